@@ -1,28 +1,168 @@
-import pandas as pd
 import re
-from difflib import get_close_matches
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify
-from flask_session import Session
+from flask import Flask, Response, g, render_template, request, session, redirect, url_for, jsonify, stream_with_context
 from datetime import timedelta, datetime
 import os
+import csv
+import io
+import hashlib
+import threading
+import time
+import numpy as np
+from biochemical_index import parse_observations
+from compositions import compact_ingredients, is_missing, parse_ingredients
+from database import Database, file_version
+from metrics import Gauge, Metrics
+from organism_index import OrganismIndex, OrganismRecord, ORGANISM_COLUMN, OPTIMAL_COMPOSITION_COLUMN
+from phenotype_matrix import FEATURES, clean_param, normalize_query, parse_query_number, top_n, total_distance
+from responses import OrjsonProvider, init_compression
+from result_cache import ResultCache
+from scoring_profiles import load_profiles, select_profile
+from sessions import init_sessions
+from sharded_scoring import ShardedScorer
+from similarity_graph import SimilarityGraph, graph_path
+from snapshot import read_snapshot, snapshot_path
+from sqlite_store import read_store, write_store
 
-def load_data_safe(filepath="Centraldatabase.csv"):
-    try:
-        if not os.path.exists(filepath):
-            raise FileNotFoundError(f"Data file {filepath} is missing.")
+REQUIRED_COLUMNS = [ORGANISM_COLUMN, OPTIMAL_COMPOSITION_COLUMN]
+# Set BACDOC_SQLITE_STORE to an SQLite file (see sqlite_store.py) to cache the
+# parsed database there: the first load imports the CSV into it, and every
+# worker after that builds its in-memory index from that file instead of the CSV
+SQLITE_STORE = os.environ.get('BACDOC_SQLITE_STORE')
+DATABASE_FILE = "Centraldatabase.csv"
+
+def sqlite_store_for(filepath):
+    """SQLITE_STORE if filepath is the production CSV, else None."""
+    if SQLITE_STORE and os.path.abspath(filepath) == os.path.abspath(DATABASE_FILE):
+        return SQLITE_STORE
+    return None
+
+def build_index(filepath=DATABASE_FILE, use_snapshot=True):
+    """Compile the CSV into an OrganismIndex; raises on any problem.
+    
+    A snapshot built from the same file contents (see snapshot.py) is
+    loaded instead of parsing the CSV, without importing pandas. For the
+    production CSV with SQLITE_STORE set the store takes the snapshot's
+    place, and a CSV that had to be parsed is imported into it once it
+    passes validation.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"Data file {filepath} is missing.")
+    version = file_version(filepath)
+    index = None
+    store = sqlite_store_for(filepath) if use_snapshot else None
+    if use_snapshot:
+        index = read_store(store, version) if store else read_snapshot(snapshot_path(filepath), version)
+    parsed = index is None
+    if parsed:
+        import pandas as pd  # only needed when there is no fresh snapshot
         df = pd.read_csv(filepath)
         df.columns = df.columns.str.strip()
-        return df
+        index = OrganismIndex(df.to_dict('records'), version=version, columns=list(df.columns))
+    missing = [column for column in REQUIRED_COLUMNS if column not in index.columns]
+    if missing:
+        raise ValueError(f"Data file {filepath} is missing columns: {', '.join(missing)}")
+    if store and parsed:
+        validate_index(index)  # a rejected CSV must not replace a good store
+        try:
+            write_store(index, store)
+        except Exception as e:
+            # Serve from memory; the import is retried on the next load
+            print(f"Could not import {filepath} into {store}: {e}")
+    return index
+
+def validate_index(index):
+    if not len(index):
+        raise ValueError("Data file has no organisms.")
+    if not all(isinstance(record.name, str) and record.name.strip() for record in index):
+        raise ValueError("Data file has rows without an organism name.")
+
+def load_data_safe(filepath=DATABASE_FILE):
+    """Build a validated index, or an empty one (after printing why) on failure."""
+    try:
+        index = build_index(filepath)
+        validate_index(index)
+        return index
     except Exception as e:
         print(f"Error loading data: {e}")
-        return pd.DataFrame()  # Return empty DataFrame on failure
+        return OrganismIndex()  # Return empty index on failure
+
+# Routes read database.snapshot once per request; a background watcher swaps
+# in a rebuilt index when Centraldatabase.csv changes
+database = Database(DATABASE_FILE, build_index, validate_index)
+# Shard workers spawned from `python PHytonAILLM.py` re-run this file as
+# __mp_main__ (see sharded_scoring.py); they must not load a copy of the database
+if __name__ != '__mp_main__':
+    database.load()
+DATABASE_WATCH_INTERVAL = 2.0
+
+# Request counts and per-stage timings served at /metrics. Set
+# BACDOC_METRICS_SAMPLE_RATE below 1 to time only that fraction of requests.
+metrics = Metrics(sample_rate=float(os.environ.get('BACDOC_METRICS_SAMPLE_RATE', 1.0)))
+metrics.add(Gauge('bacdoc_database_organisms', "Organisms in the loaded database snapshot.",
+                  lambda: {(): len(database.snapshot)}))
+metrics.add(Gauge('bacdoc_database_info', "Content version of the loaded database snapshot.",
+                  lambda: {(database.snapshot.version,): 1}, ('version',)))
+metrics.add(Gauge('bacdoc_composition_cache', "Scaled-composition cache lookups since the last reload.",
+                  lambda: {('hit',): database.snapshot.composition_cache_info().hits,
+                           ('miss',): database.snapshot.composition_cache_info().misses}, ('result',)))
+# Top matches and unscaled merged media of recent unknown-organism profiles,
+# keyed on (database version, n, normalized phenotype); a volume change or a
+# repeated profile is answered by rescaling instead of rescoring
+unknown_results = ResultCache(maxsize=2048, ttl=600)
+metrics.add(Gauge('bacdoc_unknown_cache_lookups_total', "Unknown-organism result cache lookups.",
+                  lambda: {('hit',): unknown_results.hits, ('miss',): unknown_results.misses}, ('result',),
+                  kind='counter'))
+metrics.add(Gauge('bacdoc_unknown_cache_entries', "Profiles held in the unknown-organism result cache.",
+                  lambda: {(): len(unknown_results)}))
+# Weights and penalties of Equation 2. BACDOC_SCORING_PROFILES names a JSON
+# file of alternative weight sets (see scoring_profiles.py) and
+# BACDOC_SCORING_PROFILE picks the one the routes score with
+SCORING_PROFILES = load_profiles(os.environ.get('BACDOC_SCORING_PROFILES'))
+SCORING_PROFILE = select_profile(SCORING_PROFILES, os.environ.get('BACDOC_SCORING_PROFILE', 'default'))
+# Optional hard pre-filter as (temperature window °C, pH window): only organisms
+# listing a value within ±window of the query's (or none at all) are scored.
+# Set BACDOC_TEMP_WINDOW / BACDOC_PH_WINDOW to enable; unset scores everything.
+PREFILTER = tuple(float(os.environ[name]) if os.environ.get(name) else None
+                  for name in ('BACDOC_TEMP_WINDOW', 'BACDOC_PH_WINDOW'))
+# Score in BACDOC_SCORING_WORKERS processes over shared memory (see
+# sharded_scoring.py) once the database has BACDOC_SHARD_MIN_ORGANISMS
+# organisms; the default of 0 workers always scores in-process
+sharded = ShardedScorer(int(os.environ.get('BACDOC_SCORING_WORKERS', 0)),
+                        int(os.environ.get('BACDOC_SHARD_MIN_ORGANISMS', 50000)),
+                        current=lambda: database.snapshot)
+# Clients may ask /unknown_result_ajax for a score breakdown with "trace": true
+ALLOW_SCORE_TRACE = os.environ.get('BACDOC_ALLOW_SCORE_TRACE', '1') != '0'
+# The BACDOC_SIMILARITY_K nearest organisms of every organism, for
+# /similar_organisms (see similarity_graph.py), saved next to the CSV and
+# prepared in a background thread whenever the database loads or reloads.
+# After an edit of at most BACDOC_GRAPH_MAX_CHANGED rows the last graph is
+# updated; otherwise databases of up to BACDOC_GRAPH_BUILD_LIMIT organisms are
+# rebuilt. Precompile larger ones with `python bacdoc_cli.py graph`.
+SIMILARITY_K = int(os.environ.get('BACDOC_SIMILARITY_K', 5))
+GRAPH_MAX_CHANGED = int(os.environ.get('BACDOC_GRAPH_MAX_CHANGED', 100))
+GRAPH_BUILD_LIMIT = int(os.environ.get('BACDOC_GRAPH_BUILD_LIMIT', 10000))
+graph_lock = threading.Lock()
+# (index, graph) last loaded or built; the graph of a reloaded database is derived from it
+last_graph = None
+# Index the background thread is preparing a graph for
+graph_building = None
+# (index, graph file stat) of a database without a graph; retried once the file changes
+graph_unavailable = None
 
-data = load_data_safe()
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'bacdoc_secret_key'
-app.config['SESSION_TYPE'] = 'filesystem'
+app.config['SECRET_KEY'] = os.environ.get('BACDOC_SECRET_KEY', 'bacdoc_secret_key')
 app.permanent_session_lifetime = timedelta(minutes=30)
-Session(app)
+# 'memory' (default; per process, no disk I/O), 'cookie' (signed, stateless,
+# shared by all workers; set BACDOC_SECRET_KEY) or 'filesystem' (Flask-Session)
+SESSION_BACKEND = os.environ.get('BACDOC_SESSION_BACKEND', 'memory')
+init_sessions(app, SESSION_BACKEND)
+# orjson when installed; gzip/br for the scored and merged payloads (see responses.py)
+app.json = OrjsonProvider(app)
+COMPRESSED_ENDPOINTS = ('get_organism_info', 'unknown_result_ajax', 'identify_by_tests', 'bill_of_materials_api',
+                        'similar_organisms')
+init_compression(app, COMPRESSED_ENDPOINTS)
+# Layout version of "format": "compact" responses; index.html checks it before scaling locally
+COMPACT_FORMAT_VERSION = 1
 
 USER_CREDENTIALS = {'admin': 'bacdoc123'}
 BRAND_NAME = "BacDoc Microbiology Assistant"
@@ -38,102 +178,10 @@ def extract_intent(user_input):
     else:
         return 'full'
 
-def find_organism(user_input):
-    user_input = user_input.lower()
-    for org in data['Organism']:
-        if org.lower() in user_input:
-            return org
-    return None
-
-def scale_composition(comp_str, volume_ml):
-    if pd.isna(comp_str) or not comp_str.strip() or comp_str.strip().lower() == 'unknown':
-        return "No composition info available."
-    
-    if ';' in comp_str:
-        parts = comp_str.split(';')
-    else:
-        parts = comp_str.split(',')
-    
-    scaled_parts = []
-    for part in parts:
-        token = part.strip()
-        match = re.search(r'([\d\.]+)\s*([a-zA-Z%]+)', token)
-        if match:
-            num = float(match.group(1))
-            unit = match.group(2).lower()
-            
-            if unit in ['g', 'mg']:
-                scaled_num = num * volume_ml / 100
-                if 0 < scaled_num < 0.01:
-                    scaled_str = f"{scaled_num:.4f}{unit if unit == 'g' else 'g'}"
-                else:
-                    scaled_str = f"{scaled_num:.2f}{unit if unit == 'g' else 'g'}"
-                token = re.sub(r'([\d\.]+)\s*[a-zA-Z%]+', scaled_str, token, count=1)
-            elif unit in ['ml']:
-                scaled_num = num * volume_ml / 100
-                scaled_str = f"{scaled_num:.2f}ml"
-                token = re.sub(r'([\d\.]+)\s*[a-zA-Z%]+', scaled_str, token, count=1)
-            elif unit in ['l']:
-                scaled_num = num * volume_ml / 100
-                scaled_str = f"{scaled_num:.4f}l"
-                token = re.sub(r'([\d\.]+)\s*[a-zA-Z%]+', scaled_str, token, count=1)
-        scaled_parts.append(token)
-    
-    return "; ".join(scaled_parts)
-
-def parse_composition(comp_str):
-    comp_dict = {}
-    if not comp_str or pd.isna(comp_str) or comp_str.strip().lower() == 'unknown' or comp_str == "No composition info available.":
-        return comp_dict
-    
-    if ';' in comp_str:
-        parts = comp_str.split(';')
-    else:
-        parts = comp_str.split(',')
-    
-    for part in parts:
-        part = part.strip()
-        if not part:
-            continue
-        
-        # Try to match: component name + number + unit
-        match = re.search(r'([^:\d]+?)\s*:?\s*([\d\.]+)\s*([a-zA-Z%]*)', part, re.I)
-        if match:
-            name = match.group(1).strip().lower().rstrip(':').strip()
-            amount_str = match.group(2)
-            unit = match.group(3).lower() if match.group(3) else 'g'
-            
-            # Skip water and pH entries
-            if any(skip_word in name for skip_word in ['ph', 'water', 'distilled']):
-                continue
-            
-            try:
-                amount = float(amount_str)
-            except ValueError:
-                continue
-            
-            # Unit conversion
-            if unit in ['mg']:
-                amount /= 1000
-                unit = 'g'  # Convert to grams for consistency
-            elif unit in ['%']:
-                pass  # Keep as percentage
-            elif unit in ['ml', 'l']:
-                pass  # Keep ml/l units
-            else:
-                unit = 'g'  # Default to grams
-            
-            name = re.sub(r'\s+', ' ', name).strip()
-            if name and len(name) > 1:
-                comp_dict[name] = {'amount': amount, 'unit': unit}
-        else:
-            # No numeric match - this is a qualitative component (e.g., "with selective antibiotics")
-            # Add it with a special marker
-            clean_part = part.lower().strip()
-            if clean_part and len(clean_part) > 2:
-                comp_dict[clean_part] = {'amount': None, 'unit': 'supplement'}
-    
-    return comp_dict
+def find_organism(user_input, index=None):
+    if index is None:
+        index = database.snapshot
+    return index.search.find_in(user_input)
 
 def parse_temp_ph(optimal_growth_conditions):
     temp = None
@@ -147,11 +195,6 @@ def parse_temp_ph(optimal_growth_conditions):
             ph = float(ph_match.group(1))
     return temp, ph
 
-def clean_param(value):
-    if not isinstance(value, str):
-        return ''
-    return value.strip().lower()
-
 def param_match_score(row_val, user_val):
     if not user_val:
         return 0
@@ -159,140 +202,147 @@ def param_match_score(row_val, user_val):
         return 1
     return 0 if clean_param(row_val) == clean_param(user_val) else 1
 
-def get_closest_matches_extended(origin, temp_input, ph_input, aerobicity, morphology, gramnature, n=5):
-    origin_clean = clean_param(origin)
-    aerobicity_clean = clean_param(aerobicity)
-    morphology_clean = clean_param(morphology)
-    gramnature_clean = clean_param(gramnature)
-    
-    print(f"\n{'='*80}")
-    print(f"SEARCH PARAMETERS:")
-    print(f"Origin: '{origin_clean}' | Temp: {temp_input}°C | pH: {ph_input}")
-    print(f"Aerobicity: '{aerobicity_clean}' | Morphology: '{morphology_clean}' | Gram: '{gramnature_clean}'")
-    print(f"{'='*80}\n")
-    
-    # Parse user inputs
-    try:
-        temp_val = float(re.sub(r'[^\d\.]', '', str(temp_input)))
-    except Exception:
-        temp_val = None
-    try:
-        ph_val = float(re.sub(r'[^\d\.]', '', str(ph_input)))
-    except Exception:
-        ph_val = None
+def score_profile(origin, temp_input, ph_input, aerobicity, morphology, gramnature, index=None, scoring=None,
+                  prefilter=None):
+    """(per-feature distances (6, N), total distances (N,)) of every organism to one profile.
     
+    Organisms dropped by the pre-filter are left at an infinite distance.
+    """
+    if index is None:
+        index = database.snapshot
+    if scoring is None:
+        scoring = SCORING_PROFILE
+    query = (origin, temp_input, ph_input, aerobicity, morphology, gramnature)
+    selection = index.matrix.candidates([query], *(prefilter or PREFILTER))
+    # === BACDOC EQUATION 2 + FULL PENALTIES, all organisms in one batched pass ===
+    if selection is None:
+        features = index.matrix.feature_distances(*query, scoring=scoring)
+        return features, total_distance(features)
+    rows, _ = selection
+    scored = index.matrix.feature_distances(*query, scoring=scoring, rows=rows)
+    features = np.full((len(FEATURES), len(index)), np.inf)
+    features[:, rows] = scored
+    dist = np.full(len(index), np.inf)
+    dist[rows] = total_distance(scored)
+    return features, dist
+
+def get_closest_matches_extended(origin, temp_input, ph_input, aerobicity, morphology, gramnature, n=5, index=None,
+                                 scoring=None, prefilter=None):
+    if index is None:
+        index = database.snapshot
+    if sharded.applies(index):
+        query = (origin, temp_input, ph_input, aerobicity, morphology, gramnature)
+        positions = sharded.top_n(index, [query], n, scoring or SCORING_PROFILE, prefilter or PREFILTER)[0]
+        return [index.records[i] for i in positions]
+    features, dist = score_profile(origin, temp_input, ph_input, aerobicity, morphology, gramnature, index, scoring,
+                                   prefilter)
+    # Top N by distance (ascending - lower is better) without sorting every row
+    return [index.records[i] for i in top_n(dist, n)]
+
+def get_closest_matches_profiles(origin, temp_input, ph_input, aerobicity, morphology, gramnature, scorings, n=5,
+                                 index=None):
+    """{scoring profile name: top n records} for one query scored under every profile in one pass."""
+    if index is None:
+        index = database.snapshot
+    query = (origin, temp_input, ph_input, aerobicity, morphology, gramnature)
+    scorings = list(scorings)
+    dists = index.matrix.batch_profile_distances([query], scorings)[:, 0, :]
+    return {scoring.name: [index.records[i] for i in top_n(dist, n)] for scoring, dist in zip(scorings, dists)}
+
+def score_trace(profile, features, dist, positions, index=None, timings=None):
+    """Equation 2 breakdown for the matched organisms, returned when a client asks for a trace."""
+    if index is None:
+        index = database.snapshot
+    pm = index.matrix
+    temp_shown = parse_query_number(profile.get('temperature')) is not None
+    ph_shown = parse_query_number(profile.get('ph')) is not None
     matches = []
+    for idx in positions:
+        matches.append({
+            "organism": pm.names[idx],
+            "csv": {
+                "temperature": pm.temp_display[idx] if temp_shown else None,
+                "ph": pm.ph_display[idx] if ph_shown else None,
+                "origin": pm.origin.categories[pm.origin.codes[idx]],
+                "aerobicity": pm.aerobicity.categories[pm.aerobicity.codes[idx]],
+                "morphology": pm.morphology.categories[pm.morphology.codes[idx]],
+                "gram": pm.gram.categories[pm.gram.codes[idx]],
+            },
+            "scores": {feature: float(features[k, idx]) for k, feature in enumerate(FEATURES)},
+            "total": float(dist[idx]),
+        })
+    trace = {
+        "query": {field: clean_param(profile.get(field)) for field in ('origin', 'aerobicity', 'morphology', 'gram')},
+        "matches": matches,
+        "database_version": index.version,
+        "scoring_profile": SCORING_PROFILE.name,
+    }
+    trace["query"]["temperature"] = parse_query_number(profile.get('temperature'))
+    trace["query"]["ph"] = parse_query_number(profile.get('ph'))
+    if timings:
+        trace["timings_ms"] = {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+    return trace
 
-    for idx, row in data.iterrows():
-        organism_name = row.get('Organism', 'Unknown')
-        
-        # === SMART MULTI-VALUE PARSING ===
-        def parse_numeric_range(raw_value):
-            """Parse multiple values: "37,39,40,42" → [37.0, 39.0, 40.0, 42.0]"""
-            if not isinstance(raw_value, str) or not raw_value.strip():
-                return None
-            
-            values = [v.strip() for v in raw_value.split(',') if v.strip()]
-            if not values:
-                return None
-            
-            numbers = []
-            for val in values:
-                clean = re.sub(r'[^\d\.]', '', val)
-                try:
-                    numbers.append(float(clean))
-                except:
-                    pass
-            
-            return numbers if numbers else None
+PROFILE_FIELDS = ('origin', 'temperature', 'ph', 'aerobicity', 'morphology', 'gram')
 
-        def parse_category_range(raw_value):
-            """Parse categories: "Facultative anaerobe, 5% CO2" → "facultative anaerobe" """
-            if not isinstance(raw_value, str) or not raw_value.strip():
-                return ''
-            
-            first_part = raw_value.split(',')[0].strip()
-            return clean_param(first_part)
-
-        # Get CSV values using smart parsing
-        temp_csv_list = parse_numeric_range(row.get('Optimal Growth Temperature (°C)', ''))
-        ph_csv_list = parse_numeric_range(row.get('Optimal Growth pH', ''))
-        origin_csv = clean_param(str(row.get('Origin/Source', '')))
-        aerobicity_csv = parse_category_range(row.get('Optimal Growth Aerobic Conditions', ''))
-        morphology_csv = clean_param(str(row.get('Morphology', '')))
-        gram_csv = clean_param(str(row.get('Gram Nature', '')))
-        
-        # === BACDOC EQUATION 2 + FULL PENALTIES ===
-        
-        # Temperature: W1 × |ΔTemp| (Penalty=20×W1)
-        if temp_val is not None and temp_csv_list:
-            # Find closest temperature in range
-            d_temp = min(abs(temp_val - t) for t in temp_csv_list) * 5  # W1=5
-            temp_csv = f"{temp_csv_list[0]}"  # For display
-        else:
-            d_temp = 20 * 5  # Penalty × W1=100
-            temp_csv = None
-        
-        # pH: W2 × |ΔpH| (Penalty=10×W2)
-        if ph_val is not None and ph_csv_list:
-            # Find closest pH in range
-            d_ph = min(abs(ph_val - p) for p in ph_csv_list) * 5  # W2=5
-            ph_csv = f"{ph_csv_list[0]}"  # For display
-        else:
-            d_ph = 10 * 5  # Penalty × W2=50
-            ph_csv = None
-        
-        # Origin: W3 × match (Penalty=5×W3)
-        if origin_clean and origin_clean in origin_csv:
-            origin_score = 0 * 2  # Perfect match
-        elif origin_clean:  # User gave origin, CSV empty
-            origin_score = 5 * 2  # Penalty × W3=10
-        else:
-            origin_score = 1 * 2  # Mismatch
-        
-        # Aerobicity: W4 × match (Penalty=4×W4)
-        if aerobicity_clean == aerobicity_csv and aerobicity_csv:
-            aerobicity_score = 0 * 4  # Perfect match
-        elif aerobicity_csv:  # Mismatch
-            aerobicity_score = 1 * 4  # W4=4
-        else:  # No CSV data
-            aerobicity_score = 4 * 4  # Penalty × W4=16
-        
-        # Morphology: W5 × match (Penalty=3×W5)
-        if morphology_clean == morphology_csv and morphology_csv:
-            morphology_score = 0 * 2  # Perfect match
-        elif morphology_csv:  # Mismatch
-            morphology_score = 1 * 2  # W5=2
-        else:  # No CSV data
-            morphology_score = 3 * 2  # Penalty × W5=6
-        
-        # Gram: W6 × match (Penalty=3×W6)
-        if gramnature_clean == gram_csv and gram_csv:
-            gram_score = 0 * 2  # Perfect match
-        elif gram_csv:  # Mismatch
-            gram_score = 1 * 2  # W6=2
-        else:  # No CSV data
-            gram_score = 3 * 2  # Penalty × W6=6
-        
-        # Equation 2: Σ Weighted distances + Penalties
-        dist = d_temp + d_ph + origin_score + aerobicity_score + morphology_score + gram_score
-        
-        # Debug output for first 10 organisms
-        if idx < 10:
-            print(f"{organism_name[:30]:30} | CSV: T={temp_csv}, pH={ph_csv}, O='{origin_csv[:15]}', A='{aerobicity_csv[:10]}', M='{morphology_csv[:10]}', G='{gram_csv[:8]}'")
-            print(f"{'':30} | Scores: temp={d_temp:.1f}, pH={d_ph:.1f}, origin={origin_score}, aero={aerobicity_score}, morph={morphology_score}, gram={gram_score} | TOTAL={dist:.1f}")
-            print()
-        
-        matches.append((dist, row))
+def get_closest_matches_batch(profiles, n=5, block_size=32, index=None, scoring=None, prefilter=None):
+    """Closest matches for many unknown-isolate profiles.
     
-    # Sort by distance (ascending - lower is better)
-    matches.sort(key=lambda x: x[0])
-    
-    print(f"DEBUG: {organism_name} distance={dist:.1f}")  # Single debug line
+    profiles are dicts with the /unknown_result_ajax fields (origin,
+    temperature, ph, aerobicity, morphology, gram). Profiles are scored
+    against the organism matrix a block at a time, and one list of the top
+    n records is yielded per profile, in input order, as each block is done.
+    """
+    if index is None:
+        index = database.snapshot
+    if scoring is None:
+        scoring = SCORING_PROFILE
+    block_size = max(1, min(block_size, index.matrix.batch_size()))
+    block = []
+    for profile in profiles:
+        block.append(tuple(profile.get(field) for field in PROFILE_FIELDS))
+        if len(block) >= block_size:
+            yield from _top_matches_block(index, block, n, scoring, prefilter or PREFILTER)
+            block = []
+    if block:
+        yield from _top_matches_block(index, block, n, scoring, prefilter or PREFILTER)
+
+def _top_matches_block(index, queries, n, scoring, prefilter):
+    if sharded.applies(index):
+        for positions in sharded.top_n(index, queries, n, scoring, prefilter):
+            yield [index.records[i] for i in positions]
+        return
+    selection = index.matrix.candidates(queries, *prefilter)
+    if selection is None:
+        for dist in index.matrix.batch_distances(queries, scoring):
+            yield [index.records[i] for i in top_n(dist, n)]
+        return
+    # Score the union of the block's candidates, then drop each query's pruned rows
+    rows, keep = selection
+    for dist, kept in zip(index.matrix.batch_distances(queries, scoring, rows), keep):
+        yield [index.records[i] for i in rows[top_n(np.where(kept, dist, np.inf), n)]]
 
+
+def score_tests(observations, profile=None, index=None):
+    """Distances from observed biochemical test results, plus the phenotype distance if a profile is given.
     
-    # Return top N matches
-    return [m[1] for m in matches[:n]]
+    observations is {test name: outcome} (see biochemical_index.parse_observations).
+    Returns (distances (N,), encoded query, names not in the test vocabulary).
+    """
+    if index is None:
+        index = database.snapshot
+    positive, known, unrecognized = index.biochemical.encode(observations)
+    dist = index.biochemical.distances(positive, known)
+    if profile is not None:
+        _, phenotype = score_profile(*(profile.get(field) for field in PROFILE_FIELDS), index=index)
+        dist += phenotype
+    return dist, (positive, known), unrecognized
+
+def get_closest_matches_tests(observations, profile=None, n=5, index=None):
+    if index is None:
+        index = database.snapshot
+    dist, _, _ = score_tests(observations, profile, index)
+    return [index.records[i] for i in top_n(dist, n)]
 
 
 def is_valid_media(row):
@@ -303,81 +353,213 @@ def is_valid_media(row):
         return comp_lower not in invalid_entries
     return False
 
-def merge_compositions_detailed(rows, volume_ml=100):
-    all_compositions = {}
-    component_sources = {}
-    colors = ['#FF6B6B', "#FFC800", "#88FF00", "#00F1D5", "#008FE8", "#BC75EB", "#FFFFFF", "#000000"]
+MERGE_COLORS = ['#FF6B6B', "#FFC800", "#88FF00", "#00F1D5", "#008FE8", "#BC75EB", "#FFFFFF", "#000000"]
+
+def hybrid_ingredients(row):
+    """(position, ingredient) pairs of row's optimal media that go into a hybrid medium."""
+    comp = row.get('Optimal Media Composition (per 100ml)', '')
+    if is_missing(comp) or not comp.strip() or comp.strip().lower() == 'unknown':
+        return []
     
+    ingredients = row.ingredients('optimal') if isinstance(row, OrganismRecord) else parse_ingredients(comp)
+    # Skip supplements without numeric amounts
+    return [(j, item) for j, item in enumerate(ingredients) if item.amount is not None and item.unit != 'supplement']
+
+def collect_compositions(rows):
+    """Per-100 ml optimal-media ingredients of rows, grouped by component.
+    
+    Volume-independent, so it can be cached and rescaled with scale_merged
+    for any volume. Supplements without numeric amounts are left out.
+    """
+    components = {}
     for i, row in enumerate(rows):
-        comp = row.get('Optimal Media Composition (per 100ml)', '')
-        if pd.isna(comp) or not comp.strip() or comp.strip().lower() == 'unknown':
-            continue
-        
-        scaled_comp = scale_composition(comp, volume_ml)
-        comp_dict = parse_composition(scaled_comp)
         organism_name = row.get('Organism', 'Unknown')
         media_name = row.get('Optimal Media', 'Unknown Media')
-        color = colors[i % len(colors)]
-        
-        for component, data in comp_dict.items():
-            # Handle new format: {'amount': X, 'unit': 'g'}
-            if isinstance(data, dict):
-                amount = data.get('amount')
-                unit = data.get('unit', 'g')
-            else:
-                # Backward compatibility: old format was just a number
-                amount = data
-                unit = 'g'
-            
-            # Skip supplements without numeric amounts
-            if amount is None or unit == 'supplement':
-                continue
-            
-            if component in all_compositions:
-                all_compositions[component]['amounts'].append(amount)
-                all_compositions[component]['unit'] = unit  # Keep the unit
-                component_sources[component].append({
-                    'organism': organism_name,
-                    'media': media_name,
-                    'amount': amount,
-                    'unit': unit,
-                    'color': color
-                })
-            else:
-                all_compositions[component] = {'amounts': [amount], 'unit': unit}
-                component_sources[component] = [{
-                    'organism': organism_name,
-                    'media': media_name,
-                    'amount': amount,
-                    'unit': unit,
-                    'color': color
-                }]
-    
-    # Average the amounts and format with units
+        color = MERGE_COLORS[i % len(MERGE_COLORS)]
+        for _, item in hybrid_ingredients(row):
+            components.setdefault(item.name, []).append((organism_name, media_name, color, item))
+    return components
+
+def scale_merged(components, volume_ml=100):
+    """collect_compositions output → (averaged compositions, per-source details) at volume_ml."""
     averaged_compositions = {}
     detailed_sources = {}
-    for component, data in all_compositions.items():
-        amounts = data['amounts']
-        unit = data['unit']
-        if amounts:
-            avg_amount = sum(amounts) / len(amounts)
-            averaged_compositions[component] = {'amount': avg_amount, 'unit': unit}
-            detailed_sources[component] = component_sources[component]
-    
+    for component, sources in components.items():
+        entries = []
+        for organism_name, media_name, color, item in sources:
+            entries.append({
+                'organism': organism_name,
+                'media': media_name,
+                'amount': item.amount * volume_ml / 100 if item.scalable else item.amount,
+                'unit': item.unit,
+                'color': color
+            })
+        # Average the amounts; the last source's unit is kept
+        amounts = [entry['amount'] for entry in entries]
+        averaged_compositions[component] = {'amount': sum(amounts) / len(amounts), 'unit': entries[-1]['unit']}
+        detailed_sources[component] = entries
     return averaged_compositions, detailed_sources
 
-def suggest_organisms(user_input, cutoff=0.6, max_suggestions=5):
-    # Get unique organism list (remove duplicates, preserve order)
-    organism_list = []
-    seen = set()
-    for org in data['Organism']:
-        if org not in seen:
-            organism_list.append(org)
-            seen.add(org)
+def merge_compositions_detailed(rows, volume_ml=100):
+    return scale_merged(collect_compositions(rows), volume_ml)
+
+def _file_stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def similarity_graph(index=None):
+    """The SimilarityGraph of index, or None while it is being prepared or if there is none.
+    
+    Never waits for a build: a missing graph is prepared in a background
+    thread (see prepare_similarity_graph), and the caller answers without
+    it meanwhile.
+    """
+    global graph_building, graph_unavailable
+    if index is None:
+        index = database.snapshot
+    with graph_lock:
+        if last_graph is not None and last_graph[0] is index:
+            return last_graph[1]
+        if graph_unavailable is not None and graph_unavailable[0] is index:
+            if graph_unavailable[1] == _file_stat(graph_path(database.filepath)):
+                return None
+            graph_unavailable = None  # e.g. precompiled with bacdoc_cli.py graph since
+        if graph_building is None:
+            graph_building = index
+            threading.Thread(target=prepare_similarity_graph, args=(index,), name='bacdoc-graph', daemon=True).start()
+        return None
+
+def graph_pending(index):
+    """Whether similarity_graph(index) returned None because the graph is still being prepared."""
+    with graph_lock:
+        return graph_unavailable is None or graph_unavailable[0] is not index
+
+def prepare_similarity_graph(index):
+    """Load, update or build the graph of index and save it; runs in the background.
+    
+    The saved graph is used when it was built from the same data and
+    settings; otherwise the graph is updated from the last one or rebuilt.
+    """
+    global last_graph, graph_building, graph_unavailable
+    path = graph_path(database.filepath)
+    graph = None
+    try:
+        graph = SimilarityGraph.load(path, index.version, SIMILARITY_K, SCORING_PROFILE)
+        if graph is None:
+            previous = last_graph
+            if previous is not None:
+                graph = previous[1].update(previous[0], index, SIMILARITY_K, SCORING_PROFILE, is_valid_media,
+                                           hybrid_ingredients, GRAPH_MAX_CHANGED)
+            if graph is None and len(index) <= GRAPH_BUILD_LIMIT:
+                graph = SimilarityGraph.build(index, SIMILARITY_K, SCORING_PROFILE, is_valid_media, hybrid_ingredients)
+            if graph is not None:
+                try:
+                    graph.save(path)
+                except OSError as e:
+                    # Serve from memory; the next process builds it again
+                    app.logger.warning("Could not save the similarity graph to %s: %s", path, e)
+    except Exception:
+        app.logger.exception("Preparing the similarity graph failed")
+    with graph_lock:
+        graph_building = None
+        if graph is not None:
+            last_graph = (index, graph)
+        else:
+            graph_unavailable = (index, _file_stat(path))
+    # Catch up with a reload that happened while this one was being prepared
+    if database.snapshot is not index:
+        similarity_graph()
+
+def graph_compositions(graph, position, index):
+    """collect_compositions of an organism's neighbours with valid media, from the graph's precomputed medium."""
+    sources, entries = graph.hybrid(position)
+    rows = [index.records[p] for p in sources]
+    components = {}
+    for slot, j in entries:
+        row = rows[slot]
+        item = row.ingredients('optimal')[j]
+        color = MERGE_COLORS[slot % len(MERGE_COLORS)]
+        components.setdefault(item.name, []).append(
+            (row.get('Organism', 'Unknown'), row.get('Optimal Media', 'Unknown Media'), color, item))
+    return rows, components
+
+def compact_merged(components):
+    """collect_compositions output → (sources, components) for the compact response format.
     
-    matches = get_close_matches(user_input, organism_list, n=max_suggestions, cutoff=cutoff)
+    sources lists every contributing {organism, media, color} once;
+    components is [[name, [[source index, amount per 100 ml, unit, scalable], ...]], ...]
+    sorted by name, from which scale_merged can be redone at any volume.
+    """
+    sources, lookup = [], {}
+    for entries in components.values():
+        for organism_name, media_name, color, _ in entries:
+            key = (organism_name, media_name, color)
+            if key not in lookup:
+                lookup[key] = len(sources)
+                sources.append({'organism': organism_name, 'media': media_name, 'color': color})
+    merged = [
+        [name, [[lookup[(o, m, c)], item.amount, item.unit, item.scalable] for o, m, c, item in components[name]]]
+        for name in sorted(components)
+    ]
+    return sources, merged
+
+def wants_compact(req):
+    return req.get('format') == 'compact'
+
+def suggest_organisms(user_input, cutoff=0.6, max_suggestions=5, index=None):
+    if index is None:
+        index = database.snapshot
+    # Same ranking as difflib.get_close_matches over the unique organism list
+    matches = index.search.close_matches(user_input, n=max_suggestions, cutoff=cutoff)
     return matches
 
+def resolve_order(order, index=None):
+    """{'organism', 'media', 'volume'} → (record, media kind, volume ml), or None if not found."""
+    if index is None:
+        index = database.snapshot
+    query = str(order.get('organism') or order.get('organism_name') or '').strip()
+    record = index.lookup(query)
+    if record is None:
+        found_org = find_organism(extract_organism_from_query(query), index) if query else None
+        if not found_org:
+            return None
+        record = index.lookup(found_org)
+    kind = 'differential' if str(order.get('media') or '').strip().lower() == 'differential' else 'optimal'
+    return record, kind, parse_volume(order.get('volume', 100))
+
+def bill_of_materials(orders, index=None):
+    """Aggregate reagent totals for a list of media orders; unknown organisms are reported back."""
+    if index is None:
+        index = database.snapshot
+    resolved = []
+    unresolved = []
+    for i, order in enumerate(orders):
+        entry = resolve_order(order, index)
+        if entry is None:
+            unresolved.append({"order": i, "organism": order.get('organism') or order.get('organism_name')})
+        else:
+            resolved.append(entry)
+    bom = index.bill_of_materials(resolved)
+    bom["unresolved"] = unresolved
+    return bom
+
+def bill_of_materials_csv(bom):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['section', 'component', 'amount', 'unit', 'orders'])
+    for item in bom['totals']:
+        writer.writerow(['total', item['component'], f"{item['amount']:.4f}", item['unit'], ''])
+    for item in bom['fixed_amounts']:
+        writer.writerow(['fixed', item['component'], item['amount'], item['unit'], item['orders']])
+    for item in bom['supplements']:
+        writer.writerow(['supplement', item['component'], '', '', item['orders']])
+    for item in bom['unresolved']:
+        writer.writerow(['unresolved', item['organism'], '', '', ''])
+    return out.getvalue()
+
 def extract_organism_from_query(user_input):
     user_input = user_input.lower()
     prefixes_to_remove = [
@@ -403,8 +585,9 @@ def login():
         username = request.form['username']
         password = request.form['password']
         if username in USER_CREDENTIALS and USER_CREDENTIALS[username] == password:
+            session.permanent = True
             session['logged_in'] = True
-            session['login_time'] = datetime.now()
+            session['login_time'] = time.time()
             return redirect(url_for('home'))
         else:
             return render_template('index.html', page='login', error='Invalid credentials')
@@ -417,26 +600,31 @@ def logout():
 
 @app.route('/get_organism_info', methods=['POST'])
 def get_organism_info():
+    timer = metrics.timer('get_organism_info')
     try:
         if 'logged_in' not in session:
             return jsonify({"success": False, "error": "Not logged in."})
         
-        data_json = request.get_json()
-        organism_input = data_json.get('organism_name', '').strip()
-        volume = data_json.get('volume', 100)
-        preserve_intent = data_json.get('preserve_intent', False)
-        original_intent = data_json.get('original_intent', None)
-        
-        if preserve_intent and original_intent:
-            intent = original_intent
-        else:
-            intent = extract_intent(organism_input)
+        with timer.stage('parse'):
+            data_json = request.get_json()
+            organism_input = data_json.get('organism_name', '').strip()
+            volume = data_json.get('volume', 100)
+            preserve_intent = data_json.get('preserve_intent', False)
+            original_intent = data_json.get('original_intent', None)
+            compact = wants_compact(data_json)
+            
+            if preserve_intent and original_intent:
+                intent = original_intent
+            else:
+                intent = extract_intent(organism_input)
         
-        org_name = extract_organism_from_query(organism_input)
-        found_org = find_organism(org_name)
+        index = database.snapshot
+        with timer.stage('select'):
+            org_name = extract_organism_from_query(organism_input)
+            found_org = find_organism(org_name, index)
         
         if found_org:
-            info = data[data['Organism'] == found_org].iloc[0]
+            info = index.lookup(found_org)
             try:
                 vol_float = float(volume)
                 if vol_float <= 0:
@@ -445,55 +633,65 @@ def get_organism_info():
                 vol_float = 100
             
             if intent == 'growth':
-                media_comp = info.get('Optimal Media Composition (per 100ml)', '')
+                media_kind = 'optimal'
                 bio_tests = []
                 show_all_fields = False
             elif intent == 'isolation':
-                media_comp = info.get('Differential Media Composition', '')
-                bio_tests = info.get('Biochemical Test', '').split(',') if info.get('Biochemical Test') else []
+                media_kind = 'differential'
+                bio_tests = info.tests
                 show_all_fields = False
             else:  # Full info when just organism name
-                media_comp = info.get('Optimal Media Composition (per 100ml)', '')
-                bio_tests = info.get('Biochemical Test', '').split(',') if info.get('Biochemical Test') else []
+                media_kind = 'optimal'
+                bio_tests = info.tests
                 show_all_fields = True
             
-            scaled_comp = scale_composition(media_comp, vol_float)
-            comp_dict = parse_composition(scaled_comp)
+            def media(kind):
+                # Compact responses carry per-100 ml amounts; the client scales them
+                if compact:
+                    return compact_ingredients(info.ingredients(kind))
+                return index.composition(info, kind, vol_float)
+            
+            with timer.stage('merge'):
+                comp_dict = media(media_kind)
             
             response_data = {
                 "organism_name": found_org,
                 "origin": info.get('Origin/Source', 'N/A'),
                 "growth_conditions": f"{info.get('Optimal Growth Temperature (°C)', 'N/A')}°C, pH {info.get('Optimal Growth pH', 'N/A')}",
                 "media_composition": comp_dict,
-                "biochemical_tests": [test.strip() for test in bio_tests if test.strip()],
+                "biochemical_tests": list(bio_tests),
                 "volume": vol_float,
                 "intent": intent,
                 "show_all_fields": show_all_fields,
                 "is_unknown": False
             }
+            if compact:
+                response_data["format"] = "compact"
+                response_data["format_version"] = COMPACT_FORMAT_VERSION
             
             if show_all_fields:
-                optimal_media = info.get('Optimal Media Composition (per 100ml)', '')
-                differential_media = info.get('Differential Media Composition', '')
-                optimal_media_dict = parse_composition(scale_composition(optimal_media, vol_float))
-                differential_media_dict = parse_composition(scale_composition(differential_media, vol_float))
+                with timer.stage('merge'):
+                    optimal_media_dict = media('optimal')
+                    differential_media_dict = media('differential')
                 response_data["optimal_media_composition"] = optimal_media_dict
                 response_data["differential_media_composition"] = differential_media_dict
                 response_data["optimal_media_name"] = info.get("Optimal Media", "")
                 response_data["differential_media_name"] = info.get("Differential Media", "")
-                response_data["biochemical_tests"] = [test.strip() for test in info.get("Biochemical Test",'').split(',') if test.strip()]
+                response_data["biochemical_tests"] = list(info.tests)
             
-            return jsonify({"success": True, "data": response_data})
+            with timer.stage('serialize'):
+                return jsonify({"success": True, "data": response_data})
         else:
-            suggestions = suggest_organisms(org_name)
-            return jsonify({
-                "success": False,
-                "error": "Organism not found. Is it an unknown organism?",
-                "suggestions": suggestions
-            })
+            with timer.stage('select'):
+                suggestions = suggest_organisms(org_name, index=index)
+            with timer.stage('serialize'):
+                return jsonify({
+                    "success": False,
+                    "error": "Organism not found. Is it an unknown organism?",
+                    "suggestions": suggestions
+                })
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        app.logger.exception("get_organism_info failed")
         return jsonify({"success": False, "error": f"Internal server error: {e}"})
 
 @app.route('/suggest_organisms', methods=['POST'])
@@ -502,44 +700,55 @@ def suggest_organisms_api():
     partial = data_json.get('partial', '').lower()
     cleaned_partial = extract_organism_from_query(partial)
     
-    # Get matching organisms and remove duplicates while preserving order
-    suggestions = []
-    seen = set()
-    for org in data['Organism']:
-        if cleaned_partial in org.lower() and org not in seen:
-            suggestions.append(org)
-            seen.add(org)
-            if len(suggestions) >= 8:
-                break
+    # Get matching organisms (deduplicated, database order preserved)
+    suggestions = database.snapshot.search.containing(cleaned_partial, limit=8)
     
     return jsonify({'suggestions': suggestions})
 
-@app.route('/unknown_result_ajax', methods=['POST'])
-def unknown_result_ajax():
-    if 'logged_in' not in session:
-        return jsonify({"success": False, "error": "Not logged in."})
-    
-    req = request.get_json()
-    origin = req.get('origin')
-    temperature = req.get('temperature')
-    ph = req.get('ph')
-    aerobicity = req.get('aerobicity')
-    morphology = req.get('morphology')
-    gram = req.get('gram')
-    volume = req.get('volume', 100)
+@app.route('/autocomplete')
+def autocomplete():
+    partial = request.args.get('q', '')
+    cleaned_partial = extract_organism_from_query(partial.strip())
+    index = database.snapshot
+    suggestions = index.autocomplete(cleaned_partial)
     
+    # Repeated keystrokes revalidate against the database version instead of recomputing;
+    # no-cache makes clients revalidate every time, so a reloaded database shows up at once
+    response = jsonify({'suggestions': list(suggestions)})
+    query_hash = hashlib.sha1(cleaned_partial.encode('utf-8')).hexdigest()[:12]
+    response.set_etag(f"{index.version}-{query_hash}")
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def parse_volume(volume):
     try:
         vol_float = float(volume)
         if vol_float <= 0:
             vol_float = 100
     except Exception:
         vol_float = 100
+    return vol_float
+
+def build_unknown_result(profile, matched_rows, vol_float, components=None, compact=False):
+    """Hybrid-media response for one unknown-organism profile and its closest matches.
     
-    matched_rows = get_closest_matches_extended(origin, temperature, ph, aerobicity, morphology, gram, n=5)
+    components is collect_compositions of the matches with valid media,
+    when the caller already has it (e.g. from the result cache). compact
+    returns the per-100 ml compact_merged layout instead of amounts
+    scaled to vol_float.
+    """
+    origin = profile.get('origin')
+    temperature = profile.get('temperature')
+    ph = profile.get('ph')
+    aerobicity = profile.get('aerobicity')
+    morphology = profile.get('morphology')
+    gram = profile.get('gram')
     valid_rows = [row for row in matched_rows if is_valid_media(row)]
     
     if valid_rows:
-        merged_dict, detailed_sources = merge_compositions_detailed(valid_rows, vol_float)
+        if components is None:
+            components = collect_compositions(valid_rows)
         contributors = []
         for i, row in enumerate(valid_rows[:5]):
             org = row.get('Organism', 'Unknown')
@@ -554,8 +763,6 @@ def unknown_result_ajax():
             "organism_name": f"Unknown Organism (based on {len(valid_rows)} similar organisms)",
             "origin": f"User input: {origin}",
             "growth_conditions": f"{temperature}°C, pH {ph}, {aerobicity}, {morphology}, {gram}",
-            "media_composition": merged_dict,
-            "component_sources": detailed_sources,
             "contributors": contributors,
             "biochemical_tests": [],
             "volume": vol_float,
@@ -563,22 +770,272 @@ def unknown_result_ajax():
             "show_all_fields": False,
             "is_unknown": True
         }
-        return jsonify({"success": True, "data": response_data})
+        if compact:
+            sources, merged = compact_merged(components)
+            response_data.update({"media_composition": merged, "sources": sources, "format": "compact",
+                                  "format_version": COMPACT_FORMAT_VERSION})
+        else:
+            merged_dict, detailed_sources = scale_merged(components, vol_float)
+            response_data.update({"media_composition": merged_dict, "component_sources": detailed_sources})
+        return {"success": True, "data": response_data}
+    else:
+        return {"success": False, "error": "No suitable media found for these parameters."}
+
+@app.route('/unknown_result_ajax', methods=['POST'])
+def unknown_result_ajax():
+    if 'logged_in' not in session:
+        return jsonify({"success": False, "error": "Not logged in."})
+    
+    timer = metrics.timer('unknown_result_ajax')
+    index = database.snapshot
+    with timer.stage('parse'):
+        req = request.get_json()
+        vol_float = parse_volume(req.get('volume', 100))
+        trace = ALLOW_SCORE_TRACE and req.get('trace') is True
+        query = tuple(req.get(field) for field in PROFILE_FIELDS)
+        key = (index.version, 5, normalize_query(*query))
+    
+    # Traces need the per-feature scores, so they always rescore
+    cached = None if trace else unknown_results.get(key)
+    if cached is not None:
+        positions, components = cached
+        matched_rows = [index.records[i] for i in positions]
     else:
-        return jsonify({"success": False, "error": "No suitable media found for these parameters."})
+        if not trace and sharded.applies(index):
+            with timer.stage('score'):
+                positions = sharded.top_n(index, [query], 5, SCORING_PROFILE, PREFILTER)[0]
+        else:
+            with timer.stage('score'):
+                features, dist = score_profile(*query, index=index)
+            with timer.stage('select'):
+                positions = top_n(dist, 5)
+        matched_rows = [index.records[i] for i in positions]
+        with timer.stage('merge'):
+            components = collect_compositions([row for row in matched_rows if is_valid_media(row)])
+        unknown_results.put(key, (tuple(positions.tolist()), components))
+    with timer.stage('merge'):
+        result = build_unknown_result(req, matched_rows, vol_float, components, compact=wants_compact(req))
+    if trace:
+        result["trace"] = score_trace(req, features, dist, positions, index, timer.timings)
+    with timer.stage('serialize'):
+        return jsonify(result)
+
+@app.route('/unknown_batch', methods=['POST'])
+def unknown_batch():
+    """Score a plate of unknown isolates at once; streams one NDJSON line per isolate."""
+    if 'logged_in' not in session:
+        return jsonify({"success": False, "error": "Not logged in."})
+    
+    timer = metrics.timer('unknown_batch')
+    with timer.stage('parse'):
+        req = request.get_json(silent=True) or {}
+        profiles = req.get('profiles')
+        if not isinstance(profiles, list) or not all(isinstance(p, dict) for p in profiles):
+            return jsonify({"success": False, "error": "'profiles' must be a list of phenotype objects."})
+        default_volume = req.get('volume', 100)
+        compact = wants_compact(req)
+        try:
+            n = min(max(int(req.get('n', 5)), 1), 50)
+        except (TypeError, ValueError):
+            n = 5
+    
+    index = database.snapshot
+    
+    def generate():
+        # Stages are observed per isolate; 'score' includes top-n selection
+        matches = get_closest_matches_batch(profiles, n=n, index=index)
+        for i, profile in enumerate(profiles):
+            with timer.stage('score'):
+                matched_rows = next(matches)
+            with timer.stage('merge'):
+                vol_float = parse_volume(profile.get('volume', default_volume))
+                result = build_unknown_result(profile, matched_rows, vol_float, compact=compact)
+            result["index"] = i
+            result["matches"] = [row.get('Organism', 'Unknown') for row in matched_rows]
+            with timer.stage('serialize'):
+                line = app.json.dumps(result) + "\n"
+            yield line
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/identify_by_tests', methods=['POST'])
+def identify_by_tests():
+    """Rank organisms by agreement with observed biochemical test results.
+    
+    Phenotype fields (as for /unknown_result_ajax) sent along are scored too
+    and their Equation 2 distance is added.
+    """
+    if 'logged_in' not in session:
+        return jsonify({"success": False, "error": "Not logged in."})
+    
+    timer = metrics.timer('identify_by_tests')
+    with timer.stage('parse'):
+        req = request.get_json(silent=True) or {}
+        try:
+            observations = parse_observations(req.get('tests'))
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)})
+        try:
+            n = min(max(int(req.get('n', 5)), 1), 50)
+        except (TypeError, ValueError):
+            n = 5
+        profile = req if any(req.get(field) for field in PROFILE_FIELDS) else None
+    
+    index = database.snapshot
+    with timer.stage('score'):
+        dist, (positive, known), unrecognized = score_tests(observations, profile, index)
+    if not known.any() and profile is None:
+        return jsonify({"success": False, "error": "None of the submitted tests are recorded in the database.",
+                        "unrecognized_tests": unrecognized})
+    with timer.stage('select'):
+        positions = top_n(dist, n)
+        agreeing, contradicting, untested = index.biochemical.compare(positive, known)
+        matches = [{
+            "organism": index.records[i].name,
+            "agreeing": int(agreeing[i]),
+            "contradicting": int(contradicting[i]),
+            "untested": int(untested[i]),
+            "contradicted_tests": index.biochemical.contradictions(i, positive, known),
+            "distance": float(dist[i]),
+        } for i in positions]
+    with timer.stage('serialize'):
+        return jsonify({
+            "success": True,
+            "matches": matches,
+            "tests_compared": sum(1 for name, outcome in observations.items()
+                                  if outcome is not None and name in index.biochemical.lookup),
+            "unrecognized_tests": unrecognized,
+            "phenotype_scored": profile is not None,
+        })
+
+@app.route('/similar_organisms', methods=['POST'])
+def similar_organisms():
+    """Nearest organisms to a known one and the hybrid medium of their optimal media.
+    
+    Served from the precomputed similarity graph: neighbours are ranked by
+    Equation 2 from the organism's first listed temperature and pH, and
+    organisms of the same name are left out.
+    """
+    if 'logged_in' not in session:
+        return jsonify({"success": False, "error": "Not logged in."})
+    
+    timer = metrics.timer('similar_organisms')
+    with timer.stage('parse'):
+        req = request.get_json(silent=True) or {}
+        org_name = extract_organism_from_query(str(req.get('organism_name', '')).strip())
+        vol_float = parse_volume(req.get('volume', 100))
+        compact = wants_compact(req)
+    
+    index = database.snapshot
+    with timer.stage('select'):
+        found_org = find_organism(org_name, index)
+        if not found_org:
+            return jsonify({
+                "success": False,
+                "error": "Organism not found.",
+                "suggestions": suggest_organisms(org_name, index=index)
+            })
+        graph = similarity_graph(index)
+        if graph is None:
+            if graph_pending(index):
+                return jsonify({"success": False, "pending": True,
+                                "error": "The similarity graph is still being prepared; retry shortly."})
+            return jsonify({"success": False,
+                            "error": "No similarity graph for this database; run `python bacdoc_cli.py graph`."})
+        position = index.lookup(found_org).position
+        positions, distances = graph.neighbours(position)
+        similar = [
+            {"organism": index.records[p].name, "distance": d,
+             "media": index.records[p].get('Optimal Media', ''), "has_media": is_valid_media(index.records[p])}
+            for p, d in zip(positions.tolist(), distances.tolist())
+        ]
+    
+    with timer.stage('merge'):
+        rows, components = graph_compositions(graph, position, index)
+        response_data = {
+            "organism_name": found_org,
+            "similar_organisms": similar,
+            "volume": vol_float,
+        }
+        if compact:
+            sources, merged = compact_merged(components)
+            response_data.update({"media_composition": merged, "sources": sources, "format": "compact",
+                                  "format_version": COMPACT_FORMAT_VERSION})
+        else:
+            merged_dict, detailed_sources = scale_merged(components, vol_float)
+            response_data.update({"media_composition": merged_dict, "component_sources": detailed_sources})
+        response_data["contributors"] = [
+            {'organism': row.get('Organism', 'Unknown'), 'media': row.get('Optimal Media', 'Unknown Media'),
+             'color': MERGE_COLORS[i % len(MERGE_COLORS)]}
+            for i, row in enumerate(rows)
+        ]
+    
+    with timer.stage('serialize'):
+        return jsonify({"success": True, "data": response_data})
+
+@app.route('/bill_of_materials', methods=['POST'])
+def bill_of_materials_api():
+    if 'logged_in' not in session:
+        return jsonify({"success": False, "error": "Not logged in."})
+    
+    timer = metrics.timer('bill_of_materials_api')
+    with timer.stage('parse'):
+        req = request.get_json(silent=True) or {}
+        orders = req.get('orders')
+        if not isinstance(orders, list) or not all(isinstance(o, dict) for o in orders):
+            return jsonify({"success": False, "error": "'orders' must be a list of {organism, media, volume} objects."})
+    
+    with timer.stage('merge'):
+        bom = bill_of_materials(orders, database.snapshot)
+    with timer.stage('serialize'):
+        if req.get('format') == 'csv':
+            return Response(bill_of_materials_csv(bom), mimetype='text/csv',
+                            headers={'Content-Disposition': 'attachment; filename=bill_of_materials.csv'})
+        return jsonify({"success": True, "data": bom})
+
+@app.route('/metrics')
+def metrics_api():
+    """Prometheus text exposition of this process's metrics."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def count_request(response):
+    route = request.endpoint or 'unmatched'
+    metrics.requests.inc(route, str(response.status_code))
+    start = g.get('request_start')
+    if start is not None:
+        metrics.request_seconds.observe(time.perf_counter() - start, route)
+    return response
+
+@app.before_request
+def watch_database():
+    # Started lazily so importing this module (e.g. from the CLI) spawns no threads
+    if not database.watching:
+        database.watch(DATABASE_WATCH_INTERVAL)
+    # Starts preparing the similarity graph of a newly loaded database, off the request path
+    similarity_graph(database.snapshot)
 
 @app.before_request
 def make_session_permanent():
-    session.permanent = True
+    # Only logged-in sessions are touched, and only written when something
+    # changes, so anonymous calls (autocomplete) never create a session
     if 'logged_in' in session:
+        if not session.permanent:
+            session.permanent = True
         login_time = session.get('login_time')
+        if isinstance(login_time, datetime):  # sessions stored before timestamps
+            login_time = login_time.timestamp()
         if login_time:
-            elapsed = datetime.now() - login_time
-            if elapsed > app.permanent_session_lifetime:
+            elapsed = time.time() - login_time
+            if elapsed > app.permanent_session_lifetime.total_seconds():
                 session.clear()
                 return redirect(url_for('login'))
         else:
-            session['login_time'] = datetime.now()
+            session['login_time'] = time.time()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
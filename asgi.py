@@ -0,0 +1,289 @@
+"""Production ASGI entry point for BacDoc.
+
+Serves the Flask app through any ASGI server:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+    python asgi.py --port 5000          # the same, if uvicorn is installed
+
+Each request runs the existing Flask routes in a worker thread. Scoring
+routes (unknown-organism matching, batches, identification by biochemical
+tests, bills of materials) get their own small pool, so a plate of
+isolates being scored never queues the autocomplete and lookup requests
+behind it. Each pool admits a bounded
+number of requests. Beyond that it answers 503 with Retry-After
+straight away instead of queueing without limit, and a request that
+does not start its response within the pool's timeout gets a 504.
+"""
+import argparse
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Gauge
+
+if __name__ != '__mp_main__':
+    # Shard workers re-run the script that started them as __mp_main__ (see
+    # sharded_scoring.py); they need none of the app
+    import PHytonAILLM as bacdoc
+
+# Routes whose work is dominated by phenotype scoring or media merging
+HEAVY_PATHS = ('/unknown_result_ajax', '/unknown_batch', '/identify_by_tests', '/bill_of_materials',
+               '/similar_organisms')
+MAX_BODY_BYTES = 16 * 1024 * 1024
+STREAM_BUFFER_CHUNKS = 16
+
+
+class _Abandoned(Exception):
+    """Raised in a worker whose client is gone or timed out."""
+
+
+class WorkerPool:
+    """Thread pool with admission control: at most max_pending requests running or queued."""
+
+    def __init__(self, name, workers, max_pending, timeout):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'bacdoc-{name}')
+        self.pending = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def admit(self):
+        # admit and release run on the event loop thread only, so no lock is needed
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return False
+        self.pending += 1
+        return True
+
+    def release(self):
+        self.pending -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _environ(scope, body):
+    """PEP 3333 environ for an ASGI HTTP scope."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': str(client[0]),
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            # Cookies split across several headers are joined as one Cookie header would list them
+            separator = '; ' if key == 'HTTP_COOKIE' else ','
+            environ[key] = f"{environ[key]}{separator}{value}" if key in environ else value
+    return environ
+
+
+async def _send_error(send, status, message, headers=()):
+    body = message.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8'),
+                    (b'content-length', str(len(body)).encode('ascii')), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class PooledWSGI:
+    """ASGI application running a WSGI app in bounded worker pools."""
+
+    def __init__(self, wsgi_app, light, heavy, heavy_paths=HEAVY_PATHS):
+        self.wsgi_app = wsgi_app
+        self.light = light
+        self.heavy = heavy
+        self.heavy_paths = heavy_paths
+
+    def pool_for(self, path):
+        return self.heavy if path.startswith(self.heavy_paths) else self.light
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if len(body) > MAX_BODY_BYTES:
+                return await _send_error(send, 413, "Request body too large.")
+            if not message.get('more_body'):
+                break
+
+        pool = self.pool_for(scope['path'])
+        if not pool.admit():
+            return await _send_error(send, 503, "Server busy, retry shortly.", [(b'retry-after', b'1')])
+        try:
+            environ = _environ(scope, bytes(body))
+        except Exception:
+            pool.release()
+            raise
+        await self._run(pool, environ, send)
+
+    async def _run(self, pool, environ, send):
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+        chunks = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+        abandoned = threading.Event()
+
+        def put(item):
+            if abandoned.is_set():
+                raise _Abandoned()
+            # Blocks the worker thread while the client is slower than the generator
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+        def write(data):
+            # PEP 3333 write callable for apps that push body data before returning
+            if data:
+                put(bytes(data))
+
+        def start_response(status, headers, exc_info=None):
+            code = int(status.split(' ', 1)[0])
+            raw = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            loop.call_soon_threadsafe(lambda: started.done() or started.set_result((code, raw)))
+            return write
+
+        def work():
+            try:
+                result = self.wsgi_app(environ, start_response)
+            except _Abandoned:
+                return
+            try:
+                # Every chunk goes out as soon as the app yields it, e.g. each
+                # /unknown_batch isolate as soon as it is scored
+                for chunk in result:
+                    if chunk:
+                        put(chunk)
+            except _Abandoned:
+                pass
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+                # End the body, also when the generator failed part way
+                try:
+                    put(None)
+                except _Abandoned:
+                    pass
+
+        def abandon():
+            # Unblock a worker waiting on a full queue; its next put stops it
+            abandoned.set()
+            while not chunks.empty():
+                chunks.get_nowait()
+
+        task = loop.run_in_executor(pool.executor, work)
+        # The pool slot is held for as long as the worker runs, even after a 504
+        task.add_done_callback(lambda _: pool.release())
+        await asyncio.wait({started, task}, timeout=pool.timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not started.done():
+            if task.done():
+                task.exception()
+                return await _send_error(send, 500, "Internal server error.")
+            pool.timed_out += 1
+            abandon()
+            return await _send_error(send, 504, "Request timed out.")
+
+        code, headers = started.result()
+        try:
+            await send({'type': 'http.response.start', 'status': code, 'headers': headers})
+            finished = False
+            while not finished:
+                # Chunks already waiting (the client was slower than the app) go out
+                # together; nothing is held back waiting for more
+                parts = [await chunks.get()]
+                while parts[-1] is not None and not chunks.empty():
+                    parts.append(chunks.get_nowait())
+                finished = parts[-1] is None
+                body = b''.join(parts[:-1] if finished else parts)
+                if body:
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            abandon()
+        await task
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.light.shutdown()
+                self.heavy.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+# Pools of the most recently created app, as reported on /metrics
+_pools = []
+
+
+def _add_pool_gauges():
+    bacdoc.metrics.add(Gauge('bacdoc_pool_pending', "Requests running or queued per worker pool.",
+                             lambda: {(p.name,): p.pending for p in _pools}, ('pool',)))
+    bacdoc.metrics.add(Gauge('bacdoc_pool_rejected_total', "Requests refused with 503 per worker pool.",
+                             lambda: {(p.name,): p.rejected for p in _pools}, ('pool',), kind='counter'))
+    bacdoc.metrics.add(Gauge('bacdoc_pool_timeouts_total', "Requests answered with 504 per worker pool.",
+                             lambda: {(p.name,): p.timed_out for p in _pools}, ('pool',), kind='counter'))
+
+
+def create_app(light_workers=16, heavy_workers=2, max_pending=64, heavy_max_pending=8,
+               timeout=10.0, heavy_timeout=30.0):
+    light = WorkerPool('light', light_workers, max_pending, timeout)
+    heavy = WorkerPool('heavy', heavy_workers, heavy_max_pending, heavy_timeout)
+    _pools[:] = (light, heavy)
+    return PooledWSGI(bacdoc.app, light, heavy)
+
+
+if __name__ != '__mp_main__':
+    _add_pool_gauges()
+    app = create_app()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve BacDoc over ASGI with uvicorn")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args(argv)
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("uvicorn is not installed: pip install uvicorn (or run asgi:app under any ASGI server)")
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""Offline media planning from the command line.
+
+Reads a CSV or JSONL file where each row is either a known organism
+(``organism`` column, optional ``media`` = optimal/differential) or an
+unknown-isolate phenotype profile (origin, temperature, ph, aerobicity,
+morphology, gram), each with an optional ``volume`` in ml, and writes the
+scaled media for every row without going through the web app.
+
+    python bacdoc_cli.py plan week.csv -o plan.jsonl
+    python bacdoc_cli.py plan plates.jsonl -o plan.csv --workers 4
+
+``bom`` totals the reagents for a file of (organism, media, volume) orders:
+
+    python bacdoc_cli.py bom week.csv -o reagents.csv
+
+``snapshot`` precompiles the database so the app starts without pandas
+(rerun it whenever the CSV changes; a stale snapshot is ignored):
+
+    python bacdoc_cli.py snapshot
+
+``store`` imports the database into an SQLite parse cache instead (see
+sqlite_store.py), for workers started with BACDOC_SQLITE_STORE:
+
+    python bacdoc_cli.py store -o /srv/bacdoc/organisms.sqlite
+
+``graph`` builds the similarity graph behind /similar_organisms (see
+similarity_graph.py), for databases too large to build it on first use:
+
+    python bacdoc_cli.py graph
+
+``sweep`` scores isolates of known identity (an ``organism`` column plus
+the phenotype columns) under every scoring profile of a JSON file (see
+scoring_profiles.py) and reports how often each one ranks the right
+organism first and in the top n:
+
+    python bacdoc_cli.py sweep isolates.csv --profiles weights.json
+
+``evaluate`` runs a leave-one-out check over the database itself (see
+evaluation.py), optionally with noisy or missing query fields:
+
+    python bacdoc_cli.py evaluate --temp-noise 2 --missing 0.2 --level genus
+
+Rows are read, planned and written a chunk at a time, so memory stays
+bounded by the chunk size whatever the input length.
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+if __name__ != '__mp_main__':
+    # Shard workers re-run the script that started them as __mp_main__ (see
+    # sharded_scoring.py); they need none of the app
+    import PHytonAILLM as bacdoc
+from evaluation import LEVELS, holdout_queries, leave_one_out
+from phenotype_matrix import rank_of
+from scoring_profiles import load_profiles
+from similarity_graph import SimilarityGraph, graph_path
+from snapshot import snapshot_path, write_snapshot
+from sqlite_store import store_path, write_store
+
+CSV_FIELDS = ['row', 'query', 'organism', 'media', 'volume', 'component', 'amount', 'unit', 'error']
+
+
+def read_rows(path, input_format=None):
+    """Yield input rows as dicts from a CSV or JSONL file ('-' for stdin)."""
+    input_format = input_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    f = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+    try:
+        if input_format == 'jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                yield {key.strip(): value for key, value in row.items() if key}
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def chunked(rows, size):
+    """(row number, row) lists of up to size rows."""
+    numbered = enumerate(rows)
+    while True:
+        chunk = list(islice(numbered, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def plan_named(i, row, default_volume, index):
+    query = str(row.get('organism') or '').strip() or str(row.get('organism_name') or '').strip()
+    volume = bacdoc.parse_volume(row.get('volume') or default_volume)
+    org_name = bacdoc.extract_organism_from_query(query)
+    found_org = bacdoc.find_organism(org_name, index)
+    if not found_org:
+        return {"row": i, "query": query, "success": False, "error": "Organism not found.",
+                "suggestions": bacdoc.suggest_organisms(org_name, index=index)}
+
+    kind = 'differential' if str(row.get('media', '')).strip().lower() == 'differential' else 'optimal'
+    record = index.lookup(found_org)
+    media_name = record.get('Differential Media' if kind == 'differential' else 'Optimal Media', '')
+    return {
+        "row": i,
+        "query": query,
+        "success": True,
+        "organism": found_org,
+        "media": media_name,
+        "media_kind": kind,
+        "volume": volume,
+        "media_composition": index.composition(record, kind, volume),
+    }
+
+
+def filled(row, fields):
+    return any(str(row.get(field) or '').strip() for field in fields)
+
+
+def plan_chunk(chunk, default_volume=100):
+    """Plan one chunk of (row number, row) pairs; profile rows are scored as one batch.
+
+    Rows with neither an organism nor any phenotype field (e.g. a blank CSV
+    line) are reported as empty rather than scored.
+    """
+    index = bacdoc.database.snapshot
+    results = [None] * len(chunk)
+    profile_slots = []
+    for k, (i, row) in enumerate(chunk):
+        if filled(row, ('organism', 'organism_name')):
+            results[k] = plan_named(i, row, default_volume, index)
+        elif not filled(row, bacdoc.PROFILE_FIELDS):
+            results[k] = {"row": i, "success": False, "error": "Empty row."}
+        else:
+            profile_slots.append(k)
+
+    profiles = [chunk[k][1] for k in profile_slots]
+    for k, matched_rows in zip(profile_slots, bacdoc.get_closest_matches_batch(profiles, index=index)):
+        i, row = chunk[k]
+        volume = bacdoc.parse_volume(row.get('volume') or default_volume)
+        result = bacdoc.build_unknown_result(row, matched_rows, volume)
+        result["row"] = i
+        result["matches"] = [r.get('Organism', 'Unknown') for r in matched_rows]
+        results[k] = result
+    return results
+
+
+def use_database(filepath):
+    """Plan against another CSV than the one the app loaded at import."""
+    bacdoc.SQLITE_STORE = None  # never import another CSV into the production store
+    if not bacdoc.database.use(filepath):
+        raise SystemExit(f"Could not load {filepath}: {bacdoc.database.last_error}")
+
+
+def plan(rows, default_volume=100, chunk_size=256, workers=0, database=None):
+    """Yield one result per input row, in input order.
+
+    With workers > 0 chunks are planned in a process pool, keeping at most
+    two chunks per worker in flight.
+    """
+    if database:
+        use_database(database)
+    chunks = chunked(rows, chunk_size)
+    if workers <= 0:
+        for chunk in chunks:
+            yield from plan_chunk(chunk, default_volume)
+        return
+
+    initializer, initargs = (use_database, (database,)) if database else (None, ())
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(plan_chunk, chunk, default_volume))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def write_jsonl(results, out):
+    for result in results:
+        out.write(json.dumps(result) + "\n")
+
+
+def write_csv(results, out):
+    """One line per ingredient, ready for a prep sheet."""
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    for result in results:
+        base = {'row': result['row'], 'query': result.get('query', '')}
+        if not result.get('success'):
+            writer.writerow({**base, 'error': result.get('error', '')})
+            continue
+        data = result.get('data', result)
+        organism = result.get('organism') or ', '.join(result.get('matches', []))
+        for component, entry in data['media_composition'].items():
+            writer.writerow({
+                **base,
+                'organism': organism,
+                'media': result.get('media', 'hybrid'),
+                'volume': data['volume'],
+                'component': component,
+                'amount': '' if entry['amount'] is None else entry['amount'],
+                'unit': entry['unit'],
+            })
+
+
+def bill_of_materials(args):
+    if args.database:
+        use_database(args.database)
+    bom = bacdoc.bill_of_materials(list(read_rows(args.input, args.input_format)))
+    output_format = args.format or ('csv' if args.output.endswith('.csv') else 'json')
+    text = bacdoc.bill_of_materials_csv(bom) if output_format == 'csv' else json.dumps(bom, indent=2) + "\n"
+    if args.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w', newline='', encoding='utf-8') as out:
+            out.write(text)
+
+
+def compile_snapshot(args):
+    filepath = args.database or bacdoc.database.filepath
+    try:
+        index = bacdoc.build_index(filepath, use_snapshot=False)
+        bacdoc.validate_index(index)
+        directory = write_snapshot(index, args.output or snapshot_path(filepath))
+    except Exception as e:
+        raise SystemExit(f"Could not build a snapshot of {filepath}: {e}")
+    print(f"Wrote {directory} ({len(index)} organisms, version {index.version})", file=sys.stderr)
+
+
+def import_store(args):
+    filepath = args.database or bacdoc.database.filepath
+    path = args.output or bacdoc.sqlite_store_for(filepath) or store_path(filepath)
+    try:
+        index = bacdoc.build_index(filepath, use_snapshot=False)
+        bacdoc.validate_index(index)
+        path = write_store(index, path)
+    except Exception as e:
+        raise SystemExit(f"Could not import {filepath} into {path}: {e}")
+    print(f"Wrote {path} ({len(index)} organisms, version {index.version})", file=sys.stderr)
+
+
+def build_graph(args):
+    if args.database:
+        use_database(args.database)
+    index = bacdoc.database.snapshot
+    started = time.perf_counter()
+    graph = SimilarityGraph.build(index, bacdoc.SIMILARITY_K, bacdoc.SCORING_PROFILE, bacdoc.is_valid_media,
+                                  bacdoc.hybrid_ingredients)
+    try:
+        path = graph.save(graph_path(bacdoc.database.filepath))
+    except OSError as e:
+        raise SystemExit(f"Could not save the similarity graph: {e}")
+    print(f"Wrote {path} ({len(index)} organisms, k={graph.k}, {time.perf_counter() - started:.1f} s)",
+          file=sys.stderr)
+
+
+def resolve_isolates(rows, index):
+    """(phenotype queries, true record positions, unresolved names) for rows naming their organism."""
+    queries, positions, unresolved = [], [], []
+    for row in rows:
+        name = str(row.get('organism') or row.get('organism_name') or '').strip()
+        record = index.lookup(name) or index.lookup(bacdoc.find_organism(name, index) or '')
+        if record is None:
+            unresolved.append(name)
+            continue
+        queries.append(tuple(row.get(field) for field in bacdoc.PROFILE_FIELDS))
+        positions.append(record.position)
+    return queries, np.array(positions, dtype=np.intp), unresolved
+
+
+def sweep_ranks(queries, positions, scorings, index, block_size=256):
+    """(P, Q) rank of each isolate's true organism under each scoring profile."""
+    block_size = max(1, min(block_size, index.matrix.batch_size(scorings=len(scorings))))
+    ranks = np.empty((len(scorings), len(queries)), dtype=np.intp)
+    for start in range(0, len(queries), block_size):
+        stop = start + block_size
+        dist = index.matrix.batch_profile_distances(queries[start:stop], scorings)
+        ranks[:, start:stop] = rank_of(dist, positions[start:stop])
+    return ranks
+
+
+def sweep(args):
+    if args.database:
+        use_database(args.database)
+    try:
+        scorings = list(load_profiles(args.profiles).values())
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Could not load scoring profiles: {e}")
+    index = bacdoc.database.snapshot
+    queries, positions, unresolved = resolve_isolates(read_rows(args.input, args.input_format), index)
+    if not queries:
+        raise SystemExit("No isolate names an organism in the database.")
+
+    ranks = sweep_ranks(queries, positions, scorings, index)
+    report = {
+        "isolates": len(queries),
+        "unresolved": unresolved,
+        "top": args.top,
+        "profiles": [
+            {
+                "profile": scoring.name,
+                "top1": float((r == 1).mean()),
+                f"top{args.top}": float((r <= args.top).mean()),
+                "mean_rank": float(r.mean()),
+                **scoring.as_dict(),
+            }
+            for scoring, r in zip(scorings, ranks)
+        ],
+    }
+    # Profiles without a scored isolate (None) sort last
+    report["profiles"].sort(key=lambda entry: (entry["top1"] is None, -(entry["top1"] or 0),
+                                               entry["mean_rank"] if entry["mean_rank"] is not None else np.inf))
+    text = json.dumps(report, indent=2) + "\n"
+    if args.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            out.write(text)
+
+
+def evaluate(args):
+    if args.database:
+        use_database(args.database)
+    try:
+        scorings = list(load_profiles(args.profiles).values())
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"Could not load scoring profiles: {e}")
+    index = bacdoc.database.snapshot
+    queries = holdout_queries(index, args.temp_noise, args.ph_noise, args.missing, args.seed)
+    reports = []
+    for scoring in scorings:
+        start = time.perf_counter()
+        report = leave_one_out(index, scoring, queries, args.level, not args.include_self, args.top)
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        if not report["evaluated"]:
+            # Every organism's name is unique at this level, so no held-out query has a correct match
+            raise SystemExit(f"No organism in {bacdoc.database.filepath} shares its {args.level} name with another "
+                             f"row; use --level genus or --include-self.")
+        reports.append(report)
+        print(f"{scoring.name}: top-1 {report['top1']:.3f}, top-{args.top} {report[f'top{args.top}']:.3f}, "
+              f"mean rank {report['mean_rank']:.1f} over {report['evaluated']} organisms "
+              f"({report['seconds']} s)", file=sys.stderr)
+    text = json.dumps({
+        "database_version": index.version,
+        "noise": {"temp": args.temp_noise, "ph": args.ph_noise, "missing": args.missing, "seed": args.seed},
+        "profiles": reports,
+    }, indent=2) + "\n"
+    if args.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            out.write(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BacDoc offline media planning")
+    commands = parser.add_subparsers(dest='command', required=True)
+    plan_cmd = commands.add_parser('plan', help="plan media for every row of a CSV/JSONL file")
+    plan_cmd.add_argument('input', help="CSV or JSONL file, '-' for stdin")
+    plan_cmd.add_argument('-o', '--output', default='-', help="output file, '-' for stdout (default)")
+    plan_cmd.add_argument('--input-format', choices=['csv', 'jsonl'])
+    plan_cmd.add_argument('--format', choices=['jsonl', 'csv'],
+                          help="output format (default: from the output extension, else jsonl)")
+    plan_cmd.add_argument('--volume', type=float, default=100, help="volume in ml for rows without one")
+    plan_cmd.add_argument('--chunk-size', type=int, default=256)
+    plan_cmd.add_argument('--workers', type=int, default=0, help="process pool size (0 = in-process)")
+    plan_cmd.add_argument('--database', help="organism CSV (default: Centraldatabase.csv)")
+    bom_cmd = commands.add_parser('bom', help="total reagents for a CSV/JSONL file of media orders")
+    bom_cmd.add_argument('input', help="CSV or JSONL file of organism/media/volume rows, '-' for stdin")
+    bom_cmd.add_argument('-o', '--output', default='-', help="output file, '-' for stdout (default)")
+    bom_cmd.add_argument('--input-format', choices=['csv', 'jsonl'])
+    bom_cmd.add_argument('--format', choices=['json', 'csv'],
+                         help="output format (default: from the output extension, else json)")
+    bom_cmd.add_argument('--database', help="organism CSV (default: Centraldatabase.csv)")
+    snapshot_cmd = commands.add_parser('snapshot', help="precompile the organism CSV into a binary snapshot")
+    snapshot_cmd.add_argument('--database', help="organism CSV (default: Centraldatabase.csv)")
+    snapshot_cmd.add_argument('-o', '--output', help="snapshot directory (default: next to the CSV)")
+    store_cmd = commands.add_parser('store', help="import the organism CSV into an SQLite parse cache")
+    store_cmd.add_argument('--database', help="organism CSV (default: Centraldatabase.csv)")
+    store_cmd.add_argument('-o', '--output',
+                           help="SQLite file (default: BACDOC_SQLITE_STORE for the app's CSV, else next to the CSV)")
+    graph_cmd = commands.add_parser('graph', help="build the similarity graph of the organism CSV")
+    graph_cmd.add_argument('--database', help="organism CSV (default: Centraldatabase.csv)")
+    sweep_cmd = commands.add_parser('sweep', help="compare scoring profiles on isolates of known identity")
+    sweep_cmd.add_argument('input', help="CSV or JSONL file of organism + phenotype rows, '-' for stdin")
+    sweep_cmd.add_argument('--profiles', help="JSON file of scoring profiles (Equation 2 is always included)")
+    sweep_cmd.add_argument('--top', type=int, default=5, help="also report top-n accuracy (default 5)")
+    sweep_cmd.add_argument('-o', '--output', default='-', help="JSON report, '-' for stdout (default)")
+    sweep_cmd.add_argument('--input-format', choices=['csv', 'jsonl'])
+    sweep_cmd.add_argument('--database', help="organism CSV (default: Centraldatabase.csv)")
+    evaluate_cmd = commands.add_parser('evaluate', help="leave-one-out identification accuracy over the database")
+    evaluate_cmd.add_argument('--profiles', help="JSON file of scoring profiles (Equation 2 is always included)")
+    evaluate_cmd.add_argument('--level', choices=LEVELS, default='species',
+                              help="a match is correct at this level (default species)")
+    evaluate_cmd.add_argument('--include-self', action='store_true',
+                              help="keep each organism's own row as a candidate")
+    evaluate_cmd.add_argument('--temp-noise', type=float, default=0, help="s.d. of noise added to temperature (°C)")
+    evaluate_cmd.add_argument('--ph-noise', type=float, default=0, help="s.d. of noise added to pH")
+    evaluate_cmd.add_argument('--missing', type=float, default=0, help="probability of dropping each query field")
+    evaluate_cmd.add_argument('--seed', type=int, default=0)
+    evaluate_cmd.add_argument('--top', type=int, default=5, help="also report top-n accuracy (default 5)")
+    evaluate_cmd.add_argument('-o', '--output', default='-', help="JSON report, '-' for stdout (default)")
+    evaluate_cmd.add_argument('--database', help="organism CSV (default: Centraldatabase.csv)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'bom':
+        return bill_of_materials(args)
+    if args.command == 'snapshot':
+        return compile_snapshot(args)
+    if args.command == 'store':
+        return import_store(args)
+    if args.command == 'graph':
+        return build_graph(args)
+    if args.command == 'sweep':
+        return sweep(args)
+    if args.command == 'evaluate':
+        return evaluate(args)
+
+    output_format = args.format or ('csv' if args.output.endswith('.csv') else 'jsonl')
+    results = plan(read_rows(args.input, args.input_format), args.volume, args.chunk_size,
+                   args.workers, args.database)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+    try:
+        (write_csv if output_format == 'csv' else write_jsonl)(results, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
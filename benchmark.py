@@ -0,0 +1,382 @@
+"""Benchmarks for lookup, scoring, scaling and merging.
+
+Grows Centraldatabase.csv into synthetic databases of the requested sizes
+(new species epithets, jittered temperature/pH, the real media and
+phenotype text), loads each one through the app's normal build path and
+times the core helpers against a fixed, seeded query mix: exact names,
+typos, phenotype profiles and volume sweeps. A Flask test client then
+times the routes end to end and records their response sizes, plain and
+compressed, in the verbose and the compact (``"format": "compact"``)
+response formats.
+
+    python benchmark.py                                  # 1k and 10k organisms
+    python benchmark.py --sizes 1000 10000 100000 -o bench.json
+    python benchmark.py -o new.json --compare bench.json --threshold 1.25
+    python benchmark.py --sizes 100000 --shards 0 1 2 4     # sharded scoring (see sharded_scoring.py)
+
+The report is JSON: one entry per (benchmark, size) with per-call
+latencies in milliseconds. --compare prints the median ratio against an
+earlier report and exits with status 1 if any benchmark got slower than
+--threshold. --shards times single-query latency and plate throughput of
+the sharded scorer with each worker count, 0 being the in-process
+baseline.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+if __name__ != '__mp_main__':
+    # Shard workers re-run the script that started them as __mp_main__ (see
+    # sharded_scoring.py); they need none of the app
+    import PHytonAILLM as bacdoc
+from biochemical_index import parse_observations
+from compositions import parse_ingredients, scale_ingredients
+from organism_index import (
+    AEROBICITY_COLUMN, GRAM_COLUMN, MORPHOLOGY_COLUMN, OPTIMAL_COMPOSITION_COLUMN, ORGANISM_COLUMN,
+    ORIGIN_COLUMN, PH_COLUMN, TEMP_COLUMN,
+)
+from responses import available_encodings
+from scoring_profiles import DEFAULT_PROFILE, FEATURES, ScoringProfile
+from sharded_scoring import ShardedScorer
+
+VOLUMES = (10, 50, 100, 250, 500, 1000, 2500)
+# Temperature window (°C) for the pre-filtered scoring benchmark
+PREFILTER_TEMP_WINDOW = 3
+# Weight sweep: Equation 2 with each feature's weight doubled in turn, plus the original
+SWEEP_PROFILES = [DEFAULT_PROFILE] + [
+    ScoringProfile(f'{feature}_x2', {feature: 2 * weight})
+    for feature, weight in zip(FEATURES, DEFAULT_PROFILE.weights.tolist())
+]
+# Isolates per plate in the sharded throughput benchmark
+PLATE_SIZE = 96
+_SYLLABLES = ('ba', 'ci', 'do', 'fe', 'gu', 'la', 'mi', 'no', 'pe', 'ri', 'sa', 'tu', 'vi', 'xe', 'zo')
+
+
+def read_base(filepath):
+    with open(filepath, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, list(reader)
+
+
+def _jitter(raw_value, rng, spread, digits):
+    # "37,39" → "38,40": shift every listed value, keep the list shape
+    values = []
+    for value in str(raw_value).split(','):
+        try:
+            values.append(f"{float(value) + rng.uniform(-spread, spread):.{digits}f}")
+        except ValueError:
+            values.append(value)
+    return ','.join(values)
+
+
+def synthesize(base_rows, size, seed=0):
+    """size rows: the real rows first, then renamed and jittered copies of them."""
+    rng = random.Random(seed)
+    rows = [dict(row) for row in base_rows[:size]]
+    while len(rows) < size:
+        row = dict(rng.choice(base_rows))
+        genus = (row[ORGANISM_COLUMN].split() or ['Bacterium'])[0]
+        epithet = ''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+        row[ORGANISM_COLUMN] = f"{genus} {epithet}{len(rows)}"
+        if row.get(TEMP_COLUMN):
+            row[TEMP_COLUMN] = _jitter(row[TEMP_COLUMN], rng, 3, 0)
+        if row.get(PH_COLUMN):
+            row[PH_COLUMN] = _jitter(row[PH_COLUMN], rng, 0.5, 1)
+        rows.append(row)
+    return rows
+
+
+def write_csv(fieldnames, rows, filepath):
+    with open(filepath, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _typo(name, rng):
+    chars = list(name)
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(chars))
+        edit = rng.choice(('substitute', 'delete', 'transpose'))
+        if edit == 'substitute':
+            chars[i] = rng.choice('abcdefghijklmnopqrstuvwxyz')
+        elif edit == 'delete' and len(chars) > 3:
+            del chars[i]
+        elif i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    return ''.join(chars)
+
+
+def _first(raw_value):
+    return str(raw_value).split(',')[0].strip() if isinstance(raw_value, str) else ''
+
+
+def query_mix(index, count, seed=1):
+    """Seeded inputs for every benchmark, drawn from the loaded index."""
+    rng = random.Random(seed)
+    records = [rng.choice(index.records) for _ in range(count)]
+    profiles = []
+    for record in records:
+        profile = {
+            'origin': _first(record.get(ORIGIN_COLUMN)).lower(),
+            'temperature': _first(record.get(TEMP_COLUMN)),
+            'ph': _first(record.get(PH_COLUMN)),
+            'aerobicity': _first(record.get(AEROBICITY_COLUMN)),
+            'morphology': _first(record.get(MORPHOLOGY_COLUMN)),
+            'gram': _first(record.get(GRAM_COLUMN)),
+        }
+        # Users leave fields blank
+        for field in rng.sample(sorted(profile), rng.randint(0, 2)):
+            profile[field] = ''
+        profile['volume'] = rng.choice(VOLUMES)
+        profiles.append(profile)
+    compositions = [r.get(OPTIMAL_COMPOSITION_COLUMN) for r in records]
+    compositions = [c for c in compositions if isinstance(c, str)] or ['']
+    return {
+        'names': [rng.choice(('', 'how to grow ', 'identify ')) + r.name for r in records],
+        'typos': [_typo(r.name, rng) for r in records],
+        'prefixes': [r.name[:rng.randint(1, 6)] for r in records],
+        'profiles': profiles,
+        'compositions': compositions,
+        'volumes': [rng.choice(VOLUMES) for _ in records],
+        'records': records,
+        # The organism's own recorded test results, most of them kept
+        'tests': [[t for t in r.tests if rng.random() < 0.8] for r in records],
+    }
+
+
+def measure(fn, inputs, warmup=5):
+    """Per-call latency statistics (ms) of fn over inputs."""
+    for args in inputs[:warmup]:
+        fn(*args)
+    times = np.empty(len(inputs))
+    for i, args in enumerate(inputs):
+        start = time.perf_counter()
+        fn(*args)
+        times[i] = time.perf_counter() - start
+    times *= 1000
+    return {
+        'calls': len(inputs),
+        'mean_ms': float(times.mean()),
+        'median_ms': float(np.median(times)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'min_ms': float(times.min()),
+        'max_ms': float(times.max()),
+    }
+
+
+def core_benchmarks(index, mix):
+    """(name, fn, inputs) for the helpers, called the way the routes call them."""
+    profile_args = [
+        (p['origin'], p['temperature'], p['ph'], p['aerobicity'], p['morphology'], p['gram'])
+        for p in mix['profiles']
+    ]
+    matches = [bacdoc.get_closest_matches_extended(*args, n=5, index=index) for args in profile_args]
+    merged = [bacdoc.collect_compositions([row for row in rows if bacdoc.is_valid_media(row)]) for rows in matches]
+    # Every (record, media kind, volume) once, so most lookups miss the cache
+    swept = [(r, kind, v) for r in mix['records'][:20] for kind in ('optimal', 'differential') for v in VOLUMES]
+    return [
+        ('find_organism', lambda q: bacdoc.find_organism(bacdoc.extract_organism_from_query(q), index),
+         [(q,) for q in mix['names']]),
+        ('suggest_organisms', lambda q: bacdoc.suggest_organisms(q, index=index), [(q,) for q in mix['typos']]),
+        ('autocomplete', index._autocomplete, [(q,) for q in mix['prefixes']]),
+        ('get_closest_matches_extended', lambda *q: bacdoc.get_closest_matches_extended(*q, n=5, index=index),
+         profile_args),
+        ('get_closest_matches_prefiltered',
+         lambda *q: bacdoc.get_closest_matches_extended(*q, n=5, index=index, prefilter=(PREFILTER_TEMP_WINDOW, None)),
+         profile_args),
+        ('get_closest_matches_profiles',
+         lambda *q: bacdoc.get_closest_matches_profiles(*q, SWEEP_PROFILES, n=5, index=index), profile_args),
+        ('get_closest_matches_tests',
+         lambda tests: bacdoc.get_closest_matches_tests(parse_observations(tests), n=5, index=index),
+         [(tests,) for tests in mix['tests']]),
+        ('parse_ingredients', parse_ingredients, [(c,) for c in mix['compositions']]),
+        ('scale_ingredients', lambda r, kind, v: scale_ingredients(r.ingredients(kind), v), swept),
+        ('composition', index.composition, swept),
+        ('composition_cached', lambda r, v: index.composition(r, 'optimal', v),
+         list(zip(mix['records'], mix['volumes']))),
+        ('scale_merged', bacdoc.scale_merged, [(m, p['volume']) for m, p in zip(merged, mix['profiles'])]),
+        ('merge_compositions_detailed', lambda rows, v: bacdoc.merge_compositions_detailed(rows, v),
+         [(rows, p['volume']) for rows, p in zip(matches, mix['profiles'])]),
+    ]
+
+
+def sharded_benchmarks(scorer, index, mix):
+    """(name, fn, inputs) timing one ShardedScorer on single queries and on whole plates."""
+    queries = [tuple(p.get(field) for field in bacdoc.PROFILE_FIELDS) for p in mix['profiles']]
+    plates = [(queries[i:i + PLATE_SIZE],) for i in range(0, len(queries), PLATE_SIZE)]
+
+    def score(block):
+        return scorer.top_n(index, block, 5, bacdoc.SCORING_PROFILE, bacdoc.PREFILTER)
+
+    return [
+        (f'sharded_top_n_x{scorer.workers}', lambda query: score([query]), [(q,) for q in queries]),
+        (f'sharded_plate_x{scorer.workers}', score, plates),
+    ]
+
+
+def e2e_benchmarks(client, mix, encoding='identity'):
+    """(name, fn, inputs) for routes through the Flask test client; fn returns the body size.
+
+    encoding is sent as Accept-Encoding, so sizes can be taken compressed.
+    """
+    headers = {'Accept-Encoding': encoding}
+
+    def post(path):
+        return lambda body: len(client.post(path, json=body, headers=headers).get_data())
+
+    def get(path):
+        return lambda query: len(client.get(path, query_string={'q': query}, headers=headers).get_data())
+
+    lookups = [{'organism_name': q, 'volume': v} for q, v in zip(mix['names'], mix['volumes'])]
+    return [
+        ('e2e_get_organism_info', post('/get_organism_info'), [(body,) for body in lookups]),
+        ('e2e_get_organism_info_compact', post('/get_organism_info'),
+         [(dict(body, format='compact'),) for body in lookups]),
+        ('e2e_unknown_result_ajax', post('/unknown_result_ajax'), [(p,) for p in mix['profiles']]),
+        ('e2e_unknown_result_ajax_compact', post('/unknown_result_ajax'),
+         [(dict(p, format='compact'),) for p in mix['profiles']]),
+        ('e2e_identify_by_tests', post('/identify_by_tests'), [({'tests': tests},) for tests in mix['tests']]),
+        ('e2e_suggest_organisms', post('/suggest_organisms'), [({'partial': q},) for q in mix['prefixes']]),
+        ('e2e_autocomplete', get('/autocomplete'), [(q,) for q in mix['prefixes']]),
+    ]
+
+
+def run_size(size, fieldnames, base_rows, queries, workdir, shards=()):
+    filepath = os.path.join(workdir, f'organisms_{size}.csv')
+    write_csv(fieldnames, synthesize(base_rows, size), filepath)
+    start = time.perf_counter()
+    if not bacdoc.database.use(filepath):
+        raise SystemExit(f"Could not load synthetic database {filepath}: {bacdoc.database.last_error}")
+    build_ms = (time.perf_counter() - start) * 1000
+    index = bacdoc.database.snapshot
+    mix = query_mix(index, queries)
+
+    results = [{'benchmark': 'build_index', 'size': size, 'calls': 1, 'mean_ms': build_ms,
+                'median_ms': build_ms, 'p95_ms': build_ms, 'min_ms': build_ms, 'max_ms': build_ms}]
+    for name, fn, inputs in core_benchmarks(index, mix):
+        results.append({'benchmark': name, 'size': size, **measure(fn, inputs)})
+        print(f"{size:>8} {name:32} {results[-1]['median_ms']:10.4f} ms", file=sys.stderr)
+
+    for count in shards:
+        scorer = ShardedScorer(count, min_size=0)
+        try:
+            for name, fn, inputs in sharded_benchmarks(scorer, index, mix):
+                stats = measure(fn, inputs)
+                isolates = sum(len(args[0]) if name.startswith('sharded_plate') else 1 for args in inputs)
+                stats['isolates_per_s'] = isolates / (stats['mean_ms'] * stats['calls'] / 1000)
+                results.append({'benchmark': name, 'size': size, **stats})
+                print(f"{size:>8} {name:32} {stats['median_ms']:10.4f} ms {stats['isolates_per_s']:10.0f} isolates/s",
+                      file=sys.stderr)
+        finally:
+            scorer.close()
+
+    client = bacdoc.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'bacdoc123'})
+    compressed = {
+        encoding: {name: fn for name, fn, _ in e2e_benchmarks(client, mix, encoding)}
+        for encoding in available_encodings()
+    }
+    for name, fn, inputs in e2e_benchmarks(client, mix):
+        # Response bytes, outside the timed loop
+        sizes = [fn(*args) for args in inputs[:50]]
+        stats = measure(fn, inputs)
+        stats['mean_response_bytes'] = float(np.mean(sizes))
+        for encoding, fns in compressed.items():
+            stats[f'mean_{encoding}_bytes'] = float(np.mean([fns[name](*args) for args in inputs[:50]]))
+        results.append({'benchmark': name, 'size': size, **stats})
+        print(f"{size:>8} {name:32} {stats['median_ms']:10.4f} ms", file=sys.stderr)
+    print_payload_reduction(size, results)
+    return results
+
+
+def print_payload_reduction(size, results):
+    """Compact vs verbose response sizes of the routes that have both formats."""
+    by_name = {r['benchmark']: r for r in results}
+    for name, result in by_name.items():
+        verbose = by_name.get(name[:-len('_compact')]) if name.endswith('_compact') else None
+        if verbose is None:
+            continue
+        sizes = ', '.join(
+            f"{'plain' if key == 'mean_response_bytes' else key[5:-6]} {verbose[key]:.0f} → {result[key]:.0f} B"
+            for key in ('mean_response_bytes', *(f'mean_{e}_bytes' for e in available_encodings()))
+        )
+        print(f"{size:>8} {name[4:]:32} {sizes}", file=sys.stderr)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+    }
+
+
+def compare(old_report, new_report, threshold):
+    """Print median ratios new/old; returns the benchmarks slower than threshold."""
+    old = {(r['benchmark'], r['size']): r for r in old_report['results']}
+    regressions = []
+    print(f"{'benchmark':32} {'size':>8} {'old ms':>10} {'new ms':>10} {'ratio':>7}", file=sys.stderr)
+    for result in new_report['results']:
+        key = (result['benchmark'], result['size'])
+        if key not in old or not old[key]['median_ms']:
+            continue
+        ratio = result['median_ms'] / old[key]['median_ms']
+        flag = '  slower' if ratio > threshold else ''
+        print(f"{key[0]:32} {key[1]:>8} {old[key]['median_ms']:10.4f} {result['median_ms']:10.4f} {ratio:7.2f}{flag}", file=sys.stderr)
+        if ratio > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BacDoc performance benchmarks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="organisms per synthetic database")
+    parser.add_argument('--queries', type=int, default=200, help="queries per benchmark")
+    parser.add_argument('--database', default='Centraldatabase.csv', help="CSV the synthetic databases grow from")
+    parser.add_argument('-o', '--output', default='-', help="JSON report, '-' for stdout (default)")
+    parser.add_argument('--compare', help="earlier JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="median ratio counted as a regression")
+    parser.add_argument('--shards', type=int, nargs='*', default=[],
+                        help="also time sharded scoring with these worker counts (0 = in-process)")
+    args = parser.parse_args(argv)
+    bacdoc.SQLITE_STORE = None  # synthetic databases must never reach the production store
+
+    fieldnames, base_rows = read_base(args.database)
+    report = {'environment': environment(), 'queries': args.queries, 'results': []}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            report['results'].extend(run_size(size, fieldnames, base_rows, args.queries, workdir, args.shards))
+
+    text = json.dumps(report, indent=2) + "\n"
+    if args.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            out.write(text)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
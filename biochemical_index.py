@@ -0,0 +1,184 @@
+"""Bitset index over the Biochemical Test column, for identification by test results.
+
+Test strings are normalized to (test name, outcome) pairs:
+
+    "Catalase positive"   → ('catalase', True)
+    "Oxidase variable"    → ('oxidase', None)     outcome not fixed
+    "Non-motile"          → ('motile', False)
+    "Gram negative rod"   → ('gram negative rod', True)
+
+Every organism gets two bit vectors over the vocabulary of test names,
+packed into uint64 words: ``positive`` (the test is positive) and
+``known`` (an outcome is recorded; variable or contradictory outcomes are
+left unknown). Comparing observed results against all organisms is then
+AND/XOR plus popcount over (N, words) arrays, touching only the words
+the query has bits in.
+"""
+import re
+
+import numpy as np
+
+# Outcome words at the end of a test string; None means variable
+OUTCOMES = {
+    'positive': True, 'pos': True, '+': True, 'sensitive': True, 'susceptible': True,
+    'negative': False, 'neg': False, '-': False, 'resistant': False,
+    'variable': None, 'v': None,
+}
+# Distance per observed test that contradicts the organism's recorded outcome,
+# and per observed test the organism has no recorded outcome for
+MISMATCH_WEIGHT = 10
+UNTESTED_WEIGHT = 1
+
+_SEPARATORS = re.compile(r'[\s_-]+')
+_BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def normalize_test_name(name):
+    """"Voges-Proskauer " → "voges proskauer" """
+    return _SEPARATORS.sub(' ', name.strip().lower()).strip()
+
+
+def parse_test(text):
+    """One Biochemical Test entry → (test name, outcome), or None if empty."""
+    if not isinstance(text, str):
+        return None
+    words = text.strip().lower()
+    if not words:
+        return None
+    head, _, last = words.rpartition(' ')
+    if head and last in OUTCOMES:
+        return normalize_test_name(head), OUTCOMES[last]
+    if words.startswith(('non-', 'non ')):
+        return normalize_test_name(words[4:]), False
+    return normalize_test_name(words), True
+
+
+def parse_observations(observations):
+    """Observed results as a list of test strings or a {test: outcome} object → {name: outcome}.
+
+    Outcomes in an object may be booleans, null (variable) or outcome
+    words. Raises ValueError for anything else.
+    """
+    parsed = {}
+    if isinstance(observations, dict):
+        for name, outcome in observations.items():
+            if not isinstance(name, str) or not normalize_test_name(name):
+                raise ValueError(f"Test names must be non-empty strings, got {name!r}")
+            if isinstance(outcome, str):
+                if outcome.strip().lower() not in OUTCOMES:
+                    raise ValueError(f"Unknown outcome {outcome!r} for {name!r}; use positive, negative or variable")
+                outcome = OUTCOMES[outcome.strip().lower()]
+            elif outcome is not None and not isinstance(outcome, bool):
+                raise ValueError(f"Unknown outcome {outcome!r} for {name!r}; use positive, negative or variable")
+            parsed[normalize_test_name(name)] = outcome
+    elif isinstance(observations, list):
+        for text in observations:
+            if not isinstance(text, str):
+                raise ValueError(f"Tests must be strings such as 'Catalase positive', got {text!r}")
+            test = parse_test(text)
+            if test is not None:
+                parsed[test[0]] = test[1]
+    else:
+        raise ValueError("'tests' must be a list of results or an object of test: outcome")
+    return parsed
+
+
+def _popcount(words):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return _BYTE_COUNTS[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def _pack(bits):
+    # (N, V) bool → (N, words) uint64, bit j of the vocabulary in word j // 64
+    n, v = bits.shape
+    words = max(1, -(-v // 64))
+    packed = np.zeros((n, words * 8), dtype=np.uint8)
+    packed[:, :-(-v // 8)] = np.packbits(bits, axis=1, bitorder='little')
+    return packed.view('<u8').astype(np.uint64)
+
+
+class BiochemicalIndex:
+    """Packed positive/known bit vectors of every organism's biochemical tests."""
+
+    def __init__(self, test_lists):
+        parsed = []
+        lookup = {}
+        for tests in test_lists:
+            outcomes = {}
+            for text in tests:
+                test = parse_test(text)
+                if test is None:
+                    continue
+                name, outcome = test
+                lookup.setdefault(name, len(lookup))
+                # The same test listed with different outcomes counts as unknown
+                outcomes[name] = outcome if outcomes.get(name, outcome) == outcome else None
+            parsed.append(outcomes)
+        positive = np.zeros((len(parsed), len(lookup)), dtype=bool)
+        known = np.zeros((len(parsed), len(lookup)), dtype=bool)
+        for i, outcomes in enumerate(parsed):
+            for name, outcome in outcomes.items():
+                if outcome is not None:
+                    known[i, lookup[name]] = True
+                    positive[i, lookup[name]] = outcome
+        self._set(list(lookup), _pack(positive), _pack(known))
+
+    @classmethod
+    def from_arrays(cls, vocabulary, positive, known):
+        """Index over already packed arrays, e.g. memory-mapped from a snapshot."""
+        index = cls.__new__(cls)
+        index._set(list(vocabulary), positive, known)
+        return index
+
+    def _set(self, vocabulary, positive, known):
+        self.vocabulary = vocabulary
+        self.lookup = {name: bit for bit, name in enumerate(vocabulary)}
+        self.positive = positive
+        self.known = known
+
+    def __len__(self):
+        return len(self.vocabulary)
+
+    def encode(self, observations):
+        """{name: outcome} → (positive words, known words, names not in the vocabulary)."""
+        words = self.known.shape[1]
+        positive = np.zeros(words, dtype=np.uint64)
+        known = np.zeros(words, dtype=np.uint64)
+        unrecognized = []
+        for name, outcome in observations.items():
+            bit = self.lookup.get(name)
+            if bit is None:
+                unrecognized.append(name)
+            elif outcome is not None:
+                mask = np.uint64(1 << (bit % 64))
+                known[bit // 64] |= mask
+                if outcome:
+                    positive[bit // 64] |= mask
+        return positive, known, unrecognized
+
+    def compare(self, positive, known):
+        """(agreeing, contradicting, untested) counts per organism for an encoded query."""
+        used = np.flatnonzero(known)
+        query_known = known[used]
+        organism_known = self.known[:, used]
+        both = organism_known & query_known
+        contradicting = _popcount((self.positive[:, used] ^ positive[used]) & both).sum(axis=1, dtype=np.int64)
+        agreeing = _popcount(both).sum(axis=1, dtype=np.int64) - contradicting
+        untested = _popcount(~organism_known & query_known).sum(axis=1, dtype=np.int64)
+        return agreeing, contradicting, untested
+
+    def distances(self, positive, known):
+        """MISMATCH_WEIGHT × contradicting + UNTESTED_WEIGHT × untested per organism."""
+        _, contradicting, untested = self.compare(positive, known)
+        return (MISMATCH_WEIGHT * contradicting + UNTESTED_WEIGHT * untested).astype(float)
+
+    def contradictions(self, row, positive, known):
+        """Names of the query tests organism row has the opposite recorded outcome for."""
+        bits = (self.positive[row] ^ positive) & self.known[row] & known
+        return [self.vocabulary[bit] for bit in _bits(bits)]
+
+
+def _bits(words):
+    unpacked = np.unpackbits(words.astype('<u8').view(np.uint8), bitorder='little')
+    return np.flatnonzero(unpacked).tolist()
@@ -0,0 +1,153 @@
+import math
+import re
+from collections import namedtuple
+
+import numpy as np
+
+# Written units that scale with volume; percentages and bare counts do not
+SCALABLE_UNITS = ('g', 'mg', 'ml', 'l')
+
+_COMPONENT = re.compile(r'([^:\d]+?)\s*:?\s*([\d\.]+)\s*([a-zA-Z%]*)', re.I)
+
+Ingredient = namedtuple('Ingredient', ['name', 'amount', 'unit', 'scalable'])
+
+
+def is_missing(value):
+    """True for None and the NaN pandas uses for empty CSV cells."""
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _split_parts(comp_str):
+    if ';' in comp_str:
+        return comp_str.split(';')
+    return comp_str.split(',')
+
+def _parse_part(part):
+    """One composition token → (name, amount, unit, written_unit), or None to skip it."""
+    # Try to match: component name + number + unit
+    match = _COMPONENT.search(part)
+    if match:
+        name = match.group(1).strip().lower().rstrip(':').strip()
+        amount_str = match.group(2)
+        unit = match.group(3).lower() if match.group(3) else 'g'
+        written_unit = match.group(3).lower()
+        
+        # Skip water and pH entries
+        if any(skip_word in name for skip_word in ['ph', 'water', 'distilled']):
+            return None
+        
+        try:
+            amount = float(amount_str)
+        except ValueError:
+            return None
+        
+        # Unit conversion
+        if unit in ['mg']:
+            amount /= 1000
+            unit = 'g'  # Convert to grams for consistency
+        elif unit in ['%']:
+            pass  # Keep as percentage
+        elif unit in ['ml', 'l']:
+            pass  # Keep ml/l units
+        else:
+            unit = 'g'  # Default to grams
+        
+        name = re.sub(r'\s+', ' ', name).strip()
+        if name and len(name) > 1:
+            return name, amount, unit, written_unit
+        return None
+    
+    # No numeric match - this is a qualitative component (e.g., "with selective antibiotics")
+    # Add it with a special marker
+    clean_part = part.lower().strip()
+    if clean_part and len(clean_part) > 2:
+        return clean_part, None, 'supplement', ''
+    return None
+
+def parse_ingredients(comp_str):
+    """Parse a per-100 ml composition string once into a tuple of Ingredients.
+
+    Amounts are unit-normalized (mg → g) straight from the CSV text, so
+    rescaling with scale_ingredients never goes through formatted strings.
+    """
+    if not isinstance(comp_str, str) or not comp_str.strip() or comp_str.strip().lower() == 'unknown':
+        return ()
+    
+    ingredients = {}
+    for part in _split_parts(comp_str):
+        part = part.strip()
+        if not part:
+            continue
+        parsed = _parse_part(part)
+        if parsed:
+            name, amount, unit, written_unit = parsed
+            # Later duplicates win
+            ingredients[name] = Ingredient(name, amount, unit, written_unit in SCALABLE_UNITS)
+    return tuple(ingredients.values())
+
+def scale_ingredients(ingredients, volume_ml):
+    """Ingredients per 100 ml → {name: {'amount', 'unit'}} for volume_ml."""
+    return {
+        item.name: {
+            'amount': item.amount * volume_ml / 100 if item.scalable else item.amount,
+            'unit': item.unit,
+        }
+        for item in ingredients
+    }
+
+def compact_ingredients(ingredients):
+    """Ingredients → [[name, amount per 100 ml, unit, scalable], ...] sorted by name.
+
+    The compact response format sends these and lets the client scale
+    them as scale_ingredients would.
+    """
+    return [[item.name, item.amount, item.unit, item.scalable] for item in sorted(ingredients, key=lambda i: i.name)]
+
+class IngredientMatrix:
+    """Ingredients of many media in CSR form, for summing over orders in one pass.
+
+    Row i holds the volume-scalable ingredients of ingredient_lists[i]
+    (litres folded into ml); fixed amounts such as percentages and
+    qualitative supplements are kept per row on the side, since they do not
+    add up across media.
+    """
+
+    def __init__(self, ingredient_lists):
+        self.columns = []  # (name, unit) per column
+        lookup = {}
+        indptr, cols, vals = [0], [], []
+        self.fixed = []
+        self.supplements = []
+        for ingredients in ingredient_lists:
+            fixed, supplements = [], []
+            for item in ingredients:
+                if item.amount is None:
+                    supplements.append(item.name)
+                elif item.scalable:
+                    amount, unit = (item.amount * 1000, 'ml') if item.unit == 'l' else (item.amount, item.unit)
+                    key = (item.name, unit)
+                    if key not in lookup:
+                        lookup[key] = len(self.columns)
+                        self.columns.append(key)
+                    cols.append(lookup[key])
+                    vals.append(amount)
+                else:
+                    fixed.append((item.name, item.amount, item.unit))
+            indptr.append(len(cols))
+            self.fixed.append(tuple(fixed))
+            self.supplements.append(tuple(supplements))
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.cols = np.array(cols, dtype=np.int64)
+        self.vals = np.array(vals, dtype=np.float64)
+
+    def totals(self, rows, factors):
+        """Sum of factor × row over (row, factor) pairs → amount per column."""
+        rows = np.asarray(rows, dtype=np.int64)
+        factors = np.asarray(factors, dtype=np.float64)
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        # Flat positions of every entry of every selected row
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        entries = np.arange(counts.sum()) + offsets
+        weights = self.vals[entries] * np.repeat(factors, counts)
+        return np.bincount(self.cols[entries], weights=weights, minlength=len(self.columns))
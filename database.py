@@ -0,0 +1,110 @@
+import hashlib
+import os
+import threading
+import time
+
+from organism_index import OrganismIndex
+
+
+def file_version(filepath):
+    """Short content hash of the database file, used as its version."""
+    with open(filepath, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+class Database:
+    """The current OrganismIndex, replaced wholesale when the CSV changes.
+
+    ``snapshot`` is swapped with a single reference assignment, so a request
+    that reads it once keeps a consistent index for its whole lifetime while
+    newer requests see the rebuilt one. A rebuild that fails (unreadable
+    file, missing columns, no organisms) leaves the last good snapshot in
+    place.
+    """
+
+    def __init__(self, filepath, build, validate=None):
+        self.filepath = filepath
+        self._build = build
+        self._validate = validate
+        self._stat = None
+        self._lock = threading.Lock()
+        self._watcher = None
+        self.last_error = None
+        self.snapshot = OrganismIndex()
+
+    @property
+    def watching(self):
+        return self._watcher is not None and self._watcher.is_alive()
+
+    def _file_stat(self):
+        st = os.stat(self.filepath)
+        return st.st_mtime_ns, st.st_size
+
+    def load(self):
+        """Build from the file now; on failure keep the current snapshot and return False."""
+        with self._lock:
+            return self._rebuild()
+
+    def use(self, filepath):
+        """Point at another file and load it."""
+        with self._lock:
+            self.filepath = filepath
+            self._stat = None
+            return self._rebuild()
+
+    def refresh(self):
+        """Rebuild if the file's mtime/size changed and its content hash differs. Returns True on swap."""
+        try:
+            stat = self._file_stat()
+        except OSError as e:
+            self.last_error = e
+            return False
+        if stat == self._stat:
+            return False
+        with self._lock:
+            if stat == self._stat:
+                return False
+            try:
+                if file_version(self.filepath) == self.snapshot.version:
+                    self._stat = stat  # touched but unchanged
+                    return False
+            except OSError as e:
+                self.last_error = e
+                return False
+            return self._rebuild()
+
+    def _rebuild(self):
+        try:
+            stat = self._file_stat()
+            index = self._build(self.filepath)
+            if self._validate is not None:
+                self._validate(index)
+        except Exception as e:
+            # Remember the broken file so it is not rebuilt every tick
+            try:
+                self._stat = self._file_stat()
+            except OSError:
+                self._stat = None
+            self.last_error = e
+            print(f"Error loading data: {e}")
+            return False
+        self._stat = stat
+        self.last_error = None
+        self.snapshot = index
+        return True
+
+    def watch(self, interval=2.0):
+        """Start a daemon thread that calls refresh every interval seconds."""
+        with self._lock:
+            if self.watching:
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name='bacdoc-db-watcher', daemon=True)
+            self._watcher.start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                self.last_error = e
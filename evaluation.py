@@ -0,0 +1,129 @@
+"""Leave-one-out accuracy of unknown-organism identification.
+
+Every organism in the database becomes a query built from its own
+phenotype (first listed temperature and pH, its categories). Gaussian
+noise can be added to temperature and pH, and fields can be dropped at
+random. The query is scored against the whole database, with its own row
+removed when ``exclude_self`` is set. A match is correct when it has the
+same name as the query organism, or the same genus at ``level='genus'``.
+Queries are scored a block at a time, so memory stays bounded for large
+databases.
+"""
+import numpy as np
+
+from phenotype_matrix import FEATURES, total_distance
+from scoring_profiles import DEFAULT_PROFILE
+
+LEVELS = ('species', 'genus')
+
+
+def _label(name, level):
+    name = name.strip().lower() if isinstance(name, str) else ''
+    return name.split(' ', 1)[0] if level == 'genus' else name
+
+
+def label_codes(index, level='species'):
+    """Integer label per record: equal codes mean the same species (or genus)."""
+    lookup = {}
+    return np.array([lookup.setdefault(_label(r.name, level), len(lookup)) for r in index.records], dtype=np.intp)
+
+
+def holdout_queries(index, temp_noise=0.0, ph_noise=0.0, missing=0.0, seed=0):
+    """One (origin, temp, pH, aerobicity, morphology, gram) query per record, in database order."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for record in index.records:
+        temp = record.temp_values[0] if record.temp_values else None
+        if temp is not None and temp_noise:
+            temp += rng.normal(0, temp_noise)
+        ph = record.ph_values[0] if record.ph_values else None
+        if ph is not None and ph_noise:
+            ph += rng.normal(0, ph_noise)
+        query = [
+            record.origin,
+            # Formatted so parse_query_number reads them back unchanged
+            '' if temp is None else f"{max(temp, 0):.3f}",
+            '' if ph is None else f"{max(ph, 0):.3f}",
+            record.aerobicity, record.morphology, record.gram,
+        ]
+        if missing:
+            for k in np.flatnonzero(rng.random(len(query)) < missing):
+                query[k] = ''
+        queries.append(tuple(query))
+    return queries
+
+
+def best_correct(dist, correct):
+    """(rank, position) of the best-ranked correct record per row of dist (Q, N).
+
+    Ranks are 1-based in top_n order (ties broken by database order); rows
+    without a correct record get rank 0 and position -1.
+    """
+    masked = np.where(correct, dist, np.inf)
+    best = masked.min(axis=1)
+    has = correct.any(axis=1)
+    position = np.argmax(correct & (masked == best[:, None]), axis=1)
+    before = np.arange(dist.shape[1])[None, :] < position[:, None]
+    rank = (dist < best[:, None]).sum(axis=1) + ((dist == best[:, None]) & before).sum(axis=1) + 1
+    return np.where(has, rank, 0), np.where(has, position, -1)
+
+
+def leave_one_out(index, scoring=DEFAULT_PROFILE, queries=None, level='species', exclude_self=True,
+                  top=5, block_size=256):
+    """Accuracy report for one scoring profile; see the module docstring."""
+    if level not in LEVELS:
+        raise ValueError(f"Unknown level {level!r}; expected one of {', '.join(LEVELS)}")
+    if queries is None:
+        queries = holdout_queries(index)
+    labels = label_codes(index, level)
+    size = len(index)
+    block_size = max(1, min(block_size, index.matrix.batch_size()))
+
+    ranks = np.zeros(size, dtype=np.intp)
+    # Per-feature distance sums for the correct match and for the closest wrong one
+    correct_sums = np.zeros(len(FEATURES))
+    wrong_sums = np.zeros(len(FEATURES))
+    wrong_count = 0
+    for start in range(0, size, block_size):
+        rows = np.arange(start, min(start + block_size, size))
+        features = index.matrix.batch_feature_distances(queries[start:rows[-1] + 1], scoring)
+        dist = total_distance(features)
+        correct = labels[None, :] == labels[rows, None]
+        if exclude_self:
+            dist[np.arange(len(rows)), rows] = np.inf
+            correct[np.arange(len(rows)), rows] = False
+        rank, position = best_correct(dist, correct)
+        ranks[rows] = rank
+
+        scored = np.flatnonzero(rank > 0)
+        correct_sums += features[:, scored, position[scored]].sum(axis=1)
+        wrong = np.where(correct, np.inf, dist)
+        wrong_position = np.argmin(wrong, axis=1)
+        contested = scored[np.isfinite(wrong[scored, wrong_position[scored]])]
+        wrong_sums += features[:, contested, wrong_position[contested]].sum(axis=1)
+        wrong_count += len(contested)
+
+    scored = ranks > 0
+    evaluated = int(scored.sum())
+    r = ranks[scored]
+    return {
+        "profile": scoring.name,
+        "level": level,
+        "exclude_self": exclude_self,
+        "organisms": size,
+        "evaluated": evaluated,
+        "top1": float((r == 1).mean()) if evaluated else None,
+        f"top{top}": float((r <= top).mean()) if evaluated else None,
+        "mean_rank": float(r.mean()) if evaluated else None,
+        "median_rank": float(np.median(r)) if evaluated else None,
+        # Mean distance each feature adds to the correct organism and to the
+        # closest wrong one; features where the two differ most discriminate best
+        "feature_contribution": {
+            feature: {
+                "correct": float(correct_sums[k] / evaluated) if evaluated else None,
+                "best_wrong": float(wrong_sums[k] / wrong_count) if wrong_count else None,
+            }
+            for k, feature in enumerate(FEATURES)
+        },
+    }
+
@@ -0,0 +1,211 @@
+"""Load test: autocomplete latency while unknown-isolate batches are scored.
+
+Runs two kinds of clients against a running server for a fixed time:
+``--batch-clients`` threads that keep posting plates of random isolates to
+/unknown_batch, and ``--light-clients`` threads that keep hitting
+/autocomplete. Reports throughput and autocomplete latency percentiles
+as JSON.
+
+    python loadtest.py --url http://127.0.0.1:5000
+    python loadtest.py --spawn                   # starts both servers and compares them
+
+--spawn starts the Flask development server (PHytonAILLM.app.run) and the
+ASGI server (uvicorn asgi:app) on free ports and runs the same load
+against each.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+FRAGMENTS = ('sta', 'esc', 'bac', 'str', 'pse', 'cl', 'my', 'lac', 'sal', 'vib', 'e. co', 's aur')
+ORIGINS = ('soil', 'water', 'human', 'gut', 'skin', 'marine', '')
+MORPHOLOGIES = ('rod', 'cocci', 'spiral', '')
+AEROBICITY = ('aerobe', 'anaerobe', 'facultative anaerobe', '')
+GRAM = ('gram positive', 'gram negative', '')
+
+
+def random_profile(rng):
+    return {
+        'origin': rng.choice(ORIGINS),
+        'temperature': str(rng.choice((25, 30, 37, 42, 55))),
+        'ph': str(rng.choice((5.5, 6.5, 7, 7.5, 8))),
+        'aerobicity': rng.choice(AEROBICITY),
+        'morphology': rng.choice(MORPHOLOGIES),
+        'gram': rng.choice(GRAM),
+        'volume': rng.choice((100, 250, 500)),
+    }
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def logged_in_opener(url):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), _NoRedirect())
+    data = urllib.parse.urlencode({'username': 'admin', 'password': 'bacdoc123'}).encode()
+    try:
+        opener.open(url + '/login', data=data, timeout=30).read()
+    except urllib.error.HTTPError as e:
+        # A successful login answers with a redirect to the home page; only the cookie is needed
+        if e.code != 302:
+            raise
+    return opener
+
+
+def batch_client(url, plate_size, stop, stats, seed):
+    rng = random.Random(seed)
+    opener = logged_in_opener(url)
+    while not stop.is_set():
+        body = json.dumps({'profiles': [random_profile(rng) for _ in range(plate_size)]}).encode()
+        request = urllib.request.Request(url + '/unknown_batch', data=body, headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        try:
+            with opener.open(request, timeout=120) as response:
+                lines = response.read().count(b'\n')
+            stats.append(('batch', time.perf_counter() - start, lines))
+        except urllib.error.HTTPError as e:
+            stats.append(('batch_error', time.perf_counter() - start, e.code))
+            time.sleep(0.1)
+        except OSError:
+            stats.append(('batch_error', time.perf_counter() - start, 0))
+
+
+def light_client(url, stop, stats, seed):
+    rng = random.Random(seed)
+    while not stop.is_set():
+        query = urllib.parse.urlencode({'q': rng.choice(FRAGMENTS)})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(f"{url}/autocomplete?{query}", timeout=30) as response:
+                response.read()
+            stats.append(('light', time.perf_counter() - start, 1))
+        except urllib.error.HTTPError as e:
+            stats.append(('light_error', time.perf_counter() - start, e.code))
+        except OSError:
+            stats.append(('light_error', time.perf_counter() - start, 0))
+
+
+def run_load(url, duration, light_clients, batch_clients, plate_size):
+    stop = threading.Event()
+    stats = []  # list.append is atomic, so the threads share one list
+    threads = [threading.Thread(target=batch_client, args=(url, plate_size, stop, stats, i))
+               for i in range(batch_clients)]
+    threads += [threading.Thread(target=light_client, args=(url, stop, stats, 1000 + i))
+                for i in range(light_clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    def latencies(kind):
+        return np.array([seconds for k, seconds, _ in stats if k == kind]) * 1000
+
+    light = latencies('light')
+    batches = [(seconds, lines) for k, seconds, lines in stats if k == 'batch']
+    return {
+        'url': url,
+        'duration_s': duration,
+        'autocomplete_requests_per_s': len(light) / duration,
+        'autocomplete_p50_ms': float(np.percentile(light, 50)) if len(light) else None,
+        'autocomplete_p95_ms': float(np.percentile(light, 95)) if len(light) else None,
+        'autocomplete_p99_ms': float(np.percentile(light, 99)) if len(light) else None,
+        'autocomplete_errors': sum(1 for k, _, _ in stats if k == 'light_error'),
+        'batches_per_s': len(batches) / duration,
+        'isolates_per_s': sum(lines for _, lines in batches) / duration,
+        'batch_errors': sum(1 for k, _, _ in stats if k == 'batch_error'),
+    }
+
+
+def format_ms(value):
+    return 'n/a' if value is None else f"{value:.1f} ms"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + '/autocomplete?q=a', timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"Server at {url} did not come up")
+
+
+def spawn(kind, port):
+    here = os.path.dirname(os.path.abspath(__file__))
+    if kind == 'flask':
+        code = f"import PHytonAILLM as b; b.app.run(host='127.0.0.1', port={port}, threaded=True)"
+        command = [sys.executable, '-c', code]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                   '--log-level', 'warning']
+    return subprocess.Popen(command, cwd=here, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BacDoc load test")
+    parser.add_argument('--url', action='append', help="server to test (repeatable)")
+    parser.add_argument('--spawn', action='store_true', help="start the Flask dev server and the ASGI server and compare")
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--light-clients', type=int, default=8)
+    parser.add_argument('--batch-clients', type=int, default=4)
+    parser.add_argument('--plate-size', type=int, default=96)
+    parser.add_argument('-o', '--output', default='-', help="JSON report, '-' for stdout (default)")
+    args = parser.parse_args(argv)
+
+    targets = [(url, url) for url in args.url or []]
+    processes = []
+    try:
+        if args.spawn:
+            for kind in ('flask', 'asgi'):
+                port = free_port()
+                processes.append(spawn(kind, port))
+                targets.append((kind, f"http://127.0.0.1:{port}"))
+        if not targets:
+            parser.error("give --url or --spawn")
+        report = []
+        for name, url in targets:
+            wait_for(url)
+            result = run_load(url, args.duration, args.light_clients, args.batch_clients, args.plate_size)
+            result['server'] = name
+            report.append(result)
+            print(f"{name}: autocomplete p50 {format_ms(result['autocomplete_p50_ms'])}, "
+                  f"p95 {format_ms(result['autocomplete_p95_ms'])}, {result['autocomplete_requests_per_s']:.0f} req/s; "
+                  f"{result['isolates_per_s']:.0f} isolates/s", file=sys.stderr)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    text = json.dumps(report, indent=2) + "\n"
+    if args.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            out.write(text)
+
+
+if __name__ == "__main__":
+    main()
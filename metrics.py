@@ -0,0 +1,170 @@
+"""In-process request metrics in the Prometheus text exposition format.
+
+Routes time their stages (parse, score, select, merge, serialize) with a
+per-request ``StageTimer``; each stage is observed into a histogram as soon
+as it finishes, so streamed responses are covered too. Only a
+``sample_rate`` fraction of requests is timed; request counts are always
+kept. Every worker process keeps its own registry, so scrape each worker
+(or sum across them) when running more than one.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds; the last bucket is +Inf
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}  # label values → [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += seconds
+            series[-1] += 1
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[-1] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        names = self.labels + ('le',)
+        for label_values, series in items:
+            cumulative = 0
+            for bound, hits in zip(self.buckets, series):
+                cumulative += hits
+                lines.append(f"{self.name}_bucket{_labels(names, label_values + (_number(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {series[-2]!r}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time; kind='counter' for running totals kept elsewhere."""
+
+    def __init__(self, name, help_text, read, labels=(), kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.kind = kind
+        self._read = read  # → {label values: value}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, value in sorted(self._read().items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+class StageTimer:
+    """Times the stages of one request; a no-op unless the request was sampled."""
+    __slots__ = ('route', 'sampled', 'timings', '_histogram')
+
+    def __init__(self, route, histogram, sampled):
+        self.route = route
+        self.sampled = sampled
+        self.timings = {}  # stage → seconds, for traces
+        self._histogram = histogram
+
+    @contextmanager
+    def stage(self, name):
+        if not self.sampled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            self._histogram.observe(elapsed, self.route, name)
+
+
+class Metrics:
+    """Registry of the app's metrics and the sampling switch for stage timers."""
+
+    def __init__(self, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self._metrics = []
+        self.requests = self.add(Counter(
+            'bacdoc_requests_total', "Requests handled, by route and status code.", ('route', 'status')))
+        self.request_seconds = self.add(Histogram(
+            'bacdoc_request_seconds', "Time to build each response (first byte for streams).", ('route',)))
+        self.stage_seconds = self.add(Histogram(
+            'bacdoc_stage_seconds', "Time spent in each request stage, for sampled requests.", ('route', 'stage')))
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def timer(self, route, sampled=None):
+        """StageTimer for one request; sampled defaults to a draw against sample_rate."""
+        if sampled is None:
+            sampled = self.sampled()
+        return StageTimer(route, self.stage_seconds, sampled)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
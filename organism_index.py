@@ -0,0 +1,217 @@
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+from biochemical_index import BiochemicalIndex
+from compositions import IngredientMatrix, parse_ingredients, scale_ingredients
+from phenotype_matrix import PhenotypeMatrix, clean_param, parse_category_range, parse_numeric_range
+from search_index import PrefixIndex, SearchIndex
+
+TEMP_COLUMN = 'Optimal Growth Temperature (°C)'
+PH_COLUMN = 'Optimal Growth pH'
+ORIGIN_COLUMN = 'Origin/Source'
+AEROBICITY_COLUMN = 'Optimal Growth Aerobic Conditions'
+MORPHOLOGY_COLUMN = 'Morphology'
+GRAM_COLUMN = 'Gram Nature'
+ORGANISM_COLUMN = 'Organism'
+OPTIMAL_MEDIA_COLUMN = 'Optimal Media'
+OPTIMAL_COMPOSITION_COLUMN = 'Optimal Media Composition (per 100ml)'
+DIFFERENTIAL_MEDIA_COLUMN = 'Differential Media'
+DIFFERENTIAL_COMPOSITION_COLUMN = 'Differential Media Composition'
+BIOCHEMICAL_COLUMN = 'Biochemical Test'
+
+# Media kinds served by the routes and the column each one is parsed from
+MEDIA_KINDS = {
+    'optimal': OPTIMAL_COMPOSITION_COLUMN,
+    'differential': DIFFERENTIAL_COMPOSITION_COLUMN,
+}
+
+
+def split_tests(raw_value):
+    """"Catalase positive, Oxidase negative" → ('Catalase positive', 'Oxidase negative')"""
+    if not isinstance(raw_value, str) or not raw_value:
+        return ()
+    return tuple(test.strip() for test in raw_value.split(',') if test.strip())
+
+
+class OrganismRecord:
+    """One database row with every request-independent field parsed up front.
+
+    ``get`` reads the raw CSV columns, so records can be passed anywhere a
+    row was accepted before (is_valid_media, merge_compositions_detailed).
+    """
+    __slots__ = (
+        'position', 'raw', 'name', 'name_lower',
+        'temp_values', 'ph_values', 'origin', 'aerobicity', 'morphology', 'gram',
+        'tests', 'optimal_ingredients', 'differential_ingredients',
+    )
+
+    def __init__(self, position, raw):
+        self._set_raw(position, raw)
+        self.temp_values = parse_numeric_range(raw.get(TEMP_COLUMN, ''))
+        self.ph_values = parse_numeric_range(raw.get(PH_COLUMN, ''))
+        self.origin = clean_param(str(raw.get(ORIGIN_COLUMN, '')))
+        self.aerobicity = parse_category_range(raw.get(AEROBICITY_COLUMN, ''))
+        self.morphology = clean_param(str(raw.get(MORPHOLOGY_COLUMN, '')))
+        self.gram = clean_param(str(raw.get(GRAM_COLUMN, '')))
+
+        self.tests = split_tests(raw.get(BIOCHEMICAL_COLUMN))
+        # Media compositions as per-100 ml ingredient tuples
+        self.optimal_ingredients = parse_ingredients(raw.get(OPTIMAL_COMPOSITION_COLUMN, ''))
+        self.differential_ingredients = parse_ingredients(raw.get(DIFFERENTIAL_COMPOSITION_COLUMN, ''))
+
+    @classmethod
+    def from_parsed(cls, position, raw, temp_values, ph_values, origin, aerobicity, morphology, gram,
+                    optimal_ingredients, differential_ingredients):
+        """A record whose parsed fields are already known (see snapshot.read_snapshot)."""
+        record = cls.__new__(cls)
+        record._set_raw(position, raw)
+        record.temp_values = temp_values
+        record.ph_values = ph_values
+        record.origin = origin
+        record.aerobicity = aerobicity
+        record.morphology = morphology
+        record.gram = gram
+        record.tests = split_tests(raw.get(BIOCHEMICAL_COLUMN))
+        record.optimal_ingredients = optimal_ingredients
+        record.differential_ingredients = differential_ingredients
+        return record
+
+    def _set_raw(self, position, raw):
+        self.position = position
+        self.raw = raw
+        self.name = raw.get(ORGANISM_COLUMN, 'Unknown')
+        self.name_lower = self.name.lower() if isinstance(self.name, str) else ''
+
+    def get(self, column, default=None):
+        return self.raw.get(column, default)
+
+    def ingredients(self, kind):
+        """Per-100 ml ingredients for a media kind ('optimal' or 'differential')."""
+        if kind == 'differential':
+            return self.differential_ingredients
+        return self.optimal_ingredients
+
+    def __repr__(self):
+        return f"OrganismRecord({self.position}, {self.name!r})"
+
+
+class OrganismIndex:
+    """Everything the routes need from Centraldatabase.csv, compiled once.
+
+    Records keep database order; ``lookup`` resolves a name to its first
+    record in O(1), matching the old first-row-wins DataFrame filter.
+    ``version`` identifies the source data (see load_data_safe) and is what
+    HTTP caches revalidate against; ``columns`` are the CSV header names in
+    file order.
+    """
+
+    def __init__(self, rows=(), version='empty', columns=None):
+        records = [OrganismRecord(i, row) for i, row in enumerate(rows)]
+        if columns is None:
+            columns = list(records[0].raw) if records else []
+        self._set(records, version, columns, PhenotypeMatrix(records))
+
+    @classmethod
+    def from_records(cls, records, version, columns, matrix, biochemical=None):
+        """Index over records and a phenotype matrix that are already built (see snapshot.py)."""
+        index = cls.__new__(cls)
+        index._set(list(records), version, list(columns), matrix, biochemical)
+        return index
+
+    def _set(self, records, version, columns, matrix, biochemical=None):
+        self.version = version
+        self.columns = columns
+        self.records = records
+        self.by_name = {}
+        for record in self.records:
+            self.by_name.setdefault(record.name, record)
+        # Distinct names in first-seen order
+        self.names = list(self.by_name)
+        self.search = SearchIndex(self.names)
+        self.prefixes = PrefixIndex(self.names)
+        self.matrix = matrix
+        if biochemical is None:
+            biochemical = BiochemicalIndex([r.tests for r in self.records])
+        self.biochemical = biochemical
+        self.ingredient_matrices = {
+            kind: IngredientMatrix([r.ingredients(kind) for r in self.records]) for kind in MEDIA_KINDS
+        }
+        # Scaled compositions, keyed by (record position, media kind, volume)
+        self._scaled = lru_cache(maxsize=4096)(self._scale)
+        # Autocomplete responses for hot prefixes
+        self.autocomplete = lru_cache(maxsize=4096)(self._autocomplete)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def lookup(self, name):
+        return self.by_name.get(name)
+
+    def composition(self, record, kind, volume_ml=100):
+        """{component: {'amount', 'unit'}} for a record's media at volume_ml.
+
+        The returned dict is shared through the cache; treat it as read-only.
+        """
+        return self._scaled(record.position, kind, float(volume_ml))
+
+    def composition_cache_info(self):
+        return self._scaled.cache_info()
+
+    def bill_of_materials(self, orders):
+        """Total reagents for (record, media kind, volume ml) orders.
+
+        Volume-scalable amounts are summed per (component, unit) with one
+        sparse reduction per media kind. Percentages and other fixed
+        amounts, and qualitative supplements, are listed with the number of
+        orders that need them.
+        """
+        totals = {}
+        fixed = Counter()
+        supplements = Counter()
+        for kind, matrix in self.ingredient_matrices.items():
+            selected = [(record.position, volume) for record, k, volume in orders if k == kind]
+            if not selected:
+                continue
+            rows, volumes = zip(*selected)
+            amounts = matrix.totals(rows, np.array(volumes, dtype=float) / 100)
+            for column in np.flatnonzero(amounts):
+                key = matrix.columns[column]
+                totals[key] = totals.get(key, 0.0) + float(amounts[column])
+            for row, count in Counter(rows).items():
+                fixed.update({entry: count for entry in matrix.fixed[row]})
+                supplements.update({name: count for name in matrix.supplements[row]})
+        return {
+            "orders": len(orders),
+            "totals": [
+                {"component": name, "amount": amount, "unit": unit}
+                for (name, unit), amount in sorted(totals.items())
+            ],
+            "fixed_amounts": [
+                {"component": name, "amount": amount, "unit": unit, "orders": count}
+                for (name, amount, unit), count in sorted(fixed.items())
+            ],
+            "supplements": [
+                {"component": name, "orders": count} for name, count in sorted(supplements.items())
+            ],
+        }
+
+    def _autocomplete(self, fragment, limit=8):
+        """Prefix completions (name, abbreviation, epithet), topped up with substring matches."""
+        suggestions = [self.names[i] for i in self.prefixes.complete(fragment, limit)]
+        if len(suggestions) < limit:
+            seen = set(suggestions)
+            for name in self.search.containing(fragment, limit):
+                if name not in seen:
+                    suggestions.append(name)
+                    if len(suggestions) >= limit:
+                        break
+        return tuple(suggestions)
+
+    def _scale(self, position, kind, volume_ml):
+        return scale_ingredients(self.records[position].ingredients(kind), volume_ml)
+
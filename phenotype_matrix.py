@@ -0,0 +1,407 @@
+import re
+import numpy as np
+
+from scoring_profiles import DEFAULT_PROFILE, FEATURES, profile_matrix
+
+_NON_NUMERIC = re.compile(r'[^\d\.]')
+
+
+def clean_param(value):
+    if not isinstance(value, str):
+        return ''
+    return value.strip().lower()
+
+
+def parse_numeric_range(raw_value):
+    """Parse multiple values: "37,39,40,42" → [37.0, 39.0, 40.0, 42.0]"""
+    if not isinstance(raw_value, str) or not raw_value.strip():
+        return None
+
+    values = [v.strip() for v in raw_value.split(',') if v.strip()]
+    if not values:
+        return None
+
+    numbers = []
+    for val in values:
+        clean = _NON_NUMERIC.sub('', val)
+        try:
+            numbers.append(float(clean))
+        except ValueError:
+            pass
+
+    return numbers if numbers else None
+
+
+def parse_category_range(raw_value):
+    """Parse categories: "Facultative anaerobe, 5% CO2" → "facultative anaerobe" """
+    if not isinstance(raw_value, str) or not raw_value.strip():
+        return ''
+
+    first_part = raw_value.split(',')[0].strip()
+    return clean_param(first_part)
+
+
+def parse_query_number(value):
+    """User input "37 °C" → 37.0, anything unparseable → None"""
+    try:
+        return float(_NON_NUMERIC.sub('', str(value)))
+    except ValueError:
+        return None
+
+
+def normalize_query(origin, temp_input, ph_input, aerobicity, morphology, gramnature):
+    """The parts of a raw query that scoring reads; equal tuples get identical distances."""
+    return (
+        clean_param(origin), parse_query_number(temp_input), parse_query_number(ph_input),
+        clean_param(aerobicity), clean_param(morphology), clean_param(gramnature),
+    )
+
+
+def _padded_values(value_lists):
+    # Ragged value lists → (N, width) float matrix padded with +inf, so the
+    # row-wise minimum distance ignores the padding
+    width = max((len(v) for v in value_lists if v), default=1)
+    matrix = np.full((len(value_lists), width), np.inf)
+    present = np.zeros(len(value_lists), dtype=bool)
+    for i, values in enumerate(value_lists):
+        if values:
+            matrix[i, :len(values)] = values
+            present[i] = True
+    return matrix, present
+
+
+def _encode(values):
+    # Integer-code a categorical column; returns (codes, categories, lookup)
+    lookup = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(lookup)
+        codes[i] = code
+    categories = list(lookup)
+    return codes, categories, lookup
+
+
+class CategoricalColumn:
+    __slots__ = ('codes', 'categories', 'lookup', 'present')
+
+    def __init__(self, values):
+        codes, categories, _ = _encode(values)
+        self._set(codes, categories)
+
+    @classmethod
+    def from_codes(cls, codes, categories):
+        """Column from already encoded codes (possibly a read-only memmap)."""
+        column = cls.__new__(cls)
+        column._set(codes, list(categories))
+        return column
+
+    def _set(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+        self.lookup = {value: code for code, value in enumerate(categories)}
+        filled = np.array([bool(c) for c in categories], dtype=bool)
+        self.present = filled[codes] if len(codes) else np.zeros(0, dtype=bool)
+
+    def code(self, value):
+        """Integer code of a cleaned value, -1 for empty or unseen values."""
+        if not value:
+            return -1
+        return self.lookup.get(value, -1)
+
+    def contains(self, value):
+        # Substring test once per distinct category, then gathered by code
+        hits = np.array([value in c for c in self.categories], dtype=bool)
+        return hits[self.codes] if len(self.codes) else np.zeros(0, dtype=bool)
+
+
+class ValueIndex:
+    """Numeric value sets (temperatures or pHs) of every organism, indexed for searchsorted.
+
+    Built from a +inf padded (N, width) matrix. Values are flattened and
+    sorted by (owner, value), so one vectorized searchsorted finds each
+    organism's closest values below and above a query. They are also kept
+    sorted by value alone, so the organisms with a value in a window can
+    be read off a single slice.
+    """
+
+    def __init__(self, matrix, present):
+        self.size = len(present)
+        self.present = present
+        owners, columns = np.nonzero(np.isfinite(matrix))
+        values = np.asarray(matrix)[owners, columns]
+        # Owner-major keys built from value ranks: exact integer ordering
+        self.distinct = np.unique(values)
+        ranks = np.searchsorted(self.distinct, values)
+        keys = owners.astype(np.int64) * max(1, len(self.distinct)) + ranks
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.values, self.owners = keys[order], values[order], owners[order]
+        by_value = np.argsort(values, kind='stable')
+        self.sorted_values, self.sorted_owners = values[by_value], owners[by_value]
+
+    def nearest(self, values, rows=None):
+        """(|Δ| to each organism's closest value, penalised), both (Q, len(rows)).
+
+        Queries without a value (NaN) and organisms without data are
+        penalised and get a distance of 0.
+        """
+        rows = np.arange(self.size) if rows is None else rows
+        known = ~np.isnan(values)
+        penalised = ~(known[:, None] & self.present[rows][None, :])
+        nearest = np.zeros((len(values), len(rows)))
+        if not len(self.keys) or not known.any():
+            return nearest, penalised
+
+        # Rank r: distinct values below r are < x, from r on they are >= x
+        r = np.searchsorted(self.distinct, values[known])
+        needles = rows.astype(np.int64)[None, :] * max(1, len(self.distinct)) + r[:, None]
+        above = np.searchsorted(self.keys, needles)
+        below = above - 1
+        last = len(self.keys) - 1
+        x = values[known][:, None]
+        above_c, below_c = np.minimum(above, last), np.maximum(below, 0)
+        # |x - v| is exact in either direction, so this equals min(abs(x - values))
+        up = np.where((above <= last) & (self.owners[above_c] == rows), self.values[above_c] - x, np.inf)
+        down = np.where((below >= 0) & (self.owners[below_c] == rows), x - self.values[below_c], np.inf)
+        nearest[known] = np.minimum(up, down)
+        nearest[penalised] = 0
+        return nearest, penalised
+
+    def within(self, value, radius):
+        """Mask of organisms with a listed value in [value - radius, value + radius]."""
+        lo = np.searchsorted(self.sorted_values, value - radius, side='left')
+        hi = np.searchsorted(self.sorted_values, value + radius, side='right')
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.sorted_owners[lo:hi]] = True
+        return mask
+
+
+class PhenotypeMatrix:
+    """Array-backed phenotype columns for every organism, built once at load time.
+
+    Takes parsed organism records (see organism_index.OrganismRecord). Row i
+    of every array describes the i-th record, so the indices returned by
+    top_n can be used to look records up directly.
+    """
+
+    def __init__(self, records):
+        records = list(records)
+        temps, has_temp = _padded_values([r.temp_values for r in records])
+        phs, has_ph = _padded_values([r.ph_values for r in records])
+        self._set(
+            records, temps, has_temp, phs, has_ph,
+            CategoricalColumn([r.origin for r in records]),
+            CategoricalColumn([r.aerobicity for r in records]),
+            CategoricalColumn([r.morphology for r in records]),
+            CategoricalColumn([r.gram for r in records]),
+        )
+
+    @classmethod
+    def from_arrays(cls, records, temps, has_temp, phs, has_ph, origin, aerobicity, morphology, gram):
+        """Matrix over prebuilt arrays and columns, e.g. memory-mapped from a snapshot."""
+        matrix = cls.__new__(cls)
+        matrix._set(list(records), temps, has_temp, phs, has_ph, origin, aerobicity, morphology, gram)
+        return matrix
+
+    @classmethod
+    def scoring_only(cls, temps, has_temp, phs, has_ph, origin, aerobicity, morphology, gram):
+        """Matrix over arrays alone, without records (see sharded_scoring.py).
+
+        It scores like any other matrix but has no names or display values,
+        so it cannot back a score trace.
+        """
+        matrix = cls.__new__(cls)
+        matrix._set_arrays(temps, has_temp, phs, has_ph, origin, aerobicity, morphology, gram)
+        return matrix
+
+    def _set(self, records, temps, has_temp, phs, has_ph, origin, aerobicity, morphology, gram):
+        self._set_arrays(temps, has_temp, phs, has_ph, origin, aerobicity, morphology, gram)
+        self.names = [r.name for r in records]
+        # First listed value, kept only for score breakdown output
+        self.temp_display = [f"{r.temp_values[0]}" if r.temp_values else None for r in records]
+        self.ph_display = [f"{r.ph_values[0]}" if r.ph_values else None for r in records]
+
+    def _set_arrays(self, temps, has_temp, phs, has_ph, origin, aerobicity, morphology, gram):
+        self.size = len(has_temp)
+        self.temps, self.has_temp = temps, has_temp
+        self.phs, self.has_ph = phs, has_ph
+        self.temp_index = ValueIndex(temps, has_temp)
+        self.ph_index = ValueIndex(phs, has_ph)
+
+        self.origin = origin
+        self.aerobicity = aerobicity
+        self.morphology = morphology
+        self.gram = gram
+
+        self._origin_cache = {}
+
+    def _origin_hits(self, origin_clean):
+        hits = self._origin_cache.get(origin_clean)
+        if hits is None:
+            if len(self._origin_cache) > 1024:
+                self._origin_cache.clear()
+            hits = self._origin_cache[origin_clean] = self.origin.contains(origin_clean)
+        return hits
+
+    def candidates(self, queries, temp_window=None, ph_window=None):
+        """Sorted rows that any query can match under a hard temperature/pH pre-filter.
+
+        An organism is kept for a query when it lists a value within
+        ±window of the query's, or lists no value at all; a query without
+        the value keeps everything. Returns None when nothing is filtered,
+        else (rows, keep) with keep a (Q, len(rows)) mask.
+        """
+        keep = np.ones((len(queries), self.size), dtype=bool)
+        filtered = False
+        for window, position, index in ((temp_window, 1, self.temp_index), (ph_window, 2, self.ph_index)):
+            if window is None:
+                continue
+            for k, query in enumerate(queries):
+                value = parse_query_number(query[position])
+                if value is not None:
+                    keep[k] &= index.within(value, window) | ~index.present
+                    filtered = True
+        if not filtered:
+            return None
+        rows = np.flatnonzero(keep.any(axis=0))
+        return rows, keep[:, rows]
+
+    def feature_distances(self, origin, temp_input, ph_input, aerobicity, morphology, gramnature,
+                          scoring=DEFAULT_PROFILE, rows=None):
+        """BacDoc Equation 2 per-feature weighted distances, shape (6, N) in FEATURES order."""
+        query = (origin, temp_input, ph_input, aerobicity, morphology, gramnature)
+        return self.batch_feature_distances([query], scoring, rows)[:, 0, :]
+
+    def batch_feature_distances(self, queries, scoring=DEFAULT_PROFILE, rows=None):
+        """Per-feature distances for many queries at once, shape (6, Q, N).
+
+        Each query is an (origin, temp, pH, aerobicity, morphology, gram)
+        tuple of raw user input; scoring is the ScoringProfile whose
+        weights and penalties are applied. With rows (sorted positions, e.g.
+        from candidates) only those organisms are scored and the last axis
+        follows rows. Memory grows with Q × N, so callers with large
+        batches should pass them in blocks (see batch_size).
+        """
+        queries = list(queries)
+        size = self.size if rows is None else len(rows)
+        out = np.empty((len(FEATURES), len(queries), size))
+        if not size or not queries:
+            return out
+        for k, (raw, penalised) in enumerate(self._unit_distances(queries, rows)):
+            out[k] = np.where(penalised, scoring.penalty_distances[k], raw * scoring.weights[k])
+        return out
+
+    def batch_profile_distances(self, queries, scorings):
+        """Total distances under several scoring profiles at once, shape (P, Q, N).
+
+        The unweighted per-feature distances are computed once and combined
+        with the (P, 6) weight and penalty matrices. Terms are summed in
+        FEATURES order, so each [p] slice equals batch_distances(queries,
+        scorings[p]) exactly. Memory grows with P × Q × N.
+        """
+        queries = list(queries)
+        weights, penalty_distances = profile_matrix(scorings)
+        total = np.zeros((len(weights), len(queries), self.size))
+        if not self.size or not queries:
+            return total
+        for k, (raw, penalised) in enumerate(self._unit_distances(queries)):
+            term = np.where(penalised[None], penalty_distances[:, k, None, None],
+                            raw[None] * weights[:, k, None, None])
+            if k:
+                total += term
+            else:
+                total = term
+        return total
+
+    def _unit_distances(self, queries, rows=None):
+        # Yields (unweighted distance, penalised) per feature in FEATURES order,
+        # both (Q, N) or (Q, len(rows)). Penalised entries score penalty × weight instead.
+        size = self.size if rows is None else len(rows)
+        origins = [clean_param(q[0]) for q in queries]
+        temp_vals = np.array([_or_nan(parse_query_number(q[1])) for q in queries])
+        ph_vals = np.array([_or_nan(parse_query_number(q[2])) for q in queries])
+
+        # Temperature and pH: |Δ| to the closest listed value
+        yield self.temp_index.nearest(temp_vals, rows)
+        yield self.ph_index.nearest(ph_vals, rows)
+
+        # Origin: 0 on a match, 1 when no origin was given, penalty on a miss;
+        # each distinct origin is matched once
+        raw = np.ones((len(queries), size))
+        penalised = np.zeros((len(queries), size), dtype=bool)
+        for origin in set(origins):
+            if origin:
+                same = [k for k, o in enumerate(origins) if o == origin]
+                hits = self._origin_hits(origin)
+                raw[same] = 0
+                penalised[same] = ~(hits if rows is None else hits[rows])
+        yield raw, penalised
+
+        # Aerobicity, morphology, gram: 0/1 mismatch, penalty when the organism has no value
+        for column, position in ((self.aerobicity, 3), (self.morphology, 4), (self.gram, 5)):
+            codes = np.array([column.code(clean_param(q[position])) for q in queries])
+            column_codes = column.codes if rows is None else column.codes[rows]
+            present = column.present if rows is None else column.present[rows]
+            raw = (column_codes[None, :] != codes[:, None]).astype(float)
+            yield raw, np.broadcast_to(~present[None, :], raw.shape)
+
+    def batch_size(self, budget=1 << 22, scorings=1):
+        """How many queries fit in one batch_feature_distances call for a given element budget.
+
+        Pass the number of scoring profiles for batch_profile_distances.
+        """
+        # The nearest-value search holds about eight (Q, N) temporaries
+        width = max(8, scorings)
+        return max(1, budget // max(1, self.size * width))
+
+    def distances(self, *query, scoring=DEFAULT_PROFILE):
+        """Total Equation 2 distance for every organism."""
+        return total_distance(self.feature_distances(*query, scoring=scoring))
+
+    def batch_distances(self, queries, scoring=DEFAULT_PROFILE, rows=None):
+        """Total distances, shape (Q, N) or (Q, len(rows))."""
+        return total_distance(self.batch_feature_distances(queries, scoring, rows))
+
+
+def _or_nan(value):
+    return np.nan if value is None else value
+
+
+def total_distance(features):
+    # Summed row by row in FEATURES order so totals are bit-identical to the
+    # scalar d_temp + d_ph + origin + aerobicity + morphology + gram
+    total = features[0].copy()
+    for row in features[1:]:
+        total += row
+    return total
+
+
+def top_n(dist, n):
+    """Indices of the n smallest distances, ties broken by database order.
+
+    Organisms at an infinite distance (dropped by a pre-filter) are never returned.
+    """
+    n = min(n, int(np.isfinite(dist).sum()))
+    if n <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if n < len(dist):
+        kth = dist[np.argpartition(dist, n - 1)[n - 1]]
+        candidates = np.flatnonzero(dist <= kth)
+    else:
+        candidates = np.arange(len(dist))
+    order = np.argsort(dist[candidates], kind='stable')
+    return candidates[order[:n]]
+
+
+def rank_of(dist, positions):
+    """1-based rank top_n would give organism positions[q] in row q of dist.
+
+    dist is (..., Q, N), e.g. (P, Q, N) from batch_profile_distances;
+    ties are broken by database order as in top_n.
+    """
+    positions = np.asarray(positions)
+    index = np.broadcast_to(positions[:, None], dist.shape[:-1] + (1,))
+    own = np.take_along_axis(dist, index, axis=-1)
+    before = np.arange(dist.shape[-1])[None, :] < positions[:, None]
+    return (dist < own).sum(axis=-1) + ((dist == own) & before).sum(axis=-1) + 1
@@ -0,0 +1,115 @@
+"""Response encoding: a faster JSON provider and gzip/br compression.
+
+OrjsonProvider serializes with orjson when it is installed, keeping
+Flask's key sorting; anything orjson cannot encode (and any call with
+json.dumps options it has no equivalent for) goes through the standard
+encoder. Without orjson it behaves exactly like Flask's default provider.
+
+init_compression compresses the JSON responses of the given endpoints
+with brotli (if the brotli package is installed) or gzip, whichever the
+client accepts, once the body is at least min_bytes long.
+"""
+import gzip
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+# Higher qualities compress a little better but cost far more time per response
+BROTLI_QUALITY = 5
+
+
+def available_encodings():
+    """Content encodings init_compression can produce, preferred first."""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, falling back to the standard json module."""
+
+    def _options(self, kwargs):
+        # orjson options for json.dumps kwargs, or None if orjson cannot honour them
+        if orjson is None:
+            return None
+        kwargs = dict(kwargs)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if kwargs.pop('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        indent = kwargs.pop('indent', None)
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        elif indent is not None:
+            return None
+        # orjson always writes compact separators and UTF-8
+        if kwargs.pop('separators', (',', ':')) != (',', ':') or kwargs:
+            return None
+        return option
+
+    def dumps(self, obj, **kwargs):
+        option = self._options(kwargs)
+        if option is not None:
+            try:
+                return orjson.dumps(obj, option=option).decode('utf-8')
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indented = (self.compact is None and self._app.debug) or self.compact is False
+        option = self._options({'indent': 2} if indented else {})
+        if option is not None:
+            try:
+                body = orjson.dumps(obj, option=option | orjson.OPT_APPEND_NEWLINE)
+            except TypeError:
+                pass
+            else:
+                return self._app.response_class(body, mimetype=self.mimetype)
+        return super().response(obj)
+
+
+def init_compression(app, endpoints, min_bytes=512):
+    """Compress JSON responses of endpoints for clients sending a matching Accept-Encoding."""
+    endpoints = frozenset(endpoints)
+    encodings = available_encodings()
+
+    @app.after_request
+    def compress_response(response):
+        if request.endpoint not in endpoints or response.mimetype != 'application/json':
+            return response
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+            return response
+        if 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        accepted = request.accept_encodings
+        encoding = next((e for e in encodings if accepted[e]), None)
+        body = response.get_data()
+        if encoding is None or len(body) < min_bytes:
+            return response
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    return compress_response
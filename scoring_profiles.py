@@ -0,0 +1,124 @@
+"""Weight sets for BacDoc Equation 2 ("scoring profiles").
+
+Every feature has a weight W and a penalty multiplier. A feature
+contributes W × |Δ| (temperature, pH) or W × mismatch (categories). When
+the query or the organism has no value it contributes penalty × W instead.
+Origin is the exception: an empty query scores 1 × W, and only a miss
+scores penalty × W.
+
+Alternative weightings are declared in a JSON file. Features that are
+left out keep their Equation 2 values:
+
+    {
+      "gram_first": {"weights": {"gram": 6, "morphology": 3}},
+      "lenient_ph": {"weights": {"ph": 2}, "penalties": {"ph": 5},
+                     "description": "for media with poorly known pH"}
+    }
+"""
+import json
+import math
+
+import numpy as np
+
+# Order of the per-feature distance rows; the total is summed in this order
+FEATURES = ('temp', 'ph', 'origin', 'aerobicity', 'morphology', 'gram')
+
+EQUATION_2_WEIGHTS = {'temp': 5, 'ph': 5, 'origin': 2, 'aerobicity': 4, 'morphology': 2, 'gram': 2}
+EQUATION_2_PENALTIES = {'temp': 20, 'ph': 10, 'origin': 5, 'aerobicity': 4, 'morphology': 3, 'gram': 3}
+
+_PROFILE_KEYS = ('weights', 'penalties', 'description')
+
+
+def _feature_values(name, kind, values, defaults):
+    if values is None:
+        values = {}
+    if not isinstance(values, dict):
+        raise ValueError(f"Scoring profile {name!r}: {kind} must be an object of feature: number")
+    unknown = [feature for feature in values if feature not in FEATURES]
+    if unknown:
+        raise ValueError(f"Scoring profile {name!r}: unknown {kind} {', '.join(map(repr, unknown))}; "
+                         f"features are {', '.join(FEATURES)}")
+    out = []
+    for feature in FEATURES:
+        value = values.get(feature, defaults[feature])
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+            raise ValueError(f"Scoring profile {name!r}: {kind} for {feature} must be a non-negative number, "
+                             f"got {value!r}")
+        out.append(float(value))
+    return np.array(out)
+
+
+class ScoringProfile:
+    """One validated weight set, compiled to the constants the distance kernel uses.
+
+    ``weights`` and ``penalty_distances`` (penalty × weight) are float
+    arrays in FEATURES order.
+    """
+    __slots__ = ('name', 'description', 'weights', 'penalties', 'penalty_distances')
+
+    def __init__(self, name, weights=None, penalties=None, description=''):
+        self.name = name
+        self.description = description
+        self.weights = _feature_values(name, 'weights', weights, EQUATION_2_WEIGHTS)
+        self.penalties = _feature_values(name, 'penalties', penalties, EQUATION_2_PENALTIES)
+        # Products taken per feature exactly as Equation 2 writes them (e.g. 20 * 5)
+        self.penalty_distances = self.penalties * self.weights
+
+    @classmethod
+    def from_config(cls, name, config):
+        if not isinstance(config, dict):
+            raise ValueError(f"Scoring profile {name!r} must be an object")
+        unknown = [key for key in config if key not in _PROFILE_KEYS]
+        if unknown:
+            raise ValueError(f"Scoring profile {name!r}: unknown keys {', '.join(map(repr, unknown))}")
+        return cls(name, config.get('weights'), config.get('penalties'), str(config.get('description', '')))
+
+    def as_dict(self):
+        return {
+            'weights': dict(zip(FEATURES, self.weights.tolist())),
+            'penalties': dict(zip(FEATURES, self.penalties.tolist())),
+            'description': self.description,
+        }
+
+    def __repr__(self):
+        return f"ScoringProfile({self.name!r})"
+
+
+DEFAULT_PROFILE = ScoringProfile('default', description="BacDoc Equation 2")
+
+
+def load_profiles(path=None):
+    """{name: ScoringProfile} from a JSON file, always including 'default'.
+
+    Raises ValueError naming the offending profile when a weight set is
+    invalid. A file may redefine 'default'.
+    """
+    profiles = {DEFAULT_PROFILE.name: DEFAULT_PROFILE}
+    if not path:
+        return profiles
+    with open(path, encoding='utf-8') as f:
+        try:
+            config = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path} is not valid JSON: {e}") from None
+    if not isinstance(config, dict):
+        raise ValueError(f"{path} must hold an object of profile name: weights")
+    for name, entry in config.items():
+        profiles[name] = ScoringProfile.from_config(name, entry)
+    return profiles
+
+
+def select_profile(profiles, name):
+    try:
+        return profiles[name]
+    except KeyError:
+        raise ValueError(f"Unknown scoring profile {name!r}; expected one of {', '.join(profiles)}") from None
+
+
+def profile_matrix(profiles):
+    """(weights, penalty distances), each shaped (P, 6), for scoring under P profiles at once."""
+    profiles = list(profiles)
+    if not profiles:
+        raise ValueError("No scoring profiles given")
+    return (np.stack([p.weights for p in profiles]),
+            np.stack([p.penalty_distances for p in profiles]))
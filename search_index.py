@@ -0,0 +1,221 @@
+import heapq
+from bisect import bisect_left
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+import numpy as np
+
+
+class SearchIndex:
+    """Name lookups over a fixed list of organism names, prebuilt once.
+
+    Every query returns exactly what the equivalent linear scan over
+    ``names`` would, in the same order; the index only decides which names
+    are worth checking.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.names_lower = [name.lower() for name in self.names]
+
+        # Lowercase name → first name id, bucketed by length, for containment
+        self._by_lower = {}
+        for i, lower in enumerate(self.names_lower):
+            self._by_lower.setdefault(lower, i)
+        self._lengths = sorted({len(lower) for lower in self._by_lower})
+
+        # 1-, 2- and 3-gram inverted index; posting lists hold ascending ids
+        postings = defaultdict(list)
+        for i, lower in enumerate(self.names_lower):
+            grams = set()
+            for size in (1, 2, 3):
+                grams.update(lower[j:j + size] for j in range(len(lower) - size + 1))
+            for gram in grams:
+                postings[gram].append(i)
+        self._postings = dict(postings)
+
+        # Per-name character counts (case-sensitive, like difflib) for a
+        # vectorized SequenceMatcher.quick_ratio upper bound
+        self._alphabet = {}
+        for name in self.names:
+            for ch in name:
+                self._alphabet.setdefault(ch, len(self._alphabet))
+        self._char_counts = np.zeros((len(self.names), max(len(self._alphabet), 1)), dtype=np.int16)
+        for i, name in enumerate(self.names):
+            for ch in name:
+                self._char_counts[i, self._alphabet[ch]] += 1
+        self._name_lengths = np.array([len(name) for name in self.names], dtype=np.int32)
+
+        # Character ids per position for names of up to 64 characters, used
+        # to build one uint64 match mask per name for bit-parallel LCS
+        self._positions = np.full((len(self.names), 64), -1, dtype=np.int16)
+        for i, name in enumerate(self.names):
+            if len(name) <= 64:
+                self._positions[i, :len(name)] = [self._alphabet[ch] for ch in name]
+        self._short = self._name_lengths <= 64
+        self._length_masks = np.array(
+            [(1 << min(int(length), 64)) - 1 for length in self._name_lengths], dtype=np.uint64
+        )
+
+    def find_in(self, text):
+        """First name (in database order) whose lowercase form occurs in text."""
+        text = text.lower()
+        best = None
+        for size in self._lengths:
+            if size > len(text):
+                break
+            for start in range(len(text) - size + 1):
+                i = self._by_lower.get(text[start:start + size])
+                if i is not None and (best is None or i < best):
+                    best = i
+        return None if best is None else self.names[best]
+
+    def containing(self, fragment, limit=None):
+        """Names whose lowercase form contains fragment, in database order."""
+        fragment = fragment.lower()
+        if not fragment:
+            candidates = range(len(self.names))
+        elif len(fragment) <= 3:
+            candidates = self._postings.get(fragment, ())
+        else:
+            grams = [fragment[j:j + 3] for j in range(len(fragment) - 2)]
+            lists = [self._postings.get(gram, ()) for gram in grams]
+            candidates = min(lists, key=len)
+        matches = []
+        for i in candidates:
+            if fragment in self.names_lower[i]:
+                matches.append(self.names[i])
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
+
+    def close_matches(self, word, n=5, cutoff=0.6):
+        """difflib.get_close_matches over all names, without scoring every name.
+
+        A name's real ratio is bounded from above by its character-multiset
+        ratio (difflib's quick_ratio) and by 2 * LCS / total length. Bounds
+        for all names come from a few NumPy passes; names are then scored
+        best-bound first and the scan stops once no remaining bound can beat
+        the n-th best score, so the result is the same list
+        get_close_matches returns.
+        """
+        if not n > 0:
+            raise ValueError("n must be > 0: %r" % (n,))
+        if not 0.0 <= cutoff <= 1.0:
+            raise ValueError("cutoff must be in [0.0, 1.0]: %r" % (cutoff,))
+        if not self.names:
+            return []
+        query = np.zeros(self._char_counts.shape[1], dtype=np.int16)
+        for ch in word:
+            j = self._alphabet.get(ch)
+            if j is not None:
+                query[j] += 1
+        common = np.minimum(self._char_counts, query).sum(axis=1)
+        # Matching blocks form a common subsequence, so the LCS is a tighter bound
+        common = np.where(self._short, np.minimum(common, self._lcs_lengths(word)), common)
+        total = self._name_lengths + len(word)
+        bound = np.divide(2.0 * common, total, out=np.ones(len(total)), where=total > 0)
+        keep = np.flatnonzero(bound >= cutoff - 1e-9)
+        keep = keep[np.argsort(-bound[keep], kind='stable')]
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(word)
+        best = []  # min-heap of the n best (score, name) so far
+        for i in keep:
+            if len(best) == n and bound[i] < best[0][0] - 1e-9:
+                break
+            name = self.names[i]
+            matcher.set_seq1(name)
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                score = matcher.ratio()
+                if score >= cutoff:
+                    if len(best) < n:
+                        heapq.heappush(best, (score, name))
+                    else:
+                        heapq.heappushpop(best, (score, name))
+        return [name for score, name in heapq.nlargest(n, best)]
+
+    def _lcs_lengths(self, word):
+        # Bit-parallel LCS (Hyyrö) of word against every name at once: one
+        # uint64 per name, one add/and/or per character of word
+        masks = {}
+        v = np.full(len(self.names), np.iinfo(np.uint64).max, dtype=np.uint64)
+        for ch in word:
+            j = self._alphabet.get(ch)
+            if j is None:
+                continue
+            match = masks.get(j)
+            if match is None:
+                bits = np.packbits(self._positions == j, axis=1, bitorder='little')
+                match = masks[j] = bits.view('<u8').ravel().astype(np.uint64)
+            u = v & match
+            v = (v + u) | (v - u)
+        zeros = (~v & self._length_masks).view(np.uint8).reshape(-1, 8)
+        return np.unpackbits(zeros, axis=1).sum(axis=1)
+
+
+def normalize_name(text):
+    """"S.aureus", "s. Aureus" → "s aureus": lowercase, dots as spaces, single spaces."""
+    return ' '.join(text.lower().replace('.', ' ').split())
+
+
+def _prefix_keys(name):
+    # (rank, key): full name first, then "s aureus" abbreviations, then the
+    # species epithet onwards
+    words = normalize_name(name).split()
+    if not words:
+        return []
+    keys = [(0, ' '.join(words))]
+    if len(words) > 1:
+        rest = ' '.join(words[1:])
+        keys.append((1, f"{words[0][0]} {rest}"))
+        keys.append((2, rest))
+    return keys
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over normalized organism names.
+
+    Each name is reachable by its full name, its abbreviated form
+    ("s aureus") and its species epithet ("aureus"). Completions are
+    ranked by key kind, then database order. Results for prefixes of up
+    to ``hot_length`` characters, the ones every keystroke starts with,
+    are precomputed.
+    """
+
+    def __init__(self, names, limit=8, hot_length=3):
+        self.limit = limit
+        self.hot_length = hot_length
+        entries = sorted(
+            (key, rank, i) for i, name in enumerate(names) for rank, key in _prefix_keys(name)
+        )
+        self._keys = [key for key, _, _ in entries]
+        self._entries = [(rank, i) for _, rank, i in entries]
+
+        hot = defaultdict(dict)
+        for key, rank, i in entries:
+            for size in range(1, min(len(key), hot_length) + 1):
+                ranks = hot[key[:size]]
+                if rank < ranks.get(i, rank + 1):
+                    ranks[i] = rank
+        self._hot = {prefix: self._best(ranks, limit) for prefix, ranks in hot.items()}
+
+    @staticmethod
+    def _best(ranks, limit):
+        return [i for rank, i in heapq.nsmallest(limit, ((rank, i) for i, rank in ranks.items()))]
+
+    def complete(self, prefix, limit=None):
+        """Name ids completing prefix, best first."""
+        limit = self.limit if limit is None else limit
+        prefix = normalize_name(prefix)
+        if not prefix:
+            return []
+        if len(prefix) <= self.hot_length and limit <= self.limit:
+            return self._hot.get(prefix, [])[:limit]
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix + '\uffff', lo)
+        ranks = {}
+        for rank, i in self._entries[lo:hi]:
+            if rank < ranks.get(i, rank + 1):
+                ranks[i] = rank
+        return self._best(ranks, limit)
@@ -0,0 +1,149 @@
+"""Session backends: in-memory, signed cookie, or Flask-Session on disk.
+
+``memory`` keeps session data in a dict in the worker process, behind a
+random session id cookie, and sweeps expired sessions periodically.
+``cookie`` is Flask's stateless signed-cookie session: nothing is stored
+server side, so it works across worker processes, but the session is only
+as safe as SECRET_KEY. ``filesystem`` is the original Flask-Session setup.
+None of them touches the disk except ``filesystem``.
+"""
+import secrets
+import threading
+import time
+
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, SessionInterface
+
+SESSION_BACKENDS = ('memory', 'cookie', 'filesystem')
+
+
+class MemorySession(SecureCookieSession):
+    """Session dict with change tracking (from SecureCookieSession) plus its server-side id."""
+
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+
+
+class MemorySessionStore:
+    """sid → (expires at, data), with expired entries swept every sweep_interval seconds."""
+
+    def __init__(self, sweep_interval=60.0, clock=time.time):
+        self.sweep_interval = sweep_interval
+        self._clock = clock
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._next_sweep = clock() + sweep_interval
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, sid):
+        entry = self._sessions.get(sid)
+        if entry is None or entry[0] <= self._clock():
+            return None
+        return entry[1]
+
+    def set(self, sid, data, expires_at):
+        with self._lock:
+            self._sessions[sid] = (expires_at, data)
+        self._maybe_sweep()
+
+    def touch(self, sid, expires_at):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is not None:
+                self._sessions[sid] = (expires_at, entry[1])
+        self._maybe_sweep()
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def sweep(self):
+        """Drop expired sessions; returns how many were dropped."""
+        now = self._clock()
+        with self._lock:
+            expired = [sid for sid, (expires_at, _) in self._sessions.items() if expires_at <= now]
+            for sid in expired:
+                del self._sessions[sid]
+            self._next_sweep = now + self.sweep_interval
+        return len(expired)
+
+    def _maybe_sweep(self):
+        if self._clock() >= self._next_sweep:
+            self.sweep()
+
+
+class MemorySessionInterface(SessionInterface):
+    """Server-side sessions held in process memory.
+
+    A request that leaves the session unchanged only refreshes the stored
+    expiry (and the cookie, if SESSION_REFRESH_EACH_REQUEST is set); data is
+    copied into the store only when it was modified. Sessions are per
+    process, so use the cookie backend when running several workers.
+    """
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else MemorySessionStore()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return MemorySession(data, sid=sid)
+        return MemorySession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if session.modified and session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+                response.vary.add("Cookie")
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        expires_at = time.time() + app.permanent_session_lifetime.total_seconds()
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+            self.store.set(session.sid, dict(session), expires_at)
+        elif session.modified:
+            self.store.set(session.sid, dict(session), expires_at)
+        else:
+            self.store.touch(session.sid, expires_at)
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+        response.vary.add("Cookie")
+
+
+def init_sessions(app, backend='memory'):
+    """Install one of SESSION_BACKENDS on app."""
+    if backend == 'memory':
+        app.session_interface = MemorySessionInterface()
+    elif backend == 'cookie':
+        app.session_interface = SecureCookieSessionInterface()
+    elif backend == 'filesystem':
+        from flask_session import Session
+        app.config['SESSION_TYPE'] = 'filesystem'
+        Session(app)
+    else:
+        raise ValueError(f"Unknown session backend {backend!r}; expected one of {', '.join(SESSION_BACKENDS)}")
+    return app.session_interface
@@ -0,0 +1,268 @@
+"""Phenotype scoring split across worker processes over shared memory.
+
+ShardedScorer copies the arrays PhenotypeMatrix scores on into one
+multiprocessing.shared_memory block and starts one worker process per
+shard, each owning a contiguous slice of the organisms. Workers map their
+slice without copying it, score every query of a request against it and
+send back only their local top n. The parent merges those lists with a
+heap, ties broken by database order as in top_n, so the matches equal
+in-process scoring exactly.
+
+Workers stay up between requests and are restarted when a different
+index (e.g. a reloaded database) is scored; the old workers finish the
+requests already running on them first. Databases smaller than min_size,
+and every database when workers is 0, are scored in-process.
+
+Workers are spawned, not forked, so a threaded server can start them
+safely. A spawned process re-runs the script that started it as
+``__mp_main__``, so scripts that can start workers (PHytonAILLM.py,
+asgi.py, bacdoc_cli.py, benchmark.py) skip importing and loading the app
+under that name: workers score from shared memory only.
+"""
+import atexit
+import heapq
+import multiprocessing
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from phenotype_matrix import CategoricalColumn, PhenotypeMatrix, top_n
+
+_CATEGORICAL = ('origin', 'aerobicity', 'morphology', 'gram')
+_ALIGN = 64
+
+# The shard a worker process owns: (shared memory block, matrix over its slice, first position)
+_shard = None
+
+
+def _layout(arrays):
+    """({name: (offset, shape, dtype)}, total bytes) packing arrays back to back, 64-byte aligned."""
+    spec, offset = {}, 0
+    for name, array in arrays.items():
+        spec[name] = (offset, array.shape, array.dtype.str)
+        offset += -(-array.nbytes // _ALIGN) * _ALIGN
+    return spec, max(offset, _ALIGN)
+
+
+def _views(buffer, spec):
+    return {
+        name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+        for name, (offset, shape, dtype) in spec.items()
+    }
+
+
+def _share(matrix):
+    """Copy matrix's scoring arrays into a new shared memory block; returns (block, spec)."""
+    arrays = {
+        'temps': matrix.temps, 'has_temp': matrix.has_temp,
+        'phs': matrix.phs, 'has_ph': matrix.has_ph,
+        **{f'{name}_codes': getattr(matrix, name).codes for name in _CATEGORICAL},
+    }
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    spec, size = _layout(arrays)
+    block = shared_memory.SharedMemory(create=True, size=size)
+    for name, view in _views(block.buf, spec).items():
+        view[...] = arrays[name]
+    return block, spec
+
+
+def _init_worker(block_name, spec, categories, start, stop):
+    global _shard
+    block = shared_memory.SharedMemory(name=block_name)
+    arrays = {name: view[start:stop] for name, view in _views(block.buf, spec).items()}
+    columns = {
+        name: CategoricalColumn.from_codes(arrays[f'{name}_codes'], categories[name]) for name in _CATEGORICAL
+    }
+    matrix = PhenotypeMatrix.scoring_only(
+        arrays['temps'], arrays['has_temp'], arrays['phs'], arrays['has_ph'],
+        columns['origin'], columns['aerobicity'], columns['morphology'], columns['gram'],
+    )
+    _shard = (block, matrix, start)
+
+
+def _ready():
+    return _shard is not None
+
+
+def local_top_n(matrix, queries, n, scoring, prefilter=(None, None), start=0):
+    """[(positions, distances)] of the n closest rows of matrix per query, positions offset by start.
+
+    Mirrors the in-process batch path: queries are scored in blocks of
+    matrix.batch_size(), with the pre-filter applied per block.
+    """
+    results = []
+    block_size = matrix.batch_size()
+    for offset in range(0, len(queries), block_size):
+        block = queries[offset:offset + block_size]
+        selection = matrix.candidates(block, *prefilter)
+        if selection is None:
+            for dist in matrix.batch_distances(block, scoring):
+                best = top_n(dist, n)
+                results.append(((best + start).tolist(), dist[best].tolist()))
+            continue
+        rows, keep = selection
+        for dist, kept in zip(matrix.batch_distances(block, scoring, rows), keep):
+            dist = np.where(kept, dist, np.inf)
+            best = top_n(dist, n)
+            results.append(((rows[best] + start).tolist(), dist[best].tolist()))
+    return results
+
+
+def _score_shard(queries, n, scoring, prefilter):
+    _, matrix, start = _shard
+    return local_top_n(matrix, queries, n, scoring, prefilter, start)
+
+
+def merge_top_n(shard_results, n):
+    """Merge per-shard (positions, distances) lists of one query into the overall top n positions."""
+    merged = heapq.merge(*(zip(distances, positions) for positions, distances in shard_results))
+    return np.array([position for _, position in islice(merged, n)], dtype=np.intp)
+
+
+class _Shards:
+    """The workers and shared memory block started for one index."""
+
+    def __init__(self, index, workers):
+        self.index = index
+        # Requests scoring on these workers; retired shards are closed when the last one finishes
+        self.users = 0
+        self.retired = False
+        self.executors = []
+        self.block, spec = _share(index.matrix)
+        try:
+            categories = {name: getattr(index.matrix, name).categories for name in _CATEGORICAL}
+            count = max(1, min(workers, len(index)))
+            bounds = np.linspace(0, len(index), count + 1).astype(int).tolist()
+            context = multiprocessing.get_context('spawn')
+            self.executors = [
+                ProcessPoolExecutor(1, mp_context=context, initializer=_init_worker,
+                                    initargs=(self.block.name, spec, categories, start, stop))
+                for start, stop in zip(bounds, bounds[1:])
+            ]
+            # Start every worker now, in parallel, rather than on the first request
+            for future in [executor.submit(_ready) for executor in self.executors]:
+                future.result()
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+        self.executors = []
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+
+class ShardedScorer:
+    """Top-n phenotype matches computed by a persistent pool of shard workers.
+
+    current, if given, returns the index being served (e.g. the database
+    snapshot). Workers are only started for that index: a request still
+    holding a replaced snapshot is scored in-process instead of restarting
+    them, and so is every request that arrives while they are starting.
+    """
+
+    def __init__(self, workers=0, min_size=50000, current=None):
+        self.workers = workers
+        self.min_size = min_size
+        self.current = current
+        self._lock = threading.Lock()
+        self._shards = None
+        # Token of the _Shards being started outside the lock, if any
+        self._building = None
+        atexit.register(self.close)
+
+    def applies(self, index):
+        """Whether index is large enough to be scored by the workers."""
+        return self.workers > 0 and len(index) >= max(1, self.min_size)
+
+    def top_n(self, index, queries, n, scoring, prefilter=(None, None)):
+        """Array of the n closest database positions per query, as top_n over in-process distances.
+
+        queries are (origin, temp, pH, aerobicity, morphology, gram) tuples.
+        """
+        queries = list(queries)
+        shards = self._acquire(index) if self.applies(index) else None
+        if shards is None:
+            return [np.array(p, dtype=np.intp) for p, _ in local_top_n(index.matrix, queries, n, scoring, prefilter)]
+        try:
+            futures = [executor.submit(_score_shard, queries, n, scoring, tuple(prefilter))
+                       for executor in shards.executors]
+            per_shard = [future.result() for future in futures]
+        except (RuntimeError, CancelledError) as e:
+            # A worker died (e.g. killed for memory), or the scorer was closed meanwhile:
+            # answer in-process; dead workers are replaced on the next call
+            if isinstance(e, BrokenProcessPool):
+                self._retire(shards)
+            return [np.array(p, dtype=np.intp) for p, _ in local_top_n(index.matrix, queries, n, scoring, prefilter)]
+        finally:
+            self._release(shards)
+        return [merge_top_n([results[q] for results in per_shard], n) for q in range(len(queries))]
+
+    def _acquire(self, index):
+        """Shards for index with one more user, or None if index should be scored in-process."""
+        with self._lock:
+            if self._shards is not None and self._shards.index is index:
+                self._shards.users += 1
+                return self._shards
+            if self._building is not None or (self.current is not None and self.current() is not index):
+                return None
+            retired, self._shards = self._shards, None
+            idle = retired is not None and not retired.users
+            if retired is not None:
+                retired.retired = True
+            token = self._building = object()
+        if idle:
+            retired.close()
+        # Starting workers takes seconds; other callers score in-process meanwhile
+        try:
+            shards = _Shards(index, self.workers)
+        except BaseException:
+            with self._lock:
+                if self._building is token:
+                    self._building = None
+            raise
+        with self._lock:
+            installed = self._building is token
+            if installed:
+                self._building = None
+                self._shards = shards
+                shards.users += 1
+        if not installed:
+            # close() was called while the workers were starting
+            shards.close()
+            return None
+        return shards
+
+    def _release(self, shards):
+        with self._lock:
+            shards.users -= 1
+            idle = shards.retired and not shards.users
+        if idle:
+            shards.close()
+
+    def _retire(self, shards):
+        # Replaced on the next _acquire; closed once its last user is done
+        with self._lock:
+            shards.retired = True
+            if self._shards is shards:
+                self._shards = None
+
+    def close(self):
+        """Stop the workers and free the shared memory once no request uses them; the next top_n starts them again."""
+        with self._lock:
+            self._building = None
+            shards, self._shards = self._shards, None
+            if shards is None:
+                return
+            shards.retired = True
+            idle = not shards.users
+        if idle:
+            shards.close()
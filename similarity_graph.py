@@ -0,0 +1,248 @@
+"""k-nearest-neighbour graph over the organisms, with each neighbourhood's hybrid medium.
+
+Every organism is scored as a query built from its own phenotype (first
+listed temperature and pH, see evaluation.holdout_queries) against the
+whole database with Equation 2, and its k closest organisms of another
+name are kept, ties broken by database order as in top_n. The graph is
+stored CSR-style: the neighbours of organism i are
+``indices[indptr[i]:indptr[i + 1]]``, closest first, with ``distances``
+and ``valid`` (the neighbour has usable media) alongside.
+
+Each neighbourhood's hybrid medium is precomputed as well:
+``media_slots`` / ``media_items`` (split by ``media_indptr``) list which
+valid neighbour and which of its optimal-media ingredients go into it,
+grouped by component in collect_compositions order. Serving "similar
+organisms" is then a slice per organism instead of a scan over the
+database.
+
+update() derives the graph of an edited database from the previous one.
+Rows are matched by content; an organism keeps its neighbourhood when all
+its neighbours are unchanged and no new or edited row comes at least as
+close as its k-th neighbour. Only the remaining organisms are rescored, so
+the result equals a full build.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from evaluation import holdout_queries, label_codes
+from phenotype_matrix import top_n
+
+GRAPH_FORMAT = 1
+
+_ARRAYS = ('indptr', 'indices', 'distances', 'valid', 'media_indptr', 'media_slots', 'media_items')
+
+
+def graph_path(filepath):
+    """Centraldatabase.csv → Centraldatabase.graph.npz"""
+    return os.path.splitext(filepath)[0] + '.graph.npz'
+
+
+def profile_key(scoring):
+    """Short hash of a scoring profile's weights and penalties."""
+    constants = np.concatenate([scoring.weights, scoring.penalties]).astype('<f8')
+    return hashlib.sha1(constants.tobytes()).hexdigest()[:12]
+
+
+def _floats(values):
+    return tuple(float(v) for v in values or ())
+
+
+def _fingerprint(record, media_filter, hybrid_ingredients):
+    # Everything a row contributes to its own neighbourhood and to the ones it is part of
+    return (
+        record.name, _floats(record.temp_values), _floats(record.ph_values),
+        record.origin, record.aerobicity, record.morphology, record.gram,
+        bool(media_filter(record)),
+        tuple((j, item.name, None if item.amount is None else float(item.amount), item.unit, bool(item.scalable))
+              for j, item in hybrid_ingredients(record)),
+    )
+
+
+def _nearest(index, rows, k, scoring, queries, labels):
+    """{row: (positions, distances)} of the k closest organisms of another name for each row."""
+    matrix = index.matrix
+    block_size = max(1, min(256, matrix.batch_size()))
+    nearest = {}
+    for start in range(0, len(rows), block_size):
+        block = np.asarray(rows[start:start + block_size], dtype=np.intp)
+        dist = matrix.batch_distances([queries[r] for r in block], scoring)
+        dist[labels[None, :] == labels[block, None]] = np.inf
+        for row, row_dist in zip(block.tolist(), dist):
+            best = top_n(row_dist, k)
+            nearest[row] = (best, row_dist[best])
+    return nearest
+
+
+def _medium(records, positions, media_filter, hybrid_ingredients):
+    """(valid flag per neighbour, [(slot, ingredient position), ...] grouped by component)."""
+    valid = np.array([bool(media_filter(records[p])) for p in positions.tolist()], dtype=bool)
+    groups = {}
+    for slot, position in enumerate(positions[valid].tolist()):
+        for j, item in hybrid_ingredients(records[position]):
+            groups.setdefault(item.name, []).append((slot, j))
+    return valid, [entry for entries in groups.values() for entry in entries]
+
+
+def _csr(parts, dtype, width=None):
+    indptr = np.zeros(len(parts) + 1, dtype=np.int64)
+    np.cumsum([len(part) for part in parts], out=indptr[1:])
+    shape = (int(indptr[-1]),) if width is None else (int(indptr[-1]), width)
+    flat = np.empty(shape, dtype=dtype)
+    for start, part in zip(indptr.tolist(), parts):
+        if len(part):
+            flat[start:start + len(part)] = part
+    return indptr, flat
+
+
+class SimilarityGraph:
+    """Nearest organisms of every organism and their precomputed hybrid media."""
+
+    def __init__(self, version, k, profile, indptr, indices, distances, valid, media_indptr, media_slots,
+                 media_items):
+        self.version = version
+        self.k = k
+        self.profile = profile
+        self.indptr = indptr
+        self.indices = indices
+        self.distances = distances
+        self.valid = valid
+        self.media_indptr = media_indptr
+        self.media_slots = media_slots
+        self.media_items = media_items
+
+    @classmethod
+    def build(cls, index, k, scoring, media_filter, hybrid_ingredients):
+        """Graph of every organism in index.
+
+        media_filter(record) says whether a neighbour's media can go into a
+        hybrid; hybrid_ingredients(record) lists the (ingredient position,
+        ingredient) pairs it contributes.
+        """
+        rows = list(range(len(index)))
+        nearest = _nearest(index, rows, k, scoring, holdout_queries(index), label_codes(index))
+        return cls._assemble(index, k, scoring, [nearest[row] for row in rows], [None] * len(rows),
+                             media_filter, hybrid_ingredients)
+
+    @classmethod
+    def _assemble(cls, index, k, scoring, neighbours, media, media_filter, hybrid_ingredients):
+        media = [
+            _medium(index.records, neighbours[row][0], media_filter, hybrid_ingredients) if medium is None else medium
+            for row, medium in enumerate(media)
+        ]
+        indptr, indices = _csr([positions for positions, _ in neighbours], np.int32)
+        _, distances = _csr([dist for _, dist in neighbours], np.float64)
+        _, valid = _csr([flags for flags, _ in media], bool)
+        media_indptr, entries = _csr([np.array(e, dtype=np.int32).reshape(-1, 2) for _, e in media], np.int32, 2)
+        return cls(index.version, k, profile_key(scoring), indptr, indices, distances, valid,
+                   media_indptr, np.ascontiguousarray(entries[:, 0]), np.ascontiguousarray(entries[:, 1]))
+
+    def update(self, previous_index, index, k, scoring, media_filter, hybrid_ingredients, max_changed=None):
+        """Graph of index, reusing this graph of previous_index where rows are unchanged.
+
+        Returns None when the graph is not for previous_index (or for other
+        settings), when unchanged rows were reordered, or when more than
+        max_changed rows are new or edited; build a new graph then.
+        """
+        if (self.version, self.k, self.profile) != (previous_index.version, k, profile_key(scoring)):
+            return None
+        unmatched = {}
+        for old, record in enumerate(previous_index.records):
+            unmatched.setdefault(_fingerprint(record, media_filter, hybrid_ingredients), []).append(old)
+        old_of = np.full(len(index), -1, dtype=np.intp)
+        for row, record in enumerate(index.records):
+            olds = unmatched.get(_fingerprint(record, media_filter, hybrid_ingredients))
+            if olds:
+                old_of[row] = olds.pop(0)
+        kept = np.flatnonzero(old_of >= 0)
+        changed = np.flatnonzero(old_of < 0)
+        # Ties are broken by database order, which only holds if unchanged rows keep their order
+        if np.any(np.diff(old_of[kept]) < 0):
+            return None
+        if max_changed is not None and len(changed) > max_changed:
+            return None
+        new_of = np.full(len(previous_index), -1, dtype=np.intp)
+        new_of[old_of[kept]] = kept
+
+        queries = holdout_queries(index)
+        labels = label_codes(index)
+        rescore = np.zeros(len(index), dtype=bool)
+        rescore[changed] = True
+        # Distance a new or edited row has to beat to join a kept neighbourhood
+        kth = np.full(len(index), np.inf)
+        for row, old in zip(kept.tolist(), old_of[kept].tolist()):
+            start, stop = self.indptr[old], self.indptr[old + 1]
+            if np.any(new_of[self.indices[start:stop]] < 0):
+                rescore[row] = True
+            elif stop - start == self.k:
+                kth[row] = self.distances[stop - 1]
+        if len(changed):
+            candidates = kept[~rescore[kept]]
+            block_size = max(1, min(256, index.matrix.batch_size()))
+            for start in range(0, len(candidates), block_size):
+                block = candidates[start:start + block_size]
+                dist = index.matrix.batch_distances([queries[r] for r in block], scoring, changed)
+                dist[labels[None, changed] == labels[block, None]] = np.inf
+                rescore[block] |= (np.isfinite(dist) & (dist <= kth[block, None])).any(axis=1)
+
+        nearest = _nearest(index, np.flatnonzero(rescore).tolist(), k, scoring, queries, labels)
+        neighbours, media = [], []
+        for row in range(len(index)):
+            if rescore[row]:
+                neighbours.append(nearest[row])
+                media.append(None)
+                continue
+            old = old_of[row]
+            start, stop = self.indptr[old], self.indptr[old + 1]
+            m_start, m_stop = self.media_indptr[old], self.media_indptr[old + 1]
+            neighbours.append((new_of[self.indices[start:stop]], self.distances[start:stop]))
+            media.append((self.valid[start:stop],
+                          np.stack([self.media_slots[m_start:m_stop], self.media_items[m_start:m_stop]], axis=1)))
+        return self._assemble(index, k, scoring, neighbours, media, media_filter, hybrid_ingredients)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def neighbours(self, position):
+        """(positions, distances) of an organism's neighbours, closest first."""
+        start, stop = self.indptr[position], self.indptr[position + 1]
+        return self.indices[start:stop], self.distances[start:stop]
+
+    def hybrid(self, position):
+        """(source positions, [(slot, ingredient position), ...]) of an organism's neighbourhood medium.
+
+        Sources are the neighbours with usable media, closest first; slot
+        indexes them. Entries are grouped by component.
+        """
+        start, stop = self.indptr[position], self.indptr[position + 1]
+        sources = self.indices[start:stop][self.valid[start:stop]]
+        m_start, m_stop = self.media_indptr[position], self.media_indptr[position + 1]
+        entries = zip(self.media_slots[m_start:m_stop].tolist(), self.media_items[m_start:m_stop].tolist())
+        return sources.tolist(), list(entries)
+
+    def save(self, path):
+        """Write the graph to path (.npz), replacing it atomically."""
+        meta = {'format': GRAPH_FORMAT, 'version': self.version, 'k': self.k, 'profile': self.profile}
+        staging = f"{path}.tmp{os.getpid()}"
+        with open(staging, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **{name: getattr(self, name) for name in _ARRAYS})
+        os.replace(staging, path)
+        return path
+
+    @classmethod
+    def load(cls, path, version, k, scoring):
+        """Graph saved at path, or None if it is missing, unreadable or built for other data or settings."""
+        expected = {'format': GRAPH_FORMAT, 'version': version, 'k': k, 'profile': profile_key(scoring)}
+        try:
+            with np.load(path) as data:
+                if json.loads(str(data['meta'])) != expected:
+                    return None
+                arrays = {name: data[name] for name in _ARRAYS}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring similarity graph {path}: {e}")
+            return None
+        return cls(version, k, expected['profile'], **arrays)
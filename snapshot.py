@@ -0,0 +1,228 @@
+"""Precompiled, memory-mappable snapshot of an OrganismIndex.
+
+A snapshot is a directory next to the CSV (Centraldatabase.snapshot/)
+holding the parsed database as plain .npy arrays:
+
+* a packed string table (one UTF-8 blob plus offsets) that every cell,
+  category and ingredient name points into by id;
+* ``cells``: (rows, columns) string ids of the raw CSV cells, -1 for empty;
+* the phenotype arrays and categorical codes PhenotypeMatrix scores on;
+* per media kind, the parsed ingredients in CSR form;
+* the packed biochemical test bitsets and their vocabulary.
+
+Loading it skips pandas and all text parsing. Numeric arrays are opened
+with ``mmap_mode='r'``, so gunicorn workers on one host share them through
+the page cache. ``meta.json`` records the format and the content version of
+the CSV it was built from; a snapshot whose version does not match the
+current CSV is ignored.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from biochemical_index import BiochemicalIndex
+from compositions import Ingredient
+from organism_index import MEDIA_KINDS, OrganismIndex, OrganismRecord
+from phenotype_matrix import CategoricalColumn, PhenotypeMatrix
+
+SNAPSHOT_FORMAT = 2
+
+# PhenotypeMatrix attribute → record attribute of each categorical column
+_CATEGORICAL = ('origin', 'aerobicity', 'morphology', 'gram')
+
+
+def snapshot_path(filepath):
+    """Centraldatabase.csv → Centraldatabase.snapshot"""
+    return os.path.splitext(filepath)[0] + '.snapshot'
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+
+    def intern(self, text):
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.ids)
+        return string_id
+
+    def arrays(self):
+        encoded = [text.encode('utf-8') for text in self.ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(blob, offsets):
+    data = blob.tobytes()
+    bounds = offsets.tolist()
+    return [data[a:b].decode('utf-8') for a, b in zip(bounds, bounds[1:])]
+
+
+def write_snapshot(index, directory):
+    """Write index to directory, replacing any snapshot already there.
+
+    The snapshot is assembled in a temporary sibling directory and moved
+    into place, so a worker starting meanwhile reads the old snapshot or
+    the new one, never half of each. Only text columns can be stored;
+    raises ValueError for any other cell value.
+    """
+    strings = _StringTable()
+    arrays = {}
+
+    cells = np.full((len(index.records), len(index.columns)), -1, dtype=np.int32)
+    for i, record in enumerate(index.records):
+        for j, column in enumerate(index.columns):
+            value = record.raw.get(column)
+            if isinstance(value, str):
+                cells[i, j] = strings.intern(value)
+            elif not (value is None or value != value):
+                raise ValueError(f"Row {i} column {column!r} is not text: {value!r}")
+    arrays['cells'] = cells
+
+    matrix = index.matrix
+    arrays['temps'], arrays['has_temp'] = np.asarray(matrix.temps), np.asarray(matrix.has_temp)
+    arrays['phs'], arrays['has_ph'] = np.asarray(matrix.phs), np.asarray(matrix.has_ph)
+    for name in _CATEGORICAL:
+        column = getattr(matrix, name)
+        arrays[f'{name}_codes'] = np.asarray(column.codes, dtype=np.int32)
+        arrays[f'{name}_categories'] = np.array([strings.intern(c) for c in column.categories], dtype=np.int32)
+
+    for kind in MEDIA_KINDS:
+        indptr, names, amounts, units, scalable = [0], [], [], [], []
+        for record in index.records:
+            for item in record.ingredients(kind):
+                names.append(strings.intern(item.name))
+                amounts.append(np.nan if item.amount is None else item.amount)
+                units.append(strings.intern(item.unit))
+                scalable.append(item.scalable)
+            indptr.append(len(names))
+        arrays[f'{kind}_indptr'] = np.array(indptr, dtype=np.int64)
+        arrays[f'{kind}_names'] = np.array(names, dtype=np.int32)
+        arrays[f'{kind}_amounts'] = np.array(amounts, dtype=np.float64)
+        arrays[f'{kind}_units'] = np.array(units, dtype=np.int32)
+        arrays[f'{kind}_scalable'] = np.array(scalable, dtype=bool)
+
+    biochemical = index.biochemical
+    arrays['test_vocabulary'] = np.array([strings.intern(name) for name in biochemical.vocabulary], dtype=np.int32)
+    arrays['test_positive'] = np.asarray(biochemical.positive)
+    arrays['test_known'] = np.asarray(biochemical.known)
+
+    arrays['strings'], arrays['string_offsets'] = strings.arrays()
+    meta = {
+        'format': SNAPSHOT_FORMAT,
+        'version': index.version,
+        'columns': index.columns,
+        'size': len(index.records),
+        'arrays': sorted(arrays),
+    }
+
+    directory = os.path.abspath(directory)
+    staging = f"{directory}.tmp{os.getpid()}"
+    retired = f"{directory}.old{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f'{name}.npy'), array)
+    with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1)
+    if os.path.exists(directory):
+        os.rename(directory, retired)
+    os.rename(staging, directory)
+    # Workers that still map the old files keep them until they unmap
+    shutil.rmtree(retired, ignore_errors=True)
+    return directory
+
+
+def read_meta(directory):
+    """meta.json of a snapshot, or None if there is no snapshot there."""
+    try:
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_snapshot(directory, version=None):
+    """OrganismIndex from a snapshot, or None if it is missing, unreadable or not for version."""
+    meta = read_meta(directory)
+    if meta is None or meta.get('format') != SNAPSHOT_FORMAT:
+        return None
+    if version is not None and meta.get('version') != version:
+        return None
+    try:
+        return _load(directory, meta)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        print(f"Ignoring snapshot {directory}: {e}")
+        return None
+
+
+def _load(directory, meta):
+    def array(name):
+        return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+    strings = _unpack_strings(array('strings'), array('string_offsets'))
+    columns = meta['columns']
+    cells = array('cells')
+    if cells.shape != (meta['size'], len(columns)):
+        raise ValueError(f"cells has shape {cells.shape}, expected {(meta['size'], len(columns))}")
+    nan = float('nan')
+    rows = [
+        {column: strings[cell] if cell >= 0 else nan for column, cell in zip(columns, row)}
+        for row in cells.tolist()
+    ]
+
+    temps, has_temp = array('temps'), array('has_temp')
+    phs, has_ph = array('phs'), array('has_ph')
+    columns_by_name = {
+        name: CategoricalColumn.from_codes(
+            array(f'{name}_codes'), [strings[s] for s in array(f'{name}_categories').tolist()]
+        )
+        for name in _CATEGORICAL
+    }
+    values = {
+        name: [column.categories[c] for c in column.codes.tolist()]
+        for name, column in columns_by_name.items()
+    }
+
+    ingredients = {}
+    for kind in MEDIA_KINDS:
+        indptr = array(f'{kind}_indptr').tolist()
+        items = [
+            Ingredient(strings[name], None if amount != amount else amount, strings[unit], scalable)
+            for name, amount, unit, scalable in zip(
+                array(f'{kind}_names').tolist(), array(f'{kind}_amounts').tolist(),
+                array(f'{kind}_units').tolist(), array(f'{kind}_scalable').tolist(),
+            )
+        ]
+        ingredients[kind] = [tuple(items[a:b]) for a, b in zip(indptr, indptr[1:])]
+
+    temp_lists = _value_lists(temps, has_temp)
+    ph_lists = _value_lists(phs, has_ph)
+    records = [
+        OrganismRecord.from_parsed(
+            i, row, temp_lists[i], ph_lists[i],
+            values['origin'][i], values['aerobicity'][i], values['morphology'][i], values['gram'][i],
+            ingredients['optimal'][i], ingredients['differential'][i],
+        )
+        for i, row in enumerate(rows)
+    ]
+    matrix = PhenotypeMatrix.from_arrays(
+        records, temps, has_temp, phs, has_ph,
+        columns_by_name['origin'], columns_by_name['aerobicity'],
+        columns_by_name['morphology'], columns_by_name['gram'],
+    )
+    biochemical = BiochemicalIndex.from_arrays(
+        [strings[s] for s in array('test_vocabulary').tolist()], array('test_positive'), array('test_known'),
+    )
+    return OrganismIndex.from_records(records, meta['version'], columns, matrix, biochemical)
+
+
+def _value_lists(matrix, present):
+    # Padded (N, width) rows back to the parsed lists; +inf is padding
+    return [
+        [v for v in row if v != np.inf] if has else None
+        for row, has in zip(matrix.tolist(), present.tolist())
+    ]
@@ -0,0 +1,214 @@
+"""SQLite parse cache of the organism database.
+
+The parsed database is written to one local SQLite file:
+
+* ``organisms``: one row per CSV row (``position`` is the database order),
+  with the cleaned category values and the raw CSV cells as JSON;
+* ``temperatures`` / ``ph_values``: every listed value per organism;
+* ``ingredients`` / ``compositions``: parsed per-100 ml ingredients.
+
+With BACDOC_SQLITE_STORE set, read_store builds the OrganismIndex from
+this file instead of parsing the CSV. It is a cache of the parse and
+nothing more: nothing queries the file, every worker still holds the
+whole index in memory, and nothing is shared between workers (the
+memory-mapped snapshot, see snapshot.py, is what shares memory).
+``meta`` records the format and the content version of the CSV the file
+was built from; a file for another version is ignored.
+"""
+import json
+import os
+import sqlite3
+
+from compositions import Ingredient
+from organism_index import MEDIA_KINDS, OrganismIndex, OrganismRecord
+from phenotype_matrix import PhenotypeMatrix
+
+STORE_FORMAT = 2
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE organisms (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    aerobicity TEXT NOT NULL,
+    morphology TEXT NOT NULL,
+    gram TEXT NOT NULL,
+    raw TEXT NOT NULL
+);
+CREATE TABLE temperatures (
+    organism INTEGER NOT NULL REFERENCES organisms,
+    seq INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (organism, seq)
+) WITHOUT ROWID;
+CREATE TABLE ph_values (
+    organism INTEGER NOT NULL REFERENCES organisms,
+    seq INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (organism, seq)
+) WITHOUT ROWID;
+CREATE TABLE ingredients (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE compositions (
+    organism INTEGER NOT NULL REFERENCES organisms,
+    kind TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    ingredient INTEGER NOT NULL REFERENCES ingredients,
+    amount REAL,
+    unit TEXT NOT NULL,
+    scalable INTEGER NOT NULL,
+    PRIMARY KEY (organism, kind, seq)
+) WITHOUT ROWID;
+"""
+
+
+def store_path(filepath):
+    """Centraldatabase.csv → Centraldatabase.sqlite"""
+    return os.path.splitext(filepath)[0] + '.sqlite'
+
+
+def _cell(value):
+    if isinstance(value, str):
+        return value
+    if value is None or value != value:
+        return None
+    return value
+
+
+def _insert(connection, index):
+    ids = {}
+
+    def intern(name):
+        key = ids.get(name)
+        if key is None:
+            key = ids[name] = len(ids) + 1
+        return key
+
+    organisms, temperatures, phs, compositions = [], [], [], []
+    for record in index.records:
+        p = record.position
+        raw = {column: cell for column, cell in ((c, _cell(record.raw.get(c))) for c in index.columns)
+               if cell is not None}
+        name = record.name if isinstance(record.name, str) else ''
+        organisms.append((p, name, record.origin, record.aerobicity, record.morphology, record.gram,
+                          json.dumps(raw, ensure_ascii=False)))
+        temperatures.extend((p, seq, value) for seq, value in enumerate(record.temp_values or ()))
+        phs.extend((p, seq, value) for seq, value in enumerate(record.ph_values or ()))
+        for kind in MEDIA_KINDS:
+            compositions.extend(
+                (p, kind, seq, intern(item.name), item.amount, item.unit, int(item.scalable))
+                for seq, item in enumerate(record.ingredients(kind))
+            )
+
+    connection.executemany("INSERT INTO organisms VALUES (?, ?, ?, ?, ?, ?, ?)", organisms)
+    connection.executemany("INSERT INTO temperatures VALUES (?, ?, ?)", temperatures)
+    connection.executemany("INSERT INTO ph_values VALUES (?, ?, ?)", phs)
+    connection.executemany("INSERT INTO ingredients (name, id) VALUES (?, ?)", ids.items())
+    connection.executemany("INSERT INTO compositions VALUES (?, ?, ?, ?, ?, ?, ?)", compositions)
+
+
+def write_store(index, path):
+    """Write index to an SQLite file at path, replacing any store already there.
+
+    The file is built under a temporary name and renamed into place, so a
+    worker opening it meanwhile sees the old store or the new one, never
+    half of each.
+    """
+    path = os.path.abspath(path)
+    staging = f"{path}.tmp{os.getpid()}"
+    if os.path.exists(staging):
+        os.remove(staging)
+    connection = sqlite3.connect(staging)
+    try:
+        connection.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;")
+        with connection:
+            connection.executescript(SCHEMA)
+            _insert(connection, index)
+            meta = {
+                'format': STORE_FORMAT,
+                'version': index.version,
+                'columns': index.columns,
+                'size': len(index.records),
+            }
+            connection.executemany("INSERT INTO meta VALUES (?, ?)",
+                                   [(key, json.dumps(value)) for key, value in meta.items()])
+    except BaseException:
+        connection.close()
+        os.remove(staging)
+        raise
+    connection.close()
+    os.replace(staging, path)
+    return path
+
+
+def _read_meta(connection):
+    return {key: json.loads(value) for key, value in connection.execute("SELECT key, value FROM meta")}
+
+
+def read_meta(path):
+    """meta of a store, or None if there is no readable store at path."""
+    if not os.path.exists(path):
+        return None
+    try:
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return _read_meta(connection)
+        finally:
+            connection.close()
+    except (sqlite3.Error, ValueError):
+        return None
+
+
+def read_store(path, version=None):
+    """OrganismIndex from a store, or None if it is missing, unreadable or not for version."""
+    meta = read_meta(path)
+    if meta is None or meta.get('format') != STORE_FORMAT:
+        return None
+    if version is not None and meta.get('version') != version:
+        return None
+    try:
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            return _load(connection, meta, path)
+        finally:
+            connection.close()
+    except (sqlite3.Error, ValueError, KeyError) as e:
+        print(f"Ignoring SQLite store {path}: {e}")
+        return None
+
+
+def _values(connection, table):
+    groups = {}
+    for position, value in connection.execute(f"SELECT organism, value FROM {table} ORDER BY organism, seq"):
+        groups.setdefault(position, []).append(value)
+    return groups
+
+
+def _ingredients(connection, kind):
+    groups = {}
+    for position, name, amount, unit, scalable in connection.execute(
+            "SELECT c.organism, i.name, c.amount, c.unit, c.scalable FROM compositions c "
+            "JOIN ingredients i ON i.id = c.ingredient WHERE c.kind = ? ORDER BY c.organism, c.seq", (kind,)):
+        groups.setdefault(position, []).append(Ingredient(name, amount, unit, bool(scalable)))
+    return groups
+
+
+def _load(connection, meta, path):
+    """The whole store as an OrganismIndex, equal to one built from the CSV."""
+    columns = meta['columns']
+    nan = float('nan')
+    temps = _values(connection, 'temperatures')
+    phs = _values(connection, 'ph_values')
+    ingredients = {kind: _ingredients(connection, kind) for kind in MEDIA_KINDS}
+    records = []
+    for position, raw, origin, aerobicity, morphology, gram in connection.execute(
+            "SELECT position, raw, origin, aerobicity, morphology, gram FROM organisms ORDER BY position"):
+        cells = json.loads(raw)
+        records.append(OrganismRecord.from_parsed(
+            position, {column: cells.get(column, nan) for column in columns}, temps.get(position),
+            phs.get(position), origin, aerobicity, morphology, gram,
+            tuple(ingredients['optimal'].get(position, ())), tuple(ingredients['differential'].get(position, ())),
+        ))
+    if len(records) != meta['size'] or any(r.position != i for i, r in enumerate(records)):
+        raise ValueError(f"{path} does not hold positions 0..{meta['size'] - 1}")
+    return OrganismIndex.from_records(records, meta['version'], columns, PhenotypeMatrix(records))
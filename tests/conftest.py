@@ -0,0 +1,54 @@
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATABASE = os.path.join(ROOT, 'Centraldatabase.csv')
+TEMP_COLUMN = 'Optimal Growth Temperature (°C)'
+PH_COLUMN = 'Optimal Growth pH'
+
+
+@pytest.fixture(scope='session')
+def bacdoc():
+    import PHytonAILLM
+    # Imported from another directory, the app found no Centraldatabase.csv
+    if os.path.abspath(PHytonAILLM.database.filepath) != DATABASE:
+        PHytonAILLM.database.use(DATABASE)
+    return PHytonAILLM
+
+
+@pytest.fixture(scope='session')
+def index(bacdoc):
+    """The shipped database, parsed from the CSV (never from a snapshot)."""
+    return bacdoc.build_index(DATABASE, use_snapshot=False)
+
+
+@pytest.fixture
+def client(bacdoc):
+    """Flask test client logged in as the built-in user."""
+    client = bacdoc.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'bacdoc123'})
+    return client
+
+
+def random_queries(index, count, seed=0):
+    """Unknown-isolate profiles mixing real database values, partial input and junk."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        raw = rng.choice(index.records).raw
+        origin = raw.get('Origin/Source')
+        origin = origin if isinstance(origin, str) else ''
+        queries.append((
+            rng.choice([origin, origin[:4], 'soil', 'SOIL ', 'nan', '']),
+            rng.choice([str(raw.get(TEMP_COLUMN)), '37', '30 C', '55.5', '4', '', 'warm']),
+            rng.choice([str(raw.get(PH_COLUMN)), '7', '6.5', 'pH 3', '', 'neutral']),
+            rng.choice([str(raw.get('Optimal Growth Aerobic Conditions')), 'aerobe', '']),
+            rng.choice([str(raw.get('Morphology')), 'Rod', '']),
+            rng.choice([str(raw.get('Gram Nature')), 'gram negative', '']),
+        ))
+    return queries
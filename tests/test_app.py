@@ -0,0 +1,105 @@
+"""Routes through the Flask test client."""
+import json
+import time
+
+from compositions import Ingredient, scale_ingredients
+
+
+def _profiles(index, count):
+    profiles = []
+    for record in index.records[:count]:
+        profiles.append({'origin': record.origin, 'temperature': str(record.get('Optimal Growth Temperature (°C)')),
+                         'ph': str(record.get('Optimal Growth pH')), 'aerobicity': record.aerobicity,
+                         'morphology': record.morphology, 'gram': record.gram})
+    return profiles + [{}]
+
+
+def test_unknown_batch_streams_one_ndjson_line_per_isolate(bacdoc, client):
+    index = bacdoc.database.snapshot
+    profiles = _profiles(index, 6)
+    response = client.post('/unknown_batch', json={'profiles': profiles, 'volume': 250, 'n': 3}, buffered=False)
+    assert response.mimetype == 'application/x-ndjson'
+    chunks = [chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk for chunk in response.response]
+    response.close()
+    # Each isolate is its own chunk, so clients see it as soon as it is scored
+    assert len(chunks) == len(profiles)
+    for i, (chunk, profile) in enumerate(zip(chunks, profiles)):
+        assert chunk.endswith('\n') and chunk.count('\n') == 1
+        result = json.loads(chunk)
+        assert result['index'] == i
+        expected = bacdoc.get_closest_matches_extended(*(profile.get(f) for f in bacdoc.PROFILE_FIELDS), n=3,
+                                                       index=index)
+        assert result['matches'] == [row.get('Organism', 'Unknown') for row in expected]
+        if result['success']:
+            assert result['data']['volume'] == 250
+
+
+def test_unknown_batch_rejects_malformed_profiles(client):
+    for body in ({}, {'profiles': 'soil'}, {'profiles': [{'origin': 'soil'}, 3]}):
+        result = client.post('/unknown_batch', json=body).get_json()
+        assert result == {"success": False, "error": "'profiles' must be a list of phenotype objects."}
+
+
+def test_bill_of_materials_route_reports_unresolved_orders(bacdoc, client):
+    record = bacdoc.database.snapshot.records[0]
+    orders = [{'organism': record.name, 'volume': 500}, {'organism': 'Notarealus organismus'}]
+    bom = client.post('/bill_of_materials', json={'orders': orders}).get_json()['data']
+    assert bom['unresolved'] == [{'order': 1, 'organism': 'Notarealus organismus'}]
+    expected = bacdoc.database.snapshot.bill_of_materials([(record, 'optimal', 500.0)])
+    assert bom['totals'] == expected['totals']
+    sheet = client.post('/bill_of_materials', json={'orders': orders, 'format': 'csv'})
+    assert sheet.mimetype == 'text/csv'
+    lines = sheet.get_data(as_text=True).splitlines()
+    assert lines[0] == 'section,component,amount,unit,orders'
+    assert lines[-1] == 'unresolved,Notarealus organismus,,,'
+    assert sum(line.startswith('total,') for line in lines) == len(expected['totals'])
+
+
+def _rebuild_verbose(bacdoc, data, volume):
+    """A compact response scaled to volume the way index.html does it, in the verbose layout."""
+    data = dict(data)
+    assert data.pop('format') == 'compact' and data.pop('format_version') == bacdoc.COMPACT_FORMAT_VERSION
+    if 'sources' in data:
+        sources = data.pop('sources')
+        components = {
+            name: [(sources[s]['organism'], sources[s]['media'], sources[s]['color'],
+                    Ingredient(name, amount, unit, scalable)) for s, amount, unit, scalable in entries]
+            for name, entries in data['media_composition']
+        }
+        data['media_composition'], data['component_sources'] = bacdoc.scale_merged(components, volume)
+        return data
+    for key in ('media_composition', 'optimal_media_composition', 'differential_media_composition'):
+        if key in data:
+            data[key] = scale_ingredients([Ingredient(*row) for row in data[key]], volume)
+    return data
+
+
+def _post_both(client, path, body):
+    verbose = client.post(path, json=body).get_json()
+    compact = client.post(path, json=dict(body, format='compact')).get_json()
+    assert verbose['success'] and compact['success']
+    return verbose['data'], compact['data']
+
+
+def test_compact_responses_rebuild_the_verbose_ones(bacdoc, client):
+    index = bacdoc.database.snapshot
+    volume = 333.3
+    for record in index.records[:10]:
+        for query in (record.name, f'how to grow {record.name}', f'isolate {record.name}'):
+            verbose, compact = _post_both(client, '/get_organism_info', {'organism_name': query, 'volume': volume})
+            assert _rebuild_verbose(bacdoc, compact, volume) == verbose
+    for profile in _profiles(index, 10)[:-1]:
+        body = dict(profile, volume=volume)
+        verbose, compact = client.post('/unknown_result_ajax', json=body).get_json(), \
+            client.post('/unknown_result_ajax', json=dict(body, format='compact')).get_json()
+        assert verbose['success'] == compact['success']
+        if verbose['success']:
+            assert _rebuild_verbose(bacdoc, compact['data'], volume) == verbose['data']
+    # The similarity graph is built in the background on the first request
+    deadline = time.monotonic() + 60
+    while client.post('/similar_organisms', json={'organism_name': index.records[0].name}).get_json().get('pending'):
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+    for record in index.records[:10]:
+        verbose, compact = _post_both(client, '/similar_organisms', {'organism_name': record.name, 'volume': volume})
+        assert _rebuild_verbose(bacdoc, compact, volume) == verbose
@@ -0,0 +1,66 @@
+"""The pooled ASGI server around the Flask app."""
+import asyncio
+import json
+import threading
+
+import asgi
+
+
+def _scope(path, cookie, method='POST'):
+    return {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+        'query_string': b'', 'root_path': '', 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234),
+        'headers': [(b'content-type', b'application/json'), (b'cookie', cookie.encode('latin-1'))],
+    }
+
+
+def test_batch_lines_stream_before_the_batch_finishes(bacdoc, client, index, monkeypatch):
+    profiles = [{'origin': r.origin, 'temperature': '30', 'ph': '7', 'gram': r.gram} for r in index.records[:4]]
+    last_scored = threading.Event()
+    release = threading.Event()
+    batch = bacdoc.get_closest_matches_batch
+
+    def gated(profiles, **kwargs):
+        for i, rows in enumerate(batch(profiles, **kwargs)):
+            if i == len(profiles) - 1:
+                assert release.wait(10)
+                last_scored.set()
+            yield rows
+
+    monkeypatch.setattr(bacdoc, 'get_closest_matches_batch', gated)
+    cookie = f"session={client.get_cookie('session').value}"
+    app = asgi.create_app(light_workers=1, heavy_workers=1)
+    body = json.dumps({'profiles': profiles}).encode('utf-8')
+
+    async def scenario():
+        messages = asyncio.Queue()
+        request = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+        async def receive():
+            return request.pop() if request else {'type': 'http.disconnect'}
+
+        request_task = asyncio.create_task(app(_scope('/unknown_batch', cookie), receive, messages.put))
+        start = await asyncio.wait_for(messages.get(), 10)
+        assert start['type'] == 'http.response.start' and start['status'] == 200
+        first = await asyncio.wait_for(messages.get(), 10)
+        assert not last_scored.is_set()
+        assert json.loads(first['body'].decode('utf-8').splitlines()[0])['index'] == 0
+
+        release.set()
+        received = first['body']
+        while True:
+            message = await asyncio.wait_for(messages.get(), 10)
+            received += message['body']
+            if not message.get('more_body'):
+                break
+        await request_task
+        return received
+
+    try:
+        received = asyncio.run(scenario())
+    finally:
+        release.set()
+        app.light.shutdown()
+        app.heavy.shutdown()
+    lines = received.decode('utf-8').splitlines()
+    assert [json.loads(line)['index'] for line in lines] == list(range(len(profiles)))
@@ -0,0 +1,20 @@
+"""Offline media planning from CSV input."""
+import io
+
+import bacdoc_cli
+
+
+def test_plan_reports_blank_rows_instead_of_scoring_them(index, tmp_path):
+    name = index.records[0].name
+    path = tmp_path / 'orders.csv'
+    path.write_text(f"organism,temperature,ph,volume\n{name},,,200\n,,,\n,37,7,\n", encoding='utf-8')
+    results = list(bacdoc_cli.plan(bacdoc_cli.read_rows(str(path))))
+    assert [result['row'] for result in results] == [0, 1, 2]
+    assert results[0]['success'] and results[0]['organism'] == name and results[0]['volume'] == 200
+    assert results[1] == {"row": 1, "success": False, "error": "Empty row."}
+    assert 'matches' in results[2]
+
+    out = io.StringIO()
+    bacdoc_cli.write_csv(results, out)
+    blank = [line for line in out.getvalue().splitlines() if line.startswith('1,')]
+    assert blank == ['1,,,,,,,,Empty row.']
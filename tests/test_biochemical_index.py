@@ -0,0 +1,66 @@
+"""Biochemical bitset counts against counting test by test."""
+import random
+
+from biochemical_index import BiochemicalIndex, parse_observations, parse_test
+
+
+def _brute_compare(test_lists, vocabulary, observations):
+    """(agreeing, contradicting, untested, contradicted names) per organism, test by test."""
+    counts = []
+    for tests in test_lists:
+        recorded = {}
+        for text in tests:
+            test = parse_test(text)
+            if test is not None:
+                name, outcome = test
+                recorded[name] = outcome if recorded.get(name, outcome) == outcome else None
+        agreeing = contradicting = untested = 0
+        contradicted = []
+        for name, outcome in observations.items():
+            if outcome is None or name not in vocabulary:
+                continue
+            if recorded.get(name) is None:
+                untested += 1
+            elif recorded[name] == outcome:
+                agreeing += 1
+            else:
+                contradicting += 1
+                contradicted.append(name)
+        counts.append((agreeing, contradicting, untested, sorted(contradicted)))
+    return counts
+
+
+def _check_bitsets(biochemical, test_lists, observations):
+    positive, known, unrecognized = biochemical.encode(observations)
+    assert sorted(unrecognized) == sorted(name for name in observations if name not in biochemical.lookup)
+    agreeing, contradicting, untested = biochemical.compare(positive, known)
+    distances = biochemical.distances(positive, known)
+    for row, expected in enumerate(_brute_compare(test_lists, biochemical.lookup, observations)):
+        assert (agreeing[row], contradicting[row], untested[row]) == expected[:3], (row, observations)
+        assert distances[row] == 10 * expected[1] + expected[2]
+        assert sorted(biochemical.contradictions(row, positive, known)) == expected[3]
+
+
+def test_biochemical_bitsets_count_like_brute_force(index):
+    rng = random.Random(4)
+    test_lists = [record.tests for record in index.records]
+    vocabulary = index.biochemical.vocabulary
+    for _ in range(100):
+        tests = rng.choice([tests for tests in test_lists if tests] or [[]])
+        results = [rng.choice([text, text + ' negative', text + ' variable']) for text in tests]
+        results += [f"{rng.choice(vocabulary)} {rng.choice(['positive', 'negative'])}" for _ in range(3)]
+        results.append('Made-up test positive')
+        _check_bitsets(index.biochemical, test_lists, parse_observations(results))
+
+
+def test_biochemical_bitsets_across_words():
+    # Enough test names for several 64-bit words, with repeated and conflicting entries
+    rng = random.Random(5)
+    names = [f"test {i}" for i in range(150)]
+    outcomes = ['positive', 'negative', 'variable', '']
+    test_lists = [[f"{rng.choice(names)} {rng.choice(outcomes)}".strip() for _ in range(rng.randint(0, 40))]
+                  for _ in range(60)]
+    biochemical = BiochemicalIndex(test_lists)
+    for _ in range(50):
+        observations = {rng.choice(names + ['test 999']): rng.choice([True, False, None]) for _ in range(30)}
+        _check_bitsets(biochemical, test_lists, observations)
@@ -0,0 +1,44 @@
+"""Parsed and rescaled media compositions against the documented unit conversions."""
+from compositions import Ingredient, parse_ingredients, scale_ingredients
+
+COMPOSITION = ('Peptone 10 g; Yeast extract 500 mg; Glycerol 1 ml; Broth 0.1 l; NaCl 0.5%; Agar 15; '
+               'Distilled water 100 ml; pH 7.2; with selective antibiotics')
+
+
+def test_parse_normalizes_units():
+    assert parse_ingredients(COMPOSITION) == (
+        Ingredient('peptone', 10.0, 'g', True),
+        Ingredient('yeast extract', 0.5, 'g', True),  # mg → g
+        Ingredient('glycerol', 1.0, 'ml', True),
+        Ingredient('broth', 0.1, 'l', True),
+        Ingredient('nacl', 0.5, '%', False),
+        Ingredient('agar', 15.0, 'g', False),  # no written unit: grams, not scaled
+        Ingredient('with selective antibiotics', None, 'supplement', False),
+    )
+    assert parse_ingredients('Tryptone: 1.5g, Tryptone 2 g') == (Ingredient('tryptone', 2.0, 'g', True),)
+    for missing in (None, float('nan'), '', '  ', 'Unknown'):
+        assert parse_ingredients(missing) == ()
+
+
+def test_scaling_multiplies_written_units_only():
+    scaled = scale_ingredients(parse_ingredients(COMPOSITION), 250)
+    assert scaled == {
+        'peptone': {'amount': 25.0, 'unit': 'g'},
+        'yeast extract': {'amount': 1.25, 'unit': 'g'},
+        'glycerol': {'amount': 2.5, 'unit': 'ml'},
+        'broth': {'amount': 0.25, 'unit': 'l'},
+        'nacl': {'amount': 0.5, 'unit': '%'},
+        'agar': {'amount': 15.0, 'unit': 'g'},
+        'with selective antibiotics': {'amount': None, 'unit': 'supplement'},
+    }
+    # Amounts are never rounded through formatted strings
+    assert scale_ingredients(parse_ingredients('Cysteine 3 mg'), 33)['cysteine']['amount'] == 0.003 * 33 / 100
+
+
+def test_cached_compositions_equal_direct_scaling(index):
+    for record in index.records[:100]:
+        for kind in ('optimal', 'differential'):
+            for volume in (10, 100, 333.3):
+                expected = scale_ingredients(record.ingredients(kind), volume)
+                assert index.composition(record, kind, volume) == expected
+                assert index.composition(record, kind, volume) is index.composition(record, kind, volume)
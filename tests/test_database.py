@@ -0,0 +1,67 @@
+"""Hot reload: atomic snapshot swaps, last-good fallback, and caches keyed on the version."""
+import os
+import shutil
+
+from conftest import DATABASE
+from database import Database
+
+
+def _edit(path, text):
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        f.write(text)
+    # Make the change visible to the mtime/size check even within one clock tick
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_reload_swaps_snapshot_and_keeps_last_good(bacdoc, tmp_path):
+    path = str(tmp_path / 'organisms.csv')
+    shutil.copy(DATABASE, path)
+    database = Database(path, lambda p: bacdoc.build_index(p, use_snapshot=False), bacdoc.validate_index)
+    assert database.load()
+    before = database.snapshot
+    assert not database.refresh()
+
+    _edit(path, '"Newus organismus",\n')
+    assert database.refresh()
+    after = database.snapshot
+    # A request holding the old snapshot keeps a consistent index
+    assert len(before) + 1 == len(after) and before.version != after.version
+    assert after.lookup('Newus organismus') is not None and before.lookup('Newus organismus') is None
+    assert after.composition_cache_info().currsize == 0
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('Name,Media\nfoo,bar\n')
+    assert not database.refresh()
+    assert database.snapshot is after and database.last_error is not None
+    assert not database.refresh()  # the broken file is not rebuilt every tick
+
+
+def test_caches_revalidate_after_reload(bacdoc, client, tmp_path):
+    path = str(tmp_path / 'Centraldatabase.csv')
+    shutil.copy(DATABASE, path)
+    _edit(path, '"Escherichia newus",\n')
+
+    first = client.get('/autocomplete', query_string={'q': 'Esch'})
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and 'no-cache' in first.headers['Cache-Control']
+    assert client.get('/autocomplete', query_string={'q': 'Esch'},
+                      headers={'If-None-Match': etag}).status_code == 304
+
+    profile = {'origin': 'soil', 'temperature': '30', 'ph': '7', 'aerobicity': 'aerobe', 'morphology': 'rod',
+               'gram': 'gram positive'}
+    client.post('/unknown_result_ajax', json=profile)
+    hits = bacdoc.unknown_results.hits
+    client.post('/unknown_result_ajax', json=dict(profile, volume=500))
+    assert bacdoc.unknown_results.hits == hits + 1
+
+    assert bacdoc.database.use(path)
+    try:
+        reloaded = client.get('/autocomplete', query_string={'q': 'Esch'}, headers={'If-None-Match': etag})
+        assert reloaded.status_code == 200 and reloaded.headers['ETag'] != etag
+        assert 'Escherichia newus' in reloaded.get_json()['suggestions']
+        misses = bacdoc.unknown_results.misses
+        client.post('/unknown_result_ajax', json=profile)
+        assert bacdoc.unknown_results.misses == misses + 1
+    finally:
+        bacdoc.database.use(DATABASE)
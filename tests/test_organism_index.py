@@ -0,0 +1,34 @@
+"""Reagent bill of materials against summing order by order."""
+import random
+from collections import Counter
+
+import pytest
+
+
+def _brute_bill(orders):
+    totals, fixed, supplements = {}, Counter(), Counter()
+    for record, kind, volume in orders:
+        for item in record.ingredients(kind):
+            if item.amount is None:
+                supplements[item.name] += 1
+            elif item.scalable:
+                amount, unit = item.amount * volume / 100, item.unit
+                if unit == 'l':
+                    amount, unit = amount * 1000, 'ml'
+                totals[(item.name, unit)] = totals.get((item.name, unit), 0.0) + amount
+            else:
+                fixed[(item.name, item.amount, item.unit)] += 1
+    return totals, fixed, supplements
+
+
+def test_bill_of_materials_equals_order_by_order_sums(index):
+    rng = random.Random(7)
+    orders = [(rng.choice(index.records), rng.choice(['optimal', 'differential']), rng.choice([10, 100, 250, 1000]))
+              for _ in range(300)]
+    bom = index.bill_of_materials(orders)
+    totals, fixed, supplements = _brute_bill(orders)
+    assert bom['orders'] == len(orders)
+    got = {(item['component'], item['unit']): item['amount'] for item in bom['totals']}
+    assert got == pytest.approx({key: amount for key, amount in totals.items() if amount})
+    assert {(item['component'], item['amount'], item['unit']): item['orders'] for item in bom['fixed_amounts']} == fixed
+    assert {item['component']: item['orders'] for item in bom['supplements']} == supplements
@@ -0,0 +1,119 @@
+"""Vectorized Equation 2 scoring against the original per-row loop, with and without the pre-filter."""
+import random
+import re
+
+import numpy as np
+import pandas as pd
+
+from conftest import DATABASE, PH_COLUMN, TEMP_COLUMN, random_queries
+from phenotype_matrix import ValueIndex, _padded_values, parse_query_number, top_n
+from scoring_profiles import DEFAULT_PROFILE
+
+
+def _number_list(raw_value):
+    if not isinstance(raw_value, str) or not raw_value.strip():
+        return None
+    numbers = []
+    for value in raw_value.split(','):
+        if value.strip():
+            try:
+                numbers.append(float(re.sub(r'[^\d\.]', '', value.strip())))
+            except ValueError:
+                pass
+    return numbers or None
+
+
+def _clean(value):
+    return value.strip().lower() if isinstance(value, str) else ''
+
+
+def _query_number(value):
+    try:
+        return float(re.sub(r'[^\d\.]', '', str(value)))
+    except ValueError:
+        return None
+
+
+def reference_distance(row, origin, temp_input, ph_input, aerobicity, morphology, gramnature):
+    """Equation 2 for one CSV row, term by term as the original per-row iterrows loop added it."""
+    temp_val, ph_val = _query_number(temp_input), _query_number(ph_input)
+    temps, phs = _number_list(row.get(TEMP_COLUMN, '')), _number_list(row.get(PH_COLUMN, ''))
+    origin_csv = _clean(str(row.get('Origin/Source', '')))
+    aerobicity_raw = row.get('Optimal Growth Aerobic Conditions', '')
+    aerobicity_csv = _clean(aerobicity_raw.split(',')[0]) if isinstance(aerobicity_raw, str) else ''
+    morphology_csv = _clean(str(row.get('Morphology', '')))
+    gram_csv = _clean(str(row.get('Gram Nature', '')))
+
+    d_temp = min(abs(temp_val - t) for t in temps) * 5 if temp_val is not None and temps else 20 * 5
+    d_ph = min(abs(ph_val - p) for p in phs) * 5 if ph_val is not None and phs else 10 * 5
+    if _clean(origin) and _clean(origin) in origin_csv:
+        origin_score = 0
+    elif _clean(origin):
+        origin_score = 5 * 2
+    else:
+        origin_score = 1 * 2
+    scores = [d_temp, d_ph, origin_score]
+    for query, csv_value, weight, penalty in ((aerobicity, aerobicity_csv, 4, 4), (morphology, morphology_csv, 2, 3),
+                                              (gramnature, gram_csv, 2, 3)):
+        if _clean(query) == csv_value and csv_value:
+            scores.append(0)
+        elif csv_value:
+            scores.append(weight)
+        else:
+            scores.append(penalty * weight)
+    dist = scores[0]
+    for score in scores[1:]:
+        dist = dist + score
+    return dist
+
+
+def test_vectorized_scoring_equals_per_row_loop(index):
+    rows = pd.read_csv(DATABASE)
+    rows.columns = rows.columns.str.strip()
+    rows = rows.to_dict('records')
+    queries = random_queries(index, 60)
+    dist = index.matrix.batch_distances(queries, DEFAULT_PROFILE)
+    for query, got in zip(queries, dist):
+        expected = np.array([reference_distance(row, *query) for row in rows])
+        assert got.tolist() == expected.tolist(), query
+        # The original sorted (distance, row) pairs stably
+        assert top_n(got, 5).tolist() == sorted(range(len(rows)), key=expected.__getitem__)[:5], query
+
+
+def test_prefilter_keeps_distances_bit_for_bit(bacdoc, index):
+    unfiltered = index.matrix.batch_distances(random_queries(index, 80, seed=1), bacdoc.SCORING_PROFILE)
+    temps = [record.temp_values for record in index.records]
+    phs = [record.ph_values for record in index.records]
+    for query, full in zip(random_queries(index, 80, seed=1), unfiltered):
+        for temp_window, ph_window in ((2, None), (None, 0.5), (5, 1), (0, 0)):
+            _, dist = bacdoc.score_profile(*query, index=index, prefilter=(temp_window, ph_window))
+            keep = np.ones(len(index), dtype=bool)
+            for window, value, lists in ((temp_window, query[1], temps), (ph_window, query[2], phs)):
+                value = parse_query_number(value)
+                if window is not None and value is not None:
+                    keep &= [not values or any(abs(v - value) <= window for v in values) for values in lists]
+            assert np.isfinite(dist).tolist() == keep.tolist(), query
+            assert dist[keep].tolist() == full[keep].tolist(), query
+            assert top_n(dist, 5).tolist() == [p for p in top_n(full, len(full)).tolist() if keep[p]][:5]
+
+
+def test_value_index_equals_scanning_every_value():
+    rng = random.Random(9)
+    for _ in range(200):
+        lists = [None if rng.random() < 0.2 else sorted(rng.sample([x / 2 for x in range(120)], rng.randint(1, 5)))
+                 for _ in range(rng.randint(1, 60))]
+        matrix, present = _padded_values(lists)
+        values = ValueIndex(matrix, present)
+        queries = np.array([rng.choice([np.nan, rng.uniform(-5, 70), 7.0, 0.0, 59.5]) for _ in range(7)])
+        with np.errstate(invalid='ignore'):
+            expected = np.abs(queries[:, None, None] - matrix[None]).min(axis=2)
+        penalised = ~(~np.isnan(queries)[:, None] & present[None, :])
+        expected[penalised] = 0
+        nearest, got_penalised = values.nearest(queries)
+        assert np.array_equal(got_penalised, penalised) and np.array_equal(nearest, expected)
+        rows = np.array(sorted(rng.sample(range(len(lists)), rng.randint(0, len(lists)))), dtype=np.intp)
+        nearest, got_penalised = values.nearest(queries, rows)
+        assert np.array_equal(nearest, expected[:, rows]) and np.array_equal(got_penalised, penalised[:, rows])
+        value, radius = rng.uniform(0, 60), rng.choice([0, 1, 5])
+        assert values.within(value, radius).tolist() == \
+            [bool(v) and any(value - radius <= x <= value + radius for x in v) for v in lists]
@@ -0,0 +1,28 @@
+"""Name search against difflib."""
+import difflib
+import random
+
+
+def _typo(rng, name):
+    letters = list(name.lower())
+    for _ in range(rng.randint(0, 6)):
+        at = rng.randrange(len(letters) + 1)
+        edit = rng.randrange(3)
+        if edit == 0 and letters:
+            letters.pop(min(at, len(letters) - 1))
+        elif edit == 1:
+            letters.insert(at, rng.choice('abcdefghijklmnopqrstuvwxyz .'))
+        elif letters:
+            letters[min(at, len(letters) - 1)] = rng.choice('abcdefghijklmnopqrstuvwxyz .')
+    word = ''.join(letters)
+    return word[:rng.randint(1, max(1, len(word)))] if rng.random() < 0.3 else word
+
+
+def test_close_matches_equal_difflib(index):
+    names = list(dict.fromkeys(record.name for record in index.records))
+    rng = random.Random(3)
+    for _ in range(100):
+        word = _typo(rng, rng.choice(names))
+        for cutoff in (0.6, 0.3):
+            assert index.search.close_matches(word, n=5, cutoff=cutoff) == \
+                difflib.get_close_matches(word, names, n=5, cutoff=cutoff), (word, cutoff)
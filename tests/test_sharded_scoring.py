@@ -0,0 +1,54 @@
+"""Sharded top-n against in-process scoring."""
+import threading
+
+import sharded_scoring
+from conftest import random_queries
+from phenotype_matrix import top_n
+from sharded_scoring import ShardedScorer
+
+
+def test_sharded_top_n_equals_in_process(bacdoc, index):
+    queries = random_queries(index, 40, seed=2)
+    scorer = ShardedScorer(2, 0)
+    try:
+        for prefilter in ((None, None), (3, None), (2, 0.5)):
+            results = scorer.top_n(index, queries, 5, bacdoc.SCORING_PROFILE, prefilter)
+            for query, got in zip(queries, results):
+                _, dist = bacdoc.score_profile(*query, index=index, prefilter=prefilter)
+                assert got.tolist() == top_n(dist, 5).tolist(), (query, prefilter)
+    finally:
+        scorer.close()
+
+
+def test_requests_score_in_process_while_workers_start(bacdoc, index, monkeypatch):
+    queries = random_queries(index, 10, seed=22)
+    expected = [top_n(bacdoc.score_profile(*query, index=index)[1], 5).tolist() for query in queries]
+    starting, release = threading.Event(), threading.Event()
+
+    class GatedShards(sharded_scoring._Shards):
+        def __init__(self, *args):
+            starting.set()
+            assert release.wait(60)
+            super().__init__(*args)
+
+    monkeypatch.setattr(sharded_scoring, '_Shards', GatedShards)
+    scorer = ShardedScorer(2, 0)
+    results = {}
+    def first_request():
+        results['first'] = scorer.top_n(index, queries, 5, bacdoc.SCORING_PROFILE)
+
+    first = threading.Thread(target=first_request)
+    first.start()
+    try:
+        assert starting.wait(60)
+        # Answered without waiting for the workers the first request is starting
+        assert [got.tolist() for got in scorer.top_n(index, queries, 5, bacdoc.SCORING_PROFILE)] == expected
+        assert scorer._shards is None
+    finally:
+        release.set()
+        first.join()
+    try:
+        assert [got.tolist() for got in results['first']] == expected
+        assert scorer._shards is not None and scorer._shards.users == 0
+    finally:
+        scorer.close()
@@ -0,0 +1,83 @@
+"""The similarity graph against brute force, and incremental updates against full builds."""
+import csv
+import random
+
+import numpy as np
+
+from conftest import DATABASE, TEMP_COLUMN
+from evaluation import holdout_queries, label_codes
+from phenotype_matrix import top_n
+from similarity_graph import SimilarityGraph
+
+
+def _same_graph(a, b):
+    for name in ('indptr', 'indices', 'distances', 'valid', 'media_indptr', 'media_slots', 'media_items'):
+        assert np.array_equal(getattr(a, name), getattr(b, name)), name
+    assert (a.version, a.k, a.profile) == (b.version, b.k, b.profile)
+
+
+def _check_graph(bacdoc, graph, index):
+    queries, labels = holdout_queries(index), label_codes(index)
+    for position in range(len(index)):
+        dist = index.matrix.distances(*queries[position], scoring=bacdoc.SCORING_PROFILE)
+        dist[labels == labels[position]] = np.inf
+        best = top_n(dist, bacdoc.SIMILARITY_K)
+        neighbours, distances = graph.neighbours(position)
+        assert neighbours.tolist() == best.tolist() and distances.tolist() == dist[best].tolist(), position
+        rows, components = bacdoc.graph_compositions(graph, position, index)
+        valid = [index.records[p] for p in best if bacdoc.is_valid_media(index.records[p])]
+        assert rows == valid
+        assert components == bacdoc.collect_compositions(valid)
+        assert list(components) == list(bacdoc.collect_compositions(valid))
+
+
+def _build_graph(bacdoc, index):
+    return SimilarityGraph.build(index, bacdoc.SIMILARITY_K, bacdoc.SCORING_PROFILE, bacdoc.is_valid_media,
+                                 bacdoc.hybrid_ingredients)
+
+
+def test_similarity_graph_equals_brute_force(bacdoc, index):
+    _check_graph(bacdoc, _build_graph(bacdoc, index), index)
+
+
+def test_incremental_graph_equals_full_build(bacdoc, index, tmp_path):
+    with open(DATABASE, newline='', encoding='utf-8') as f:
+        header, *body = list(csv.reader(f))
+    rng = random.Random(6)
+    temp, composition = header.index(TEMP_COLUMN), header.index('Optimal Media Composition (per 100ml)')
+    for row in rng.sample(range(len(body)), 3):
+        body[row][temp] = str(rng.randint(10, 60))
+    body[rng.randrange(len(body))][composition] = 'Peptone 1 g, NaCl 0.5 g'
+    del body[rng.randrange(len(body))]
+    body.insert(rng.randrange(len(body)), list(body[7]))
+    body.append(list(body[3]))
+    body[-1][0] = 'Newus organismus'
+    edited_path = tmp_path / 'edited.csv'
+    with open(edited_path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows([header] + body)
+    edited = bacdoc.build_index(str(edited_path), use_snapshot=False)
+
+    graph = _build_graph(bacdoc, index)
+    updated = graph.update(index, edited, bacdoc.SIMILARITY_K, bacdoc.SCORING_PROFILE, bacdoc.is_valid_media,
+                           bacdoc.hybrid_ingredients)
+    assert updated is not None
+    full = _build_graph(bacdoc, edited)
+    _same_graph(updated, full)
+    _check_graph(bacdoc, updated, edited)
+
+    path = full.save(str(tmp_path / 'edited.graph.npz'))
+    _same_graph(SimilarityGraph.load(path, edited.version, bacdoc.SIMILARITY_K, bacdoc.SCORING_PROFILE), full)
+    assert SimilarityGraph.load(path, index.version, bacdoc.SIMILARITY_K, bacdoc.SCORING_PROFILE) is None
+
+
+def test_graph_update_refuses_too_many_changes(bacdoc, index, tmp_path):
+    with open(DATABASE, newline='', encoding='utf-8') as f:
+        header, *body = list(csv.reader(f))
+    body[0][header.index(TEMP_COLUMN)] = '99'
+    edited_path = tmp_path / 'edited.csv'
+    with open(edited_path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows([header] + body)
+    edited = bacdoc.build_index(str(edited_path), use_snapshot=False)
+    graph = _build_graph(bacdoc, index)
+    assert graph.update(index, edited, bacdoc.SIMILARITY_K, bacdoc.SCORING_PROFILE, bacdoc.is_valid_media,
+                        bacdoc.hybrid_ingredients, max_changed=0) is None
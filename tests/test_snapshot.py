@@ -0,0 +1,41 @@
+"""Precompiled snapshots against the index parsed from the CSV."""
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+
+from conftest import DATABASE, ROOT, random_queries
+from snapshot import read_snapshot, snapshot_path, write_snapshot
+
+
+def test_snapshot_round_trip(index, tmp_path):
+    directory = write_snapshot(index, str(tmp_path / 'organisms.snapshot'))
+    loaded = read_snapshot(directory, index.version)
+    assert loaded is not None and loaded.version == index.version and loaded.columns == index.columns
+    for a, b in zip(index.records, loaded.records):
+        assert (a.name, a.temp_values, a.ph_values, a.origin, a.aerobicity, a.morphology, a.gram, a.tests) == \
+            (b.name, b.temp_values, b.ph_values, b.origin, b.aerobicity, b.morphology, b.gram, b.tests)
+        assert a.optimal_ingredients == b.optimal_ingredients
+        assert a.differential_ingredients == b.differential_ingredients
+        assert {k: v for k, v in a.raw.items() if isinstance(v, str)} == {k: v for k, v in b.raw.items() if v}
+    queries = random_queries(index, 50, seed=8)
+    assert np.array_equal(index.matrix.batch_distances(queries), loaded.matrix.batch_distances(queries))
+    assert loaded.biochemical.vocabulary == index.biochemical.vocabulary
+    assert np.array_equal(loaded.biochemical.known, index.biochemical.known)
+    assert np.array_equal(loaded.biochemical.positive, index.biochemical.positive)
+    assert read_snapshot(directory, 'other') is None
+    assert read_snapshot(str(tmp_path / 'missing'), index.version) is None
+
+
+def test_fresh_snapshot_loads_without_pandas(index, tmp_path):
+    path = str(tmp_path / 'Centraldatabase.csv')
+    shutil.copy(DATABASE, path)
+    write_snapshot(index, snapshot_path(path))
+    script = ("import sys; import PHytonAILLM as b; "
+              "assert len(b.database.snapshot) == %d, b.database.last_error; "
+              "assert 'pandas' not in sys.modules" % len(index))
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop('BACDOC_SQLITE_STORE', None)
+    subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env, check=True)
@@ -0,0 +1,45 @@
+"""The SQLite parse cache against the index parsed from the CSV."""
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from conftest import DATABASE, random_queries
+from sqlite_store import read_meta, read_store, write_store
+
+
+def test_store_round_trip(index, tmp_path):
+    path = write_store(index, str(tmp_path / 'organisms.sqlite'))
+    loaded = read_store(path, index.version)
+    assert loaded is not None and loaded.version == index.version and loaded.columns == index.columns
+    for a, b in zip(index.records, loaded.records):
+        assert (a.name, a.temp_values, a.ph_values, a.origin, a.aerobicity, a.morphology, a.gram, a.tests) == \
+            (b.name, b.temp_values, b.ph_values, b.origin, b.aerobicity, b.morphology, b.gram, b.tests)
+        assert a.optimal_ingredients == b.optimal_ingredients
+        assert a.differential_ingredients == b.differential_ingredients
+    queries = random_queries(index, 50, seed=20)
+    assert np.array_equal(index.matrix.batch_distances(queries), loaded.matrix.batch_distances(queries))
+    assert read_store(path, 'other') is None
+    assert read_store(str(tmp_path / 'missing.sqlite'), index.version) is None
+
+
+def test_store_only_takes_the_validated_production_csv(bacdoc, index, tmp_path, monkeypatch):
+    store = str(tmp_path / 'organisms.sqlite')
+    production = str(tmp_path / 'Centraldatabase.csv')
+    shutil.copy(DATABASE, production)
+    monkeypatch.setattr(bacdoc, 'SQLITE_STORE', store)
+    monkeypatch.setattr(bacdoc, 'DATABASE_FILE', production)
+    # Any other CSV is parsed without importing it
+    bacdoc.build_index(DATABASE)
+    assert not os.path.exists(store)
+    bacdoc.build_index(production)
+    assert read_meta(store)['version'] == index.version
+    # A CSV the app rejects (here: no organisms) leaves the last good import in place
+    with open(DATABASE, encoding='utf-8') as f:
+        header = f.readline()
+    with open(production, 'w', encoding='utf-8') as f:
+        f.write(header)
+    with pytest.raises(ValueError):
+        bacdoc.build_index(production)
+    assert read_meta(store)['version'] == index.version